@@ -0,0 +1,245 @@
+"""
+Load test the API endpoints the web UI and the browser extension hit.
+
+Runs the Flask app on a threaded server in a separate process, seeded with a
+large queue, history and log buffer, with the download worker paused. Then
+drives it from many concurrent clients for a fixed time:
+
+    pollers   the web UI: /api/status, then the first queue and history page
+              whenever their version changes
+    adders    the browser extension: /api/queue/add with new MD5s
+    loggers   the log tab: /api/logs
+
+Reports p50/p99 latency and requests per second for each endpoint and checks
+them against a latency budget, exiting with status 1 if one is over.
+
+Usage:
+    python bench/bench_api.py [--queue 5000] [--history 5000] [--pollers 8] [--adders 4] [--duration 20]
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Process, Queue
+from pathlib import Path
+from queue import Empty
+
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Milliseconds (p50, p99) each endpoint should stay under at the default load.
+# Clients don't pause, so on a single core this is mostly time spent waiting
+# for the CPU: about 1.5x what one core measures, a single request takes a few ms
+BUDGETS = {
+    "/api/status": (100, 250),
+    "/api/queue": (100, 250),
+    "/api/history": (100, 250),
+    "/api/queue/add": (100, 400),
+    "/api/logs": (75, 250),
+}
+
+def random_md5(rng):
+    return "%032x" % rng.getrandbits(128)
+
+def seed_data(options, rng):
+    """Queue and history in the queue file format, oldest first."""
+    now = datetime.now()
+    queue = [{
+        "md5": random_md5(rng),
+        "source": rng.choice(["browser", "manual"]),
+        "added_at": (now - timedelta(seconds=options.queue - index)).isoformat(),
+        "status": "queued",
+        "subfolder": None,
+        "priority": rng.choice(["low", "normal", "normal", "high"])
+    } for index in range(options.queue)]
+    history = []
+    for index in range(options.history):
+        success = rng.random() < 0.9
+        md5 = random_md5(rng)
+        history.append({
+            "md5": md5,
+            "filename": f"Author {index} - Book {index}.epub",
+            "completed_at": (now - timedelta(minutes=options.history - index)).isoformat(),
+            "success": success,
+            "filepath": f"/download/Author {index} - Book {index}.epub" if success else None,
+            "error": None if success else "All download methods failed",
+            "used_fast_download": rng.random() < 0.3,
+            "subfolder": None,
+            "size": rng.randint(200_000, 20_000_000) if success else None
+        })
+    return {"queue": queue, "processing": [], "history": history}
+
+def serve(options, root, ready_queue):
+    # A throwaway install: the real schema, web files and version, a fresh config folder
+    for name in ("files", "web", "VERSION"):
+        Path(root, name).symlink_to(REPO_ROOT / name)
+    Path(root, "config").mkdir()
+    os.environ["STACKS_PROJECT_ROOT"] = root
+    sys.path.insert(0, str(REPO_ROOT / "src"))
+    from werkzeug.serving import make_server
+    from stacks.config.config import Config
+    from stacks.constants import CONFIG_FILE, LOG_VIEW_LENGTH, QUEUE_FILE
+    from stacks.security.auth import generate_secret_key
+    from stacks.server.webserver import create_app
+
+    # Keep the whole seeded history, and give each client type its own key
+    config = Config(CONFIG_FILE)
+    config.set("queue", "max_history", value=options.history)
+    config.set("api", "key", value=generate_secret_key())
+    config.set("api", "downloader_key", value=generate_secret_key())
+    config.save()
+
+    # Keep the log file and the log view, but not the console
+    sys.stdout = open(os.devnull, "w")
+    app = create_app(str(CONFIG_FILE))
+    # Paused before the queue is seeded, so nothing is downloaded
+    app.stacks_worker.pause()
+    with open(QUEUE_FILE, "w") as f:
+        json.dump(seed_data(options, random.Random(options.seed)), f)
+    app.stacks_queue.load()
+
+    logger = logging.getLogger("bench")
+    for index in range(LOG_VIEW_LENGTH):
+        logger.warning(f"Seeded log line {index} for the log view")
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    ready_queue.put({
+        "port": server.server_port,
+        "key": app.stacks_config.get("api", "key"),
+        "downloader_key": app.stacks_config.get("api", "downloader_key")
+    })
+    server.serve_forever()
+
+class Recorder:
+    """Latencies per endpoint, from every client thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def call(self, session, method, base, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, base + path, timeout=30, **kwargs)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - started
+        endpoint = path.split("?")[0]
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(elapsed)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return response.json() if ok else None
+
+def poller(recorder, base, key, deadline, think):
+    session = requests.Session()
+    session.headers["X-API-Key"] = key
+    queue_version = history_version = None
+    while time.monotonic() < deadline:
+        status = recorder.call(session, "GET", base, "/api/status")
+        if status:
+            if status["queue_version"] != queue_version:
+                queue_version = status["queue_version"]
+                recorder.call(session, "GET", base, "/api/queue?offset=0&limit=50")
+            if status["history_version"] != history_version:
+                history_version = status["history_version"]
+                recorder.call(session, "GET", base, "/api/history?limit=50")
+        time.sleep(think)
+
+def adder(recorder, base, key, deadline, think, seed):
+    session = requests.Session()
+    session.headers["X-API-Key"] = key
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        recorder.call(session, "POST", base, "/api/queue/add", json={"md5": random_md5(rng), "source": "browser"})
+        time.sleep(think)
+
+def log_reader(recorder, base, key, deadline, think):
+    session = requests.Session()
+    session.headers["X-API-Key"] = key
+    while time.monotonic() < deadline:
+        recorder.call(session, "GET", base, "/api/logs")
+        time.sleep(think)
+
+def percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Stacks API")
+    parser.add_argument("--queue", type=int, default=5000, help="Items seeded into the queue")
+    parser.add_argument("--history", type=int, default=5000, help="Entries seeded into the history")
+    parser.add_argument("--pollers", type=int, default=8, help="Web UI clients")
+    parser.add_argument("--adders", type=int, default=4, help="Browser extension clients adding items")
+    parser.add_argument("--loggers", type=int, default=1, help="Clients reading the log view")
+    parser.add_argument("--think-ms", type=float, default=0,
+                        help="Pause between a client's requests (the UI polls every 2000)")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run")
+    parser.add_argument("--seed", type=int, default=1)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        ready_queue = Queue()
+        server = Process(target=serve, args=(options, root, ready_queue), daemon=True)
+        server.start()
+        while True:
+            try:
+                ready = ready_queue.get(timeout=1)
+                break
+            except Empty:
+                if not server.is_alive():
+                    sys.exit("Server failed to start")
+        base = f"http://127.0.0.1:{ready['port']}"
+        print(f"Seeded {options.queue} queued, {options.history} history; "
+              f"{options.pollers} pollers, {options.adders} adders, {options.loggers} log readers "
+              f"for {options.duration:g}s")
+
+        recorder = Recorder()
+        think = options.think_ms / 1000
+        deadline = time.monotonic() + options.duration
+        threads = (
+            [threading.Thread(target=poller, args=(recorder, base, ready["key"], deadline, think))
+             for _ in range(options.pollers)]
+            + [threading.Thread(target=adder, args=(recorder, base, ready["downloader_key"], deadline, think, options.seed + index))
+               for index in range(options.adders)]
+            + [threading.Thread(target=log_reader, args=(recorder, base, ready["key"], deadline, think))
+               for _ in range(options.loggers)]
+        )
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        server.terminate()
+        server.join()
+
+    print(f"{'endpoint':<16} {'requests':>9} {'req/s':>8} {'errors':>7} {'p50':>9} {'p99':>9} {'max':>9}  budget")
+    over = []
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        ordered = sorted(latencies)
+        p50, p99 = percentile(ordered, 50) * 1000, percentile(ordered, 99) * 1000
+        budget = BUDGETS.get(endpoint)
+        verdict = ""
+        if budget:
+            verdict = f"{budget[0]}/{budget[1]} ms"
+            if p50 > budget[0] or p99 > budget[1]:
+                verdict += " OVER"
+                over.append(endpoint)
+        print(f"{endpoint:<16} {len(ordered):>9} {len(ordered) / elapsed:>8.1f} {recorder.errors.get(endpoint, 0):>7} "
+              f"{p50:>7.1f}ms {p99:>7.1f}ms {ordered[-1] * 1000:>7.1f}ms  {verdict}")
+
+    if over:
+        print(f"\nOver budget: {', '.join(over)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark the whole download pipeline against the simulator.
+
+Starts bench/simulator.py in a separate process and downloads every book in
+its library with an unmodified AnnaDownloader (page fetch, fast download or
+mirrors, FlareSolverr, transfer, verify and move into place), with requests
+for the real hosts sent to the simulator by SimulatorAdapter. Reports
+items/hour, bytes/s, time to first byte and per-phase percentiles from each
+download's phase timeline.
+
+Usage:
+    python bench/bench_pipeline.py [--items 20] [--size-kb 2048] [--fast] [--reset-rate 0.1] ...
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+from pathlib import Path
+
+import requests
+
+BENCH_ROOT = Path(__file__).resolve().parent
+
+def run_simulator(options, port_queue):
+    from simulator import start
+    server = start(options)
+    port_queue.put(server.server_port)
+    while True:
+        time.sleep(3600)
+
+def percentile(values, percent):
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+def main():
+    # Keep domain state, cookies and the page cache away from a real install;
+    # set before anything imports stacks.constants (the simulator does)
+    root = tempfile.mkdtemp()
+    Path(root, "VERSION").symlink_to(BENCH_ROOT.parent / "VERSION")
+    os.environ["STACKS_PROJECT_ROOT"] = root
+    sys.path.insert(0, str(BENCH_ROOT))
+    sys.path.insert(0, str(BENCH_ROOT.parent / "src"))
+    from simulator import SimulatorAdapter, add_fault_arguments
+    from stacks.downloader.downloader import AnnaDownloader
+    from stacks.downloader.politeness import POLITENESS
+    from stacks.downloader.timeline import phase, start_timeline, stop_timeline
+    from stacks.server.history_stats import phase_report
+
+    parser = argparse.ArgumentParser(description="Benchmark the download pipeline against a simulated Anna's Archive")
+    parser.add_argument("--fast", action="store_true", help="Use the fast download API instead of mirrors")
+    parser.add_argument("--no-flaresolverr", action="store_true", help="Run without the FlareSolverr stand-in")
+    parser.add_argument("--resume-attempts", type=int, default=3)
+    parser.add_argument("--verbose", action="store_true", help="Show the downloader's log")
+    add_fault_arguments(parser)
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if options.verbose else logging.CRITICAL)
+
+    try:
+        port_queue = Queue()
+        simulator = Process(target=run_simulator, args=(options, port_queue), daemon=True)
+        simulator.start()
+        address = f"127.0.0.1:{port_queue.get()}"
+        items = requests.get(f"http://{address}/_sim/items", timeout=10).json()
+
+        Path(root, "config").mkdir()
+        downloader = AnnaDownloader(
+            output_dir=Path(root) / "download",
+            flaresolverr_url=None if options.no_flaresolverr else f"http://{address}",
+            fast_download_config={"enabled": options.fast, "key": "simulated"},
+            page_cache_ttl=0,
+            status_callback=lambda message: None
+        )
+        adapter = SimulatorAdapter(address)
+        downloader.session.mount("https://", adapter)
+        downloader.session.mount("http://", adapter)
+        # Measure the pipeline, not the politeness spacing
+        POLITENESS.configure(spacing=0, max_per_host=4)
+
+        print(f"Downloading {len(items)} x {options.size_kb} KB via {'fast download' if options.fast else 'mirrors'}")
+        results = []
+        started = time.perf_counter()
+        for item in items:
+            start_timeline()
+            with phase("page"):
+                filename, links = downloader.get_download_links(item["md5"])
+            success, _, filepath = downloader.download(
+                item["md5"], filename=filename, links=links, resume_attempts=options.resume_attempts
+            )
+            results.append({"success": bool(success), "size": item["size"], "timeline": stop_timeline().to_dict()})
+        elapsed = time.perf_counter() - started
+
+        succeeded = [result for result in results if result["success"]]
+        ttfb = [
+            entry["end"] - entry["start"]
+            for result in results for entry in result["timeline"]["phases"] if entry["phase"] == "ttfb"
+        ]
+        received = sum(result["timeline"]["bytes"] for result in results)
+        stats = requests.get(f"http://{address}/_sim/stats", timeout=10).json()
+        simulator.terminate()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"{'downloads':<16} {len(succeeded)}/{len(results)} succeeded in {elapsed:.1f}s")
+    print(f"{'items/hour':<16} {len(succeeded) / elapsed * 3600:.0f}")
+    print(f"{'bytes/s':<16} {sum(result['size'] for result in succeeded) / elapsed / 1024 ** 2:.2f} MB/s completed, "
+          f"{received / elapsed / 1024 ** 2:.2f} MB/s received")
+    print(f"{'ttfb':<16} p50 {percentile(ttfb, 50) * 1000:.0f} ms, p90 {percentile(ttfb, 90) * 1000:.0f} ms, "
+          f"p99 {percentile(ttfb, 99) * 1000:.0f} ms over {len(ttfb)} requests")
+    print(f"{'simulator':<16} {json.dumps(stats)}")
+    print()
+    print(f"{'phase':<14} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, row in phase_report(results)["phases"].items():
+        print(f"{name:<14} {row['count']:>6} {row['p50']:>8.3f}s {row['p90']:>8.3f}s {row['p99']:>8.3f}s {row['max']:>8.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark server startup.
+
+Starts Stacks the way the container does (stacks.main, which runs Gunicorn),
+or a built PEX with --pex, in a throwaway project root, and measures how long
+it takes until /api/health answers and until /api/ready reports the startup
+checks done. Repeats for several cold starts and reports the median.
+
+Usage:
+    python bench/bench_startup.py [--runs 5] [--pex dist/stacks.pex] [--flaresolverr http://10.255.255.1:8191]
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def answers(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+def start_once(options):
+    with tempfile.TemporaryDirectory() as root:
+        # Source layout (src/ tells stacks.main to exec Gunicorn), or just the data for a PEX
+        names = ("files", "web", "VERSION") if options.pex else ("files", "web", "VERSION", "src")
+        for name in names:
+            Path(root, name).symlink_to(REPO_ROOT / name)
+        config = Path(root, "config")
+        config.mkdir()
+        # Health and readiness don't need a login
+        lines = ["login:", "  disable: true"]
+        if options.flaresolverr:
+            lines += ["flaresolverr:", "  enabled: true", f"  url: {options.flaresolverr}"]
+        (config / "config.yaml").write_text("\n".join(lines) + "\n")
+
+        port = free_port()
+        env = dict(
+            os.environ,
+            STACKS_PROJECT_ROOT=root,
+            PYTHONPATH=str(REPO_ROOT / "src"),
+            GUNICORN_CMD_ARGS=f"--bind=127.0.0.1:{port}"
+        )
+        command = [options.pex] if options.pex else [sys.executable, "-m", "stacks.main"]
+        base = f"http://127.0.0.1:{port}"
+
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            command, env=env, cwd=root, start_new_session=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        healthy = ready = None
+        try:
+            while time.perf_counter() - started < options.timeout:
+                if process.poll() is not None:
+                    raise SystemExit(f"Server exited with status {process.returncode}")
+                # Gunicorn accepts connections before its worker has loaded the app, so
+                # a request can wait; the time is taken once the answer is in
+                if healthy is None and answers(base + "/api/health"):
+                    healthy = time.perf_counter() - started
+                if healthy is not None and answers(base + "/api/ready"):
+                    ready = time.perf_counter() - started
+                    break
+                time.sleep(0.01)
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=30)
+        return healthy, ready
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Stacks startup")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--pex", help="Start this PEX instead of the source tree")
+    parser.add_argument("--flaresolverr", help="Enable FlareSolverr at this URL, to see a slow startup check")
+    parser.add_argument("--timeout", type=float, default=120, help="Give up on a run after this many seconds")
+    options = parser.parse_args()
+
+    results = []
+    for run in range(options.runs):
+        healthy, ready = start_once(options)
+        results.append((healthy, ready))
+        print(f"run {run + 1}: health {healthy if healthy is not None else float('nan'):.2f}s, "
+              f"ready {ready if ready is not None else float('nan'):.2f}s")
+
+    health_times = [healthy for healthy, _ in results if healthy is not None]
+    ready_times = [ready for _, ready in results if ready is not None]
+    print()
+    if health_times:
+        print(f"{'health':<8} median {statistics.median(health_times):.2f}s, min {min(health_times):.2f}s")
+    if ready_times:
+        print(f"{'ready':<8} median {statistics.median(ready_times):.2f}s, min {min(ready_times):.2f}s")
+    if len(ready_times) < len(results):
+        print(f"{len(results) - len(ready_times)} run(s) not ready within {options.timeout:g}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark the download write path.
+
+Serves a file from a local HTTP server in a separate process and downloads it
+with the old iter_content loop and with BlockReader at several buffer sizes,
+reporting throughput and the CPU time spent on the client side.
+
+Usage:
+    python bench/bench_transfer.py [--size-mb 512] [--runs 3] [--chunk-kb 64 256 1024 4096]
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import Process, Queue
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from stacks.downloader.transfer import BlockReader  # noqa: E402
+
+def serve(size, port_queue):
+    block = os.urandom(1024 * 1024)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            remaining = size
+            while remaining:
+                chunk = block[:min(len(block), remaining)]
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+def download_iter_content(session, url, path):
+    """The original loop: 8 KB chunks with bookkeeping on every chunk."""
+    hash_md5 = hashlib.md5()
+    downloaded = 0
+    last_update = time.time()
+    response = session.get(url, stream=True, timeout=30)
+    with open(path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=8192):
+            if chunk:
+                f.write(chunk)
+                hash_md5.update(chunk)
+                downloaded += len(chunk)
+                current_time = time.time()
+                if current_time - last_update >= 0.5:
+                    last_update = current_time
+    response.close()
+    return downloaded
+
+def download_block_reader(session, url, path, chunk_size):
+    """The readinto loop used by download_direct, bookkeeping once per time slice."""
+    hash_md5 = hashlib.md5()
+    downloaded = 0
+    last_update = time.time()
+    last_downloaded = 0
+    response = session.get(url, stream=True, timeout=30)
+    reader = BlockReader(response, chunk_size)
+    with open(path, "wb") as f:
+        while True:
+            block = reader.read()
+            if not block:
+                break
+            f.write(block)
+            hash_md5.update(block)
+            downloaded += len(block)
+            current_time = time.time()
+            if current_time - last_update >= 0.5:
+                reader.adapt((downloaded - last_downloaded) / (current_time - last_update))
+                last_update = current_time
+                last_downloaded = downloaded
+    response.close()
+    return downloaded
+
+def measure(name, func, size, runs):
+    wall_times = []
+    cpu_times = []
+    for _ in range(runs):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        downloaded = func()
+        cpu_times.append(time.process_time() - cpu_start)
+        wall_times.append(time.perf_counter() - wall_start)
+        if downloaded != size:
+            raise RuntimeError(f"{name}: got {downloaded}/{size} bytes")
+
+    best_wall = min(wall_times)
+    best_cpu = min(cpu_times)
+    gb = size / 1024 ** 3
+    print(f"{name:<24} {size / 1024 ** 2 / best_wall:>10.1f} MB/s {best_cpu / gb:>10.2f} CPU s/GB")
+    return best_wall, best_cpu
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the download write path")
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--chunk-kb", type=int, nargs="+", default=[64, 256, 1024, 4096])
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    port_queue = Queue()
+    server = Process(target=serve, args=(size, port_queue), daemon=True)
+    server.start()
+    url = f"http://127.0.0.1:{port_queue.get()}/file"
+
+    session = requests.Session()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "download.bin"
+        print(f"Downloading {args.size_mb} MB, best of {args.runs}")
+        print(f"{'path':<24} {'throughput':>15} {'client CPU':>17}")
+        measure("iter_content 8 KB", lambda: download_iter_content(session, url, path), size, args.runs)
+        for chunk_kb in args.chunk_kb:
+            measure(
+                f"readinto {chunk_kb} KB",
+                lambda: download_block_reader(session, url, path, chunk_kb * 1024),
+                size,
+                args.runs
+            )
+
+    server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+Local stand-in for Anna's Archive, its download mirrors and FlareSolverr.
+
+One HTTP server answers for every simulated host, telling them apart by the
+Host header. SimulatorAdapter, mounted on a requests session, sends requests
+for any URL to it, so AnnaDownloader runs unmodified against it:
+
+    annas-archive.* (all of ANNAS_ARCHIVE_DOMAINS)
+        /md5/<md5>                   book page with slow_download and external mirror links
+        /slow_download/<md5>/<a>/<b> slow download page linking to the file
+        /dyn/api/fast_download.json  fast download API
+    libgen.sim, zlib-mirror.sim     external mirror pages linking to the file
+    files.sim                       the files themselves (Range supported)
+    POST /v1 (any host)             FlareSolverr: solves any page and hands out a clearance cookie
+    GET /_sim/items, /_sim/stats    the generated library and fault counters, for runners
+
+Faults are injected with the options below: response latency, a per-connection
+throughput cap, connection resets partway through a file, corrupted bodies,
+403 challenges on mirror and slow download pages, and 503 errors.
+
+Usage:
+    python bench/simulator.py [--port 8900] [--items 20] [--size-kb 2048] [--latency 0.05] ...
+"""
+import argparse
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from stacks.constants import ANNAS_ARCHIVE_DOMAINS  # noqa: E402
+
+MIRROR_HOSTS = ("libgen.sim", "zlib-mirror.sim")
+FILE_HOST = "files.sim"
+CLEARANCE_COOKIE = "cf_clearance"
+BLOCK_SIZE = 64 * 1024
+
+def add_fault_arguments(parser):
+    """Simulator options, shared with the runners that start one."""
+    group = parser.add_argument_group("simulator")
+    group.add_argument("--items", type=int, default=20, help="Books in the simulated library")
+    group.add_argument("--size-kb", type=int, default=2048, help="Size of each book")
+    group.add_argument("--seed", type=int, default=1, help="Seed for book contents and faults")
+    group.add_argument("--latency", type=float, default=0.05, help="Seconds before every response")
+    group.add_argument("--throughput-kbps", type=int, default=0, help="Per-connection file speed cap (0 = none)")
+    group.add_argument("--reset-rate", type=float, default=0.0, help="Chance a file transfer is cut off")
+    group.add_argument("--corrupt-rate", type=float, default=0.0, help="Chance a file body is corrupted")
+    group.add_argument("--challenge-rate", type=float, default=0.0, help="Chance a mirror page is a 403 challenge")
+    group.add_argument("--error-rate", type=float, default=0.0, help="Chance of a 503 from any host")
+    group.add_argument("--flaresolverr-delay", type=float, default=0.5, help="Seconds a FlareSolverr solve takes")
+    return group
+
+class Library:
+    """Books with random contents, named by their real MD5 so verification works."""
+
+    def __init__(self, count, size, seed):
+        rng = random.Random(seed)
+        self.books = {}
+        for index in range(count):
+            # Zip magic so the .epub sniffing check passes
+            data = b"PK\x03\x04" + rng.randbytes(max(0, size - 4))
+            md5 = hashlib.md5(data).hexdigest()
+            self.books[md5] = {"title": f"Simulated Book {index + 1}", "data": data}
+
+    def get(self, md5):
+        return self.books.get(md5)
+
+class Simulator:
+    """Fault settings, counters and page rendering, shared by all request handlers."""
+
+    def __init__(self, options):
+        self.options = options
+        self.library = Library(options.items, options.size_kb * 1024, options.seed)
+        self.rng = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.clearance = f"sim-{options.seed}"
+        self.stats = {
+            "requests": 0,
+            "challenges": 0,
+            "solves": 0,
+            "errors": 0,
+            "resets": 0,
+            "corrupted": 0,
+            "bytes_sent": 0
+        }
+
+    def chance(self, rate):
+        with self.lock:
+            return rate > 0 and self.rng.random() < rate
+
+    def uniform(self, low, high):
+        with self.lock:
+            return self.rng.uniform(low, high)
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def md5_page(self, md5):
+        book = self.library.get(md5)
+        if not book:
+            return None
+        size_mb = len(book["data"]) / 1024 ** 2
+        slow_links = "".join(
+            f'<li class="list-disc"><a href="/slow_download/{md5}/0/{server}">Slow Partner Server #{server + 1}</a> (no waitlist, but can be very slow)</li>'
+            for server in range(2)
+        )
+        mirror_links = "".join(f'<li><a href="https://{mirror}/file/{md5}">{mirror}</a></li>' for mirror in MIRROR_HOSTS)
+        return f"""<html><body>
+<div class="font-semibold text-2xl leading-[1.2]">{book["title"]}</div>
+<div class="text-gray-800 font-semibold text-sm mt-4">English [en] · EPUB · {size_mb:.1f}MB · 2024</div>
+<div id="md5-panel-downloads">
+<ul>{slow_links}</ul>
+<ul class="js-show-external">{mirror_links}</ul>
+</div>
+</body></html>"""
+
+    def file_page(self, md5):
+        book = self.library.get(md5)
+        if not book:
+            return None
+        return f"""<html><body>
+<p>{book["title"]}</p>
+<a href="https://{FILE_HOST}/dl/{md5}/book.epub">GET this file</a>
+</body></html>"""
+
+    def render(self, host, path):
+        """HTML for a page, or None if there is no such page."""
+        parts = path.strip("/").split("/")
+        if host in ANNAS_ARCHIVE_DOMAINS and len(parts) >= 2 and parts[0] == "md5":
+            return self.md5_page(parts[1])
+        if host in ANNAS_ARCHIVE_DOMAINS and len(parts) >= 2 and parts[0] == "slow_download":
+            return self.file_page(parts[1])
+        if host in MIRROR_HOSTS and len(parts) >= 2 and parts[0] == "file":
+            return self.file_page(parts[1])
+        return None
+
+def make_handler(sim):
+    options = sim.options
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+            body = body.encode() if isinstance(body, str) else body
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _host(self):
+            return (self.headers.get("Host") or "").split(":")[0]
+
+        def do_POST(self):
+            sim.count("requests")
+            if self.path != "/v1":
+                return self._send(404, "Not found")
+
+            # FlareSolverr: render the page as if the challenge had been passed
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            url = urlparse(request.get("url", ""))
+            time.sleep(options.flaresolverr_delay)
+            sim.count("solves")
+            html = sim.render(url.hostname, url.path)
+            if html is None:
+                return self._send(200, json.dumps({"status": "error", "message": "Page not found"}), "application/json")
+            return self._send(200, json.dumps({
+                "status": "ok",
+                "solution": {
+                    "url": request.get("url"),
+                    "status": 200,
+                    "cookies": [{"name": CLEARANCE_COOKIE, "value": sim.clearance, "domain": url.hostname}],
+                    "response": html
+                }
+            }), "application/json")
+
+        def do_GET(self):
+            sim.count("requests")
+            url = urlparse(self.path)
+            host = self._host()
+
+            if url.path == "/_sim/items":
+                items = [{"md5": md5, "size": len(book["data"])} for md5, book in sim.library.books.items()]
+                return self._send(200, json.dumps(items), "application/json")
+            if url.path == "/_sim/stats":
+                return self._send(200, json.dumps(sim.stats), "application/json")
+
+            if options.latency:
+                time.sleep(options.latency)
+
+            if sim.chance(options.error_rate):
+                sim.count("errors")
+                return self._send(503, "Service unavailable")
+
+            if host in ANNAS_ARCHIVE_DOMAINS and url.path == "/dyn/api/fast_download.json":
+                return self._fast_download(parse_qs(url.query))
+
+            if host == FILE_HOST and url.path.startswith("/dl/"):
+                return self._file(url.path.split("/")[2])
+
+            # Mirror and slow download pages are sometimes behind a challenge, cookies or not
+            challenged = url.path.startswith(("/slow_download/", "/file/"))
+            if challenged and sim.chance(options.challenge_rate):
+                sim.count("challenges")
+                return self._send(403, "<html><body>Checking your browser...</body></html>")
+
+            html = sim.render(host, url.path)
+            if html is None:
+                return self._send(404, "Not found")
+            return self._send(200, html)
+
+        def _fast_download(self, query):
+            md5 = (query.get("md5") or [""])[0]
+            info = {"downloads_left": 1000, "downloads_per_day": 1000}
+            if not sim.library.get(md5):
+                return self._send(200, json.dumps({"error": "Record not found", "account_fast_download_info": info}), "application/json")
+            return self._send(200, json.dumps({
+                "download_url": f"https://{FILE_HOST}/dl/{md5}/book.epub",
+                "account_fast_download_info": info
+            }), "application/json")
+
+        def _file(self, md5):
+            book = sim.library.get(md5)
+            if not book:
+                return self._send(404, "Not found")
+            data = book["data"]
+
+            start = 0
+            range_header = self.headers.get("Range")
+            if range_header and range_header.startswith("bytes="):
+                start = min(int(range_header[6:].split("-")[0] or 0), len(data))
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Type", "application/epub+zip")
+            self.send_header("Content-Length", str(len(data) - start))
+            self.send_header("ETag", f'"{md5}"')
+            self.end_headers()
+
+            # Decide the faults for this transfer up front
+            body = data[start:]
+            cut_at = len(body)
+            if sim.chance(options.reset_rate):
+                cut_at = int(len(body) * sim.uniform(0.1, 0.9))
+                sim.count("resets")
+            if body and sim.chance(options.corrupt_rate):
+                # Past the leading bytes, so only the MD5 check catches it
+                position = int(sim.uniform(min(4, len(body) - 1), len(body) - 1))
+                body = body[:position] + bytes([body[position] ^ 0xFF]) + body[position + 1:]
+                sim.count("corrupted")
+
+            rate = options.throughput_kbps * 1024
+            sent = 0
+            started = time.monotonic()
+            try:
+                while sent < cut_at:
+                    block = body[sent:min(sent + BLOCK_SIZE, cut_at)]
+                    self.wfile.write(block)
+                    sent += len(block)
+                    if rate:
+                        ahead = sent / rate - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            sim.count("bytes_sent", sent)
+
+            if cut_at < len(body):
+                # Drop the connection without finishing the body
+                self.wfile.flush()
+                self.connection.shutdown(socket.SHUT_RDWR)
+                self.close_connection = True
+
+    return Handler
+
+class SimulatorAdapter(HTTPAdapter):
+    """Send requests for any host to the simulator, keeping the real host in the Host header."""
+
+    def __init__(self, address, **kwargs):
+        self.address = address
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        original_url = request.url
+        parsed = urlparse(original_url)
+        # The session keeps the original request for cookies, only the copy is rewritten
+        request = request.copy()
+        request.headers["Host"] = parsed.netloc
+        request.url = parsed._replace(scheme="http", netloc=self.address).geturl()
+        response = super().send(request, **kwargs)
+        response.url = original_url
+        return response
+
+def start(options, port=0):
+    """Start a simulator on a background thread, returning the server."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(Simulator(options)))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Anna's Archive, mirrors and FlareSolverr")
+    parser.add_argument("--port", type=int, default=8900)
+    add_fault_arguments(parser)
+    options = parser.parse_args()
+
+    server = start(options, options.port)
+    print(f"Simulator listening on http://127.0.0.1:{server.server_port} ({options.items} books)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import logging
+
+from flask import (
+    current_app,
+    jsonify,
+    request,
+)
+
+from . import api_bp
+from stacks.utils.md5utils import extract_md5
+from stacks.security.auth import (
+    require_auth_with_permissions,
+)
+
+logger = logging.getLogger("api")
+
+@api_bp.route('/api/cache/clear', methods=['POST'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_cache_clear():
+    """Invalidate cached Anna's Archive pages (all, or a single MD5)"""
+    data = request.get_json(silent=True) or {}
+    md5 = data.get('md5')
+
+    if md5 is not None:
+        md5 = extract_md5(md5) if isinstance(md5, str) else None
+        if not md5:
+            return jsonify({'success': False, 'error': 'Invalid MD5'}), 400
+
+    worker = current_app.stacks_worker
+    count = worker.downloader.invalidate_page_cache(md5)
+
+    return jsonify({
+        'success': True,
+        'message': f'Cleared {count} cached page(s)'
+    })
@@ -7,8 +7,9 @@ from flask import (
     current_app,
 )
 from stacks.constants import KNOWN_MD5, PROJECT_ROOT
+from stacks.downloader.connections import SHARED_SESSION
+from stacks.server.postprocess import HOOK_ENV
 from . import api_bp
-from stacks.utils.logutils import setup_logging
 from stacks.utils.migrationutils import migrate_incomplete_folder
 from stacks.utils.domainutils import try_domains_until_success
 from stacks.security.auth import (
@@ -40,7 +41,7 @@ def api_config_test_flaresolverr():
         import requests
 
         # Try to connect to FlareSolverr's health endpoint
-        response = requests.get(test_url, timeout=timeout)
+        response = SHARED_SESSION.get(test_url, timeout=timeout)
         
         if response.status_code == 200:
             return jsonify({
@@ -72,11 +73,9 @@ def api_config_test_flaresolverr():
     
 def _test_key_single_domain(test_key, domain):
     """Test fast download key with a specific domain."""
-    import requests
-
     api_url = f'https://{domain}/dyn/api/fast_download.json'
 
-    response = requests.get(
+    response = SHARED_SESSION.get(
         api_url,
         params={
             'md5': KNOWN_MD5,
@@ -171,6 +170,14 @@ def api_config_update():
     config = current_app.stacks_config
     worker = current_app.stacks_worker
 
+    # The hook runs as a command in the container, it only comes from the config file or the environment
+    postprocess = data.get('postprocess')
+    if isinstance(postprocess, dict) and 'hook' in postprocess and postprocess['hook'] != config.get('postprocess', 'hook', default=None):
+        return jsonify({
+            'success': False,
+            'error': f'postprocess.hook can only be set in the config file or with the {HOOK_ENV} environment variable'
+        }), 400
+
     try:
         # Check if incomplete_folder_path is being changed
         old_incomplete_path = config.get('downloads', 'incomplete_folder_path', default='/download/incomplete')
@@ -178,22 +185,23 @@ def api_config_update():
         if 'downloads' in data and 'incomplete_folder_path' in data['downloads']:
             new_incomplete_path = data['downloads']['incomplete_folder_path']
 
-        # Apply all config changes
-        for section, values in data.items():
-            if isinstance(values, dict):
-                for key, new_value in values.items():
-                    # Special handling for password updates
-                    if section == 'login' and key == 'new_password':
-                        if new_value:  # Only update if new password is provided
-                            hashed_password = hash_password(new_value)
-                            config.set(section, 'password', value=hashed_password)
-                            logger.info("Password updated successfully")
-                    else:
-                        config.set(section, key, value=new_value)
-
-        # Validate config (this will normalize the path)
-        config.data = config.validate(config.data, config.schema)
-        config.ensure_login_credentials()
+        # Apply all config changes, telling subscribers once they're all in
+        with config.batch():
+            for section, values in data.items():
+                if isinstance(values, dict):
+                    for key, new_value in values.items():
+                        # Special handling for password updates
+                        if section == 'login' and key == 'new_password':
+                            if new_value:  # Only update if new password is provided
+                                hashed_password = hash_password(new_value)
+                                config.set(section, 'password', value=hashed_password)
+                                logger.info("Password updated successfully")
+                        else:
+                            config.set(section, key, value=new_value)
+
+            # Validate config (this will normalize the path)
+            config.data = config.validate(config.data, config.schema)
+            config.ensure_login_credentials()
 
         # Get the validated/normalized new path
         if new_incomplete_path is not None:
@@ -222,6 +230,9 @@ def api_config_update():
             old_path = PROJECT_ROOT / old_incomplete_path.lstrip('/')
             new_path = PROJECT_ROOT / new_incomplete_path.lstrip('/')
 
+            # Make sure the part manifest on disk is current before it's migrated
+            worker.downloader.part_manifest.flush()
+
             logger.info(f"Starting migration from {old_path} to {new_path}")
             success, message, stats = migrate_incomplete_folder(old_path, new_path)
 
@@ -243,7 +254,6 @@ def api_config_update():
 
         # Recreate downloader with new config (this will use the new path)
         worker.update_config()
-        setup_logging(config)
 
         # Resume worker if we paused it
         if migration_occurred and worker.paused:
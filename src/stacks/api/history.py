@@ -7,12 +7,28 @@ from flask import (
 )
 
 from . import api_bp
+from stacks.constants import HISTORY_STATUSES, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from stacks.security.auth import (
     require_auth_with_permissions,
 )
 
 logger = logging.getLogger("api")
 
+@api_bp.route('/api/history', methods=['GET'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_history():
+    """Get a page of history, newest first"""
+    cursor = request.args.get('cursor', type=int)
+    limit = min(max(1, request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)), MAX_PAGE_SIZE)
+    status = request.args.get('status') or None
+
+    if status is not None and status not in HISTORY_STATUSES:
+        return jsonify({'success': False, 'error': f"Status must be one of: {', '.join(HISTORY_STATUSES)}"}), 400
+
+    q = current_app.stacks_queue
+    return jsonify(q.get_history_page(cursor, limit, status))
+
+
 @api_bp.route('/api/history/clear', methods=['POST'])
 @require_auth_with_permissions(allow_downloader=False)
 def api_history_clear():
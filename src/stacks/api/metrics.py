@@ -0,0 +1,16 @@
+import logging
+
+from flask import Response
+
+from . import api_bp
+from stacks.utils.metrics import METRICS
+from stacks.security.auth import require_auth_with_permissions
+
+logger = logging.getLogger("api")
+
+
+@api_bp.get("/metrics")
+@require_auth_with_permissions(allow_downloader=False)
+def metrics():
+    """Prometheus metrics"""
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
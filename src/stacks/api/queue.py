@@ -7,6 +7,7 @@ from flask import (
 )
 
 from . import api_bp
+from stacks.constants import QUEUE_PRIORITIES, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from stacks.utils.md5utils import extract_md5
 from stacks.security.auth import (
     require_auth,
@@ -15,6 +16,17 @@ from stacks.security.auth import (
 
 logger = logging.getLogger("api")
 
+@api_bp.route('/api/queue', methods=['GET'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_queue():
+    """Get a page of the queue in download order"""
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(max(1, request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)), MAX_PAGE_SIZE)
+
+    q = current_app.stacks_queue
+    return jsonify(q.get_queue_page(offset, limit))
+
+
 @api_bp.route('/api/queue/remove', methods=['POST'])
 @require_auth_with_permissions(allow_downloader=False)
 def api_queue_remove():
@@ -34,6 +46,52 @@ def api_queue_remove():
     })
 
 
+@api_bp.route('/api/queue/move', methods=['POST'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_queue_move():
+    """Move item to the top, bottom or a position in the queue"""
+    data = request.json
+    md5 = data.get('md5')
+    position = data.get('position')
+
+    if not md5:
+        return jsonify({'success': False, 'error': 'MD5 required'}), 400
+
+    if position not in ('top', 'bottom') and (not isinstance(position, int) or isinstance(position, bool) or position < 0):
+        return jsonify({'success': False, 'error': "Position must be 'top', 'bottom' or a non-negative integer"}), 400
+
+    q = current_app.stacks_queue
+    moved = q.move(md5, position)
+
+    return jsonify({
+        'success': moved,
+        'message': 'Moved in queue' if moved else 'Not found in queue'
+    })
+
+
+@api_bp.route('/api/queue/priority', methods=['POST'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_queue_priority():
+    """Change the priority of a queued item"""
+    data = request.json
+    md5 = data.get('md5')
+    priority = data.get('priority')
+
+    if not md5:
+        return jsonify({'success': False, 'error': 'MD5 required'}), 400
+
+    if priority not in QUEUE_PRIORITIES:
+        return jsonify({'success': False, 'error': f"Priority must be one of: {', '.join(QUEUE_PRIORITIES)}"}), 400
+
+    q = current_app.stacks_queue
+    changed = q.set_priority(md5, priority)
+
+    return jsonify({
+        'success': changed,
+        'message': f'Priority set to {priority}' if changed else 'Not found in queue'
+    })
+
+
 @api_bp.route('/api/queue/clear', methods=['POST'])
 @require_auth_with_permissions(allow_downloader=False)
 def api_queue_clear():
@@ -52,10 +110,14 @@ def api_queue_add():
     data = request.json
     md5 = data.get('md5')
     subfolder = data.get('subfolder')
+    priority = data.get('priority')
 
     if not md5:
         return jsonify({'success': False, 'error': 'MD5 required'}), 400
 
+    if priority is not None and priority not in QUEUE_PRIORITIES:
+        return jsonify({'success': False, 'error': f"Priority must be one of: {', '.join(QUEUE_PRIORITIES)}"}), 400
+
     # Validate MD5
     extracted_md5 = extract_md5(md5)
 
@@ -79,7 +141,8 @@ def api_queue_add():
     success, message = q.add(
         extracted_md5,
         source=data.get('source'),
-        subfolder=validated_subfolder
+        subfolder=validated_subfolder,
+        priority=priority
     )
 
     return jsonify({
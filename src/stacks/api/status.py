@@ -1,8 +1,11 @@
 import logging
-from flask import jsonify, current_app
+from flask import jsonify, current_app, request
 from stacks.utils.logutils import LOG_BUFFER
 
 from . import api_bp
+from stacks.constants import HISTORY_STATUSES
+from stacks.downloader.breaker import BREAKER
+from stacks.downloader.connections import CONNECTION_STATS
 from stacks.security.auth import require_auth_with_permissions
 
 logger = logging.getLogger("api")
@@ -13,6 +16,29 @@ def health():
     return {"status": "ok"}
 
 
+def _readiness():
+    worker = current_app.stacks_worker
+    checks = worker.get_service_checks()
+    is_ready = worker.running and not any(check['status'] == 'pending' for check in checks.values())
+    return is_ready, checks
+
+
+@api_bp.get("/api/ready")
+def ready():
+    """Ready once the worker is running and the startup checks have finished (states only, no auth)"""
+    is_ready, checks = _readiness()
+    states = {name: {"status": check['status']} for name, check in checks.items()}
+    return jsonify({"ready": is_ready, "checks": states}), 200 if is_ready else 503
+
+
+@api_bp.get("/api/ready/details")
+@require_auth_with_permissions(allow_downloader=False)
+def ready_details():
+    """Readiness with each check's message and time"""
+    is_ready, checks = _readiness()
+    return jsonify({"ready": is_ready, "checks": checks}), 200 if is_ready else 503
+
+
 @api_bp.get("/api/version")
 def api_version():
     """Get current version and tampermonkey script version"""
@@ -45,3 +71,51 @@ def api_status():
     status["paused"] = w.paused
 
     return jsonify(status)
+
+
+@api_bp.get("/api/stats")
+@require_auth_with_permissions(allow_downloader=False)
+def api_stats():
+    """Get download statistics"""
+    q = current_app.stacks_queue
+    return jsonify(q.get_stats())
+
+
+@api_bp.get("/api/stats/phases")
+@require_auth_with_permissions(allow_downloader=False)
+def api_stats_phases():
+    """Get percentiles of the time spent in each download phase"""
+    limit = request.args.get('limit', 0, type=int)
+    status = request.args.get('status') or None
+
+    if status is not None and status not in HISTORY_STATUSES:
+        return jsonify({'success': False, 'error': f"Status must be one of: {', '.join(HISTORY_STATUSES)}"}), 400
+
+    q = current_app.stacks_queue
+    return jsonify(q.get_phase_report(max(0, limit), status))
+
+
+@api_bp.get("/api/stats/connections")
+@require_auth_with_permissions(allow_downloader=False)
+def api_stats_connections():
+    """Get per-host connection reuse and TLS handshake counts"""
+    return jsonify(CONNECTION_STATS.snapshot())
+
+
+@api_bp.get("/api/stats/breakers")
+@require_auth_with_permissions(allow_downloader=False)
+def api_stats_breakers():
+    """Get the hosts whose circuit breaker has seen failures"""
+    return jsonify(BREAKER.snapshot())
+
+
+@api_bp.post("/api/stats/reset")
+@require_auth_with_permissions(allow_downloader=False)
+def api_stats_reset():
+    """Reset download statistics"""
+    q = current_app.stacks_queue
+    q.reset_stats()
+    return jsonify({
+        'success': True,
+        'message': 'Statistics reset'
+    })
@@ -2,18 +2,60 @@ import threading
 import logging
 import yaml
 import copy
+from contextlib import contextmanager
 from stacks.constants import CONFIG_FILE, CONFIG_SCHEMA_FILE
 from stacks.config.validate import _validate, ensure_login_credentials
 
 logger = logging.getLogger('config')
 
+class ConfigSnapshot:
+    """
+    One version of the configuration, never changed once published.
+
+    Every section and key path is indexed up front, so a lookup is a single
+    dict access without any locking. Lists and dicts are handed out as
+    copies, so callers can't change the snapshot under other readers.
+    """
+
+    def __init__(self, data, version=0):
+        self.version = version
+        self.data = data
+        self.paths = {}
+        self._index(data, ())
+
+    def _index(self, value, path):
+        if path:
+            self.paths[path] = value
+        if isinstance(value, dict):
+            for key, child in value.items():
+                self._index(child, path + (key,))
+
+    def get(self, *keys, default=None):
+        value = self.paths.get(keys)
+        if value is None:
+            return default
+        if isinstance(value, (dict, list)):
+            return copy.deepcopy(value)
+        return value
+
 class Config:
-    """Configuration loader with live update support"""
+    """
+    Configuration loader with live update support.
+
+    Readers get the current ConfigSnapshot, swapped in whole whenever the
+    config changes, so reading never takes a lock. Writers are serialized
+    and subscribers are told about each change after it's published.
+    """
 
     def __init__(self, config_path=CONFIG_FILE, schema_path=CONFIG_SCHEMA_FILE):
         self.config_path = config_path
         self.schema_path = schema_path
-        self.lock = threading.Lock()
+        # Serializes writers (and their notifications); readers don't need it
+        self.lock = threading.RLock()
+        self._snapshot = ConfigSnapshot({})
+        self._subscribers = []
+        self._batch_depth = 0
+        self._batch_start = None
 
         self.load_schema()
         self.load()
@@ -24,25 +66,83 @@ class Config:
         if not self.data == olddata:
             logger.info("Some value(s) in config file did not conform to standard. Logfile has been healed.")
             self.save()
-        
 
-    def load(self):
-        """Load configuration from file, or create empty dict."""
+    @property
+    def snapshot(self):
+        """The current configuration. Hold on to it to read several values consistently."""
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def data(self):
+        """The current configuration as a dict. Don't change it, assign a new one."""
+        return self._snapshot.data
+
+    @data.setter
+    def data(self, value):
         with self.lock:
+            self._publish(copy.deepcopy(value))
+
+    def _publish(self, data):
+        """Swap in a new snapshot (with the lock held) and notify, unless in a batch."""
+        old = self._snapshot
+        self._snapshot = ConfigSnapshot(data, old.version + 1)
+        if self._batch_depth:
+            return
+        self._notify(old, self._snapshot)
+
+    def _notify(self, old, new):
+        for callback in list(self._subscribers):
             try:
-                with open(self.config_path, "r") as f:
-                    self.data = yaml.safe_load(f) or {}
-                    logger.debug("Loaded config.")
-            except FileNotFoundError:
-                logger.debug("No config found, seeding empty config for population.")
-                self.data = {}
+                callback(old, new)
+            except Exception as e:
+                logger.error(f"Config change handler {callback!r} failed: {e}")
+
+    @contextmanager
+    def batch(self):
+        """Make several changes, notifying subscribers once at the end."""
+        with self.lock:
+            if not self._batch_depth:
+                self._batch_start = self._snapshot
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._snapshot is not self._batch_start:
+                    start, self._batch_start = self._batch_start, None
+                    self._notify(start, self._snapshot)
+
+    def subscribe(self, callback):
+        """Call callback(old_snapshot, new_snapshot) after every change."""
+        with self.lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def load(self):
+        """Load configuration from file, or create empty dict."""
+        try:
+            with open(self.config_path, "r") as f:
+                data = yaml.safe_load(f) or {}
+                logger.debug("Loaded config.")
+        except FileNotFoundError:
+            logger.debug("No config found, seeding empty config for population.")
+            data = {}
+        self.data = data
 
     def load_schema(self):
         """Load schema from file."""
-        with self.lock:
-            with open(self.schema_path, "r") as f:
-                self.schema = yaml.safe_load(f)
-                logger.debug("Loaded config schema.")
+        with open(self.schema_path, "r") as f:
+            self.schema = yaml.safe_load(f)
+            logger.debug("Loaded config schema.")
 
     def save(self):
         """Save configuration to file."""
@@ -57,34 +157,31 @@ class Config:
     
     def get(self, *keys, default=None):
         """Get nested config value"""
-        with self.lock:
-            value = self.data
-            for key in keys:
-                if isinstance(value, dict):
-                    value = value.get(key)
-                else:
-                    return default
-                if value is None:
-                    return default
-            return value
+        # Same as self.snapshot.get, inlined since it's called on every request
+        value = self._snapshot.paths.get(keys)
+        if value is None:
+            return default
+        if isinstance(value, (dict, list)):
+            return copy.deepcopy(value)
+        return value
     
     def ensure_login_credentials(self):
         return ensure_login_credentials(self)
     
     
     def set(self, *keys, value):
-        """Set nested config value"""
+        """Set nested config value, as a new snapshot"""
         with self.lock:
-            # Navigate to parent
-            data = self.data
+            # Copy the dicts along the path, the rest is shared with the old snapshot
+            data = dict(self._snapshot.data)
+            parent = data
             for key in keys[:-1]:
-                if key not in data:
-                    data[key] = {}
-                data = data[key]
-            # Set value
-            data[keys[-1]] = value
+                child = parent.get(key)
+                parent[key] = dict(child) if isinstance(child, dict) else {}
+                parent = parent[key]
+            parent[keys[-1]] = copy.deepcopy(value)
+            self._publish(data)
     
     def get_all(self):
         """Get entire config as dict"""
-        with self.lock:
-            return self.data.copy()
\ No newline at end of file
+        return copy.deepcopy(self._snapshot.data)
@@ -5,7 +5,13 @@ from stacks.constants import (
     DEFAULT_USERNAME,
     DEFAULT_PASSWORD,
     LOG_LEVELS,
+    LOG_FORMAT_OPTIONS,
     INCLUDE_HASH_OPTIONS,
+    QUEUE_FAIRNESS_OPTIONS,
+    QUEUE_SCHEDULING_OPTIONS,
+    SCHEDULE_DAYS,
+    RE_HOST,
+    RE_CLOCK_TIME,
     RE_SECRET_KEY,
     RE_IPV4,
     RE_IPV6,
@@ -85,6 +91,53 @@ def _validate_path(value, path_type="incomplete_folder", incomplete_folder_path=
 
     return normalized_path
 
+def _validate_host_limits(value, max_value=None):
+    """Validate a {host: limit} mapping, dropping invalid entries."""
+    validated = {}
+    for host, limit in value.items():
+        if not isinstance(host, str) or not RE_HOST.fullmatch(host.strip().lower()):
+            logger.warning(f"Skipping invalid host in bandwidth limits: {host}")
+            continue
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0 or (max_value is not None and limit > max_value):
+            logger.warning(f"Skipping invalid bandwidth limit for {host}: {limit}")
+            continue
+        validated[host.strip().lower()] = limit
+    return validated
+
+def _validate_schedule(value, max_value=None):
+    """Validate a list of {days, start, end, limit} schedule entries, dropping invalid ones."""
+    validated = []
+    for entry in value:
+        if not isinstance(entry, dict):
+            logger.warning(f"Skipping invalid schedule entry: {entry}")
+            continue
+
+        start = entry.get('start')
+        end = entry.get('end')
+        limit = entry.get('limit', 0)
+        days = entry.get('days') or list(SCHEDULE_DAYS)
+
+        if not isinstance(start, str) or not RE_CLOCK_TIME.fullmatch(start) or not isinstance(end, str) or not RE_CLOCK_TIME.fullmatch(end):
+            logger.warning(f"Skipping schedule entry with invalid start/end (use HH:MM): {entry}")
+            continue
+        if start == end:
+            logger.warning(f"Skipping empty schedule entry: {entry}")
+            continue
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0 or (max_value is not None and limit > max_value):
+            logger.warning(f"Skipping schedule entry with invalid limit: {entry}")
+            continue
+        if not isinstance(days, list) or not all(isinstance(day, str) and day.lower() in SCHEDULE_DAYS for day in days):
+            logger.warning(f"Skipping schedule entry with invalid days (use {', '.join(SCHEDULE_DAYS)}): {entry}")
+            continue
+
+        validated.append({
+            'days': [day.lower() for day in days],
+            'start': start,
+            'end': end,
+            'limit': limit
+        })
+    return validated
+
 def _validate(config: dict, schema: dict) -> dict:
     logger.debug("Validating config.")
     normalized = {}
@@ -161,10 +214,22 @@ def _validate_value(value, rules, key, section=None, normalized=None):
                 if isinstance(value, str):
                     if value.upper() in LOG_LEVELS:
                         return value
+            case "LOG_FORMAT":
+                if isinstance(value, str):
+                    if value.lower() in LOG_FORMAT_OPTIONS:
+                        return value.lower()
             case "INCLUDE_HASH":
                 if isinstance(value, str):
                     if value.lower() in INCLUDE_HASH_OPTIONS:
                         return value.lower()
+            case "QUEUE_FAIRNESS":
+                if isinstance(value, str):
+                    if value.lower() in QUEUE_FAIRNESS_OPTIONS:
+                        return value.lower()
+            case "QUEUE_SCHEDULING":
+                if isinstance(value, str):
+                    if value.lower() in QUEUE_SCHEDULING_OPTIONS:
+                        return value.lower()
             case "BCRYPTHASH":
                 if is_valid_bcrypt_hash(value) and not os.environ.get('RESET_ADMIN','').lower() == 'true':
                     return value
@@ -197,6 +262,12 @@ def _validate_value(value, rules, key, section=None, normalized=None):
                     return validated_subdirs
                 elif value is None:
                     return None
+            case "HOST_LIMITS":
+                if isinstance(value, dict):
+                    return _validate_host_limits(value, max_value)
+            case "SCHEDULE":
+                if isinstance(value, list):
+                    return _validate_schedule(value, max_value)
 
     return _apply_default(default, key, value)
 
@@ -21,6 +21,7 @@ QUEUE_FILE = CONFIG_PATH / "queue.json"
 CONFIG_FILE = CONFIG_PATH / "config.yaml"
 CONFIG_SCHEMA_FILE = FILES_PATH / "config_schema.yaml"
 COOKIE_CACHE_DIR = CACHE_PATH
+PAGE_CACHE_DIR = CACHE_PATH / "pages"
 GUNICORN_CONFIG_FILE = PROJECT_ROOT / "src" / "stacks" / "gunicorn_config.py"
 
 # Reserved Paths
@@ -41,10 +42,27 @@ LOG_FORMAT = "[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 LOG_LEVELS = ["INFO", "ERROR", "WARN", "DEBUG"]
 LOG_VIEW_LENGTH = 1000
+LOG_FILE_NAME = "stacks.log"
+LOG_FORMAT_OPTIONS = ["text", "json"]
 
 # Hash inclusion options for filenames
 INCLUDE_HASH_OPTIONS = ["none", "prefix", "suffix"]
 
+# Queue priorities, highest first, and lane fairness policies
+QUEUE_PRIORITIES = ["high", "normal", "low"]
+QUEUE_FAIRNESS_OPTIONS = ["round_robin", "fifo"]
+QUEUE_SCHEDULING_OPTIONS = ["arrival", "shortest_first"]
+HISTORY_STATUSES = ["success", "failed"]
+
+# Page sizes for /api/queue and /api/history
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Bandwidth schedule
+SCHEDULE_DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+RE_HOST = re.compile(r"^[a-zA-Z0-9](?:[a-zA-Z0-9-]*[a-zA-Z0-9])?(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]*[a-zA-Z0-9])?)*$")
+RE_CLOCK_TIME = re.compile(r"^(?:[01]\d|2[0-3]):[0-5]\d$")
+
 # Default credentials
 DEFAULT_USERNAME = "admin"
 DEFAULT_PASSWORD = "stacks"
@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+import requests
+from stacks.utils.metrics import BREAKER_OPEN_HOSTS, BREAKER_TRIPS
+
+logger = logging.getLogger('stacks_downloader')
+
+# Answers that mean the host itself is in trouble (bad gateway, gateway timeout,
+# Cloudflare's origin errors), not that it turned this request down
+FAILURE_STATUSES = {502, 504, 520, 521, 522, 523, 524}
+
+class HostUnavailable(requests.exceptions.RequestException):
+    """Raised instead of sending a request to a host whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker.
+
+    After `threshold` failures in a row (connection errors, timeouts, or one of
+    FAILURE_STATUSES; 0 never opens it) a host's breaker opens and requests to it fail right away
+    with HostUnavailable. After `cooldown` seconds it's half-open: one probe
+    request goes through, closing the breaker if it works and opening it for
+    another cooldown if it doesn't.
+    """
+
+    def __init__(self, threshold=3, cooldown=60):
+        self.lock = threading.Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        # Only hosts that have failed are tracked
+        self.hosts = {}
+
+    def configure(self, threshold, cooldown):
+        with self.lock:
+            self.threshold = threshold
+            self.cooldown = cooldown
+
+    def _state(self, entry, now):
+        if entry is None or entry['opened_at'] is None:
+            return 'closed'
+        if now - entry['opened_at'] < self.cooldown:
+            return 'open'
+        return 'half_open'
+
+    def is_open(self, host):
+        """Whether a request to host would be turned away right now (cooling down, or its probe is out)."""
+        with self.lock:
+            entry = self.hosts.get(host)
+            state = self._state(entry, time.time())
+            return state == 'open' or (state == 'half_open' and entry['probing'])
+
+    def acquire(self, host):
+        """
+        Check a request to host may go out. Follow it with record_response,
+        record_failure or release.
+
+        Raises:
+            HostUnavailable if the host's breaker is open or its probe is already out
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.hosts.get(host)
+            state = self._state(entry, now)
+            if state == 'open':
+                retry_in = int(entry['opened_at'] + self.cooldown - now) + 1
+                raise HostUnavailable(f"{host} is unavailable ({entry['last_error']}), trying it again in {retry_in}s")
+            if state == 'half_open':
+                if entry['probing']:
+                    raise HostUnavailable(f"{host} is unavailable ({entry['last_error']}), waiting for a probe")
+                entry['probing'] = True
+
+    def release(self, host):
+        """A request ended without saying anything about the host, let the next one probe."""
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry:
+                entry['probing'] = False
+
+    def record_response(self, host, response):
+        if response.status_code in FAILURE_STATUSES:
+            self.record_failure(host, f"HTTP {response.status_code}")
+        else:
+            self.record_success(host)
+
+    def record_success(self, host):
+        with self.lock:
+            entry = self.hosts.pop(host, None)
+        if entry and entry['opened_at'] is not None:
+            logger.info(f"{host} is back, closing its circuit breaker")
+
+    def record_failure(self, host, error):
+        now = time.time()
+        with self.lock:
+            entry = self.hosts.get(host)
+            if entry is None:
+                entry = self.hosts[host] = {'failures': 0, 'opened_at': None, 'probing': False, 'last_error': None}
+            entry['failures'] += 1
+            entry['last_error'] = str(error)[:200]
+            state = self._state(entry, now)
+            # A failed probe opens it again; failures from requests already in flight when it opened don't
+            reopen = entry['probing'] or (state == 'closed' and self.threshold and entry['failures'] >= self.threshold)
+            if reopen:
+                entry['opened_at'] = now
+                entry['probing'] = False
+                cooldown = self.cooldown
+        if reopen:
+            BREAKER_TRIPS.inc()
+            logger.warning(f"{host} failed {entry['failures']} times in a row, skipping it for {cooldown}s: {entry['last_error']}")
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            hosts = {}
+            for host, entry in self.hosts.items():
+                state = self._state(entry, now)
+                hosts[host] = {
+                    'state': state,
+                    'failures': entry['failures'],
+                    'last_error': entry['last_error'],
+                    'opened_at': entry['opened_at'],
+                    'retry_in': max(0, entry['opened_at'] + self.cooldown - now) if state == 'open' else None
+                }
+            return {'threshold': self.threshold, 'cooldown': self.cooldown, 'hosts': hosts}
+
+    def open_hosts(self):
+        now = time.time()
+        with self.lock:
+            return sum(1 for entry in self.hosts.values() if self._state(entry, now) != 'closed')
+
+# Shared by all downloader instances and the domain rotation, so an outage is
+# noticed once rather than by every item
+BREAKER = CircuitBreaker()
+BREAKER_OPEN_HOSTS.set_function(BREAKER.open_hosts)
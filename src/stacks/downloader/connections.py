@@ -0,0 +1,374 @@
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_CA_BUNDLE_PATH, extract_zipped_paths
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.timeout import Timeout
+from urllib3.util.wait import wait_for_read
+from stacks.downloader.breaker import BREAKER
+from stacks.downloader.latency import LATENCY
+from stacks.utils.metrics import HTTP_REQUESTS, TLS_HANDSHAKES
+
+logger = logging.getLogger('stacks_downloader')
+
+# Seconds to wait for a connection (TCP and TLS handshake). Callers' timeouts
+# are read timeouts; a request that doesn't set one gets DEFAULT_READ_TIMEOUT.
+# With adaptive timeouts these only apply until a host has enough history
+CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+
+# Hosts whose pools are kept: Anna's Archive domains, mirrors, their file servers
+POOL_HOSTS = 32
+
+# Idle connections kept per host: downloads.max_per_host (at most 16) requests
+# in flight, plus a pre-connection. Fewer, and connections get thrown away
+POOL_MAXSIZE = 17
+
+# Seconds a pre-connection waits for the server's TLS 1.3 session tickets
+TICKET_WAIT = 1
+
+# Probe idle pooled connections so NAT and firewalls don't silently drop them
+SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, 'TCP_KEEPIDLE'):
+    SOCKET_OPTIONS += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 20),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    ]
+
+def _empty_counts():
+    return {'requests': 0, 'reused': 0, 'new': 0, 'preconnected': 0, 'tls_handshakes': 0, 'tls_resumed': 0}
+
+class ConnectionStats:
+    """Per-host counts of requests sent on a reused or a new connection, and of TLS handshakes."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _counts(self, host):
+        counts = self.hosts.get(host)
+        if counts is None:
+            counts = self.hosts[host] = _empty_counts()
+        return counts
+
+    def record_request(self, host, reused):
+        with self.lock:
+            counts = self._counts(host)
+            counts['requests'] += 1
+            counts['reused' if reused else 'new'] += 1
+        HTTP_REQUESTS.inc(connection='reused' if reused else 'new')
+
+    def record_handshake(self, host, resumed):
+        with self.lock:
+            counts = self._counts(host)
+            counts['tls_handshakes'] += 1
+            if resumed:
+                counts['tls_resumed'] += 1
+        TLS_HANDSHAKES.inc(resumed='true' if resumed else 'false')
+
+    def record_preconnect(self, host):
+        with self.lock:
+            self._counts(host)['preconnected'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            hosts = {host: dict(counts) for host, counts in self.hosts.items()}
+        totals = _empty_counts()
+        for counts in hosts.values():
+            for key in totals:
+                totals[key] += counts[key]
+        for counts in list(hosts.values()) + [totals]:
+            counts['hit_rate'] = round(counts['reused'] / counts['requests'], 3) if counts['requests'] else None
+        latency = LATENCY.snapshot()
+        for host, counts in hosts.items():
+            counts['latency'] = latency.get(host)
+        return {'hosts': hosts, 'totals': totals}
+
+CONNECTION_STATS = ConnectionStats()
+
+class AdaptiveTimeout(Timeout):
+    """Timeout whose read timeout only covers the first byte; the body is read with body_read."""
+
+    def __init__(self, connect, read, body_read):
+        super().__init__(connect=connect, read=read)
+        self.body_read = body_read
+
+    def clone(self):
+        return AdaptiveTimeout(self._connect, self._read, self.body_read)
+
+# The connection and pool mixins below override urllib3 internals (connect,
+# _make_request, _get_conn/_put_conn) that aren't covered by its API, so
+# requirements.txt pins the urllib3 release line they were written against.
+# On any other release the stock pools are used instead: fixed timeouts, no
+# connection stats or latency, no pre-connecting
+HOOKS_VERSION = (2, 8)
+
+def _hooks_supported(version):
+    try:
+        return tuple(int(part) for part in version.split('.')[:2]) == HOOKS_VERSION
+    except ValueError:
+        return False
+
+URLLIB3_HOOKS = _hooks_supported(urllib3.__version__)
+if not URLLIB3_HOOKS:
+    logger.warning(f"urllib3 {urllib3.__version__} isn't the supported {'.'.join(map(str, HOOKS_VERSION))}.x, using fixed timeouts and no connection stats")
+
+class _TimedConnectMixin:
+    def connect(self):
+        start = time.monotonic()
+        super().connect()
+        self.connect_seconds = time.monotonic() - start
+        LATENCY.observe(self.host, 'connect', self.connect_seconds)
+
+class TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+class _CountingPoolMixin:
+    def _make_request(self, conn, *args, **kwargs):
+        # A connection that hasn't connected yet (new, or dropped by the server) connects in here
+        reused = conn.sock is not None
+        CONNECTION_STATS.record_request(self.host, reused=reused)
+        start = time.monotonic()
+        response = super()._make_request(conn, *args, **kwargs)
+        elapsed = time.monotonic() - start
+        if not reused:
+            elapsed -= getattr(conn, 'connect_seconds', 0)
+        LATENCY.observe(self.host, 'ttfb', max(0, elapsed))
+
+        timeout = kwargs.get('timeout')
+        if isinstance(timeout, AdaptiveTimeout) and conn.sock is not None:
+            conn.timeout = timeout.body_read
+            conn.sock.settimeout(timeout.body_read)
+        return response
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class ResumingSSLContext(ssl.SSLContext):
+    """
+    SSLContext that offers each host the TLS session of its last connection,
+    so a new connection to a host we've talked to resumes instead of doing a
+    full handshake.
+    """
+
+    def _init_sessions(self):
+        self.sessions_lock = threading.Lock()
+        self.last_socket = {}
+        self.last_session = {}
+
+    def _session_for(self, host):
+        with self.sessions_lock:
+            sock = self.last_socket.get(host)
+            sock = sock() if sock else None
+            if sock is not None:
+                # TLS 1.3 tickets arrive after the handshake, so ask the live socket
+                try:
+                    session = sock.session
+                except (OSError, ValueError):
+                    session = None
+                if session is not None:
+                    self.last_session[host] = session
+            return self.last_session.get(host)
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if session is None and server_hostname and not server_side:
+            session = self._session_for(server_hostname)
+        ssl_sock = super().wrap_socket(
+            sock, server_side=server_side, do_handshake_on_connect=do_handshake_on_connect,
+            suppress_ragged_eofs=suppress_ragged_eofs, server_hostname=server_hostname, session=session
+        )
+        if server_hostname and not server_side:
+            with self.sessions_lock:
+                self.last_socket[server_hostname] = weakref.ref(ssl_sock)
+                if ssl_sock.session is not None:
+                    self.last_session[server_hostname] = ssl_sock.session
+            CONNECTION_STATS.record_handshake(server_hostname, ssl_sock.session_reused)
+        return ssl_sock
+
+_ssl_contexts = {}
+_ssl_contexts_lock = threading.Lock()
+
+def shared_ssl_context(ca_bundle=None):
+    """
+    The TLS context for verified HTTPS connections against a CA bundle (requests'
+    own by default): the bundle is loaded once instead of per connection, and
+    sessions are resumed across connections. Same settings as urllib3's default
+    context, except that TLS 1.2 tickets are allowed.
+    """
+    ca_bundle = ca_bundle or extract_zipped_paths(DEFAULT_CA_BUNDLE_PATH)
+    with _ssl_contexts_lock:
+        context = _ssl_contexts.get(ca_bundle)
+        if context is None:
+            context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            context.options |= ssl.OP_NO_COMPRESSION
+            context.hostname_checks_common_name = False
+            context.load_verify_locations(ca_bundle)
+            context.set_alpn_protocols(['http/1.1'])
+            context._init_sessions()
+            _ssl_contexts[ca_bundle] = context
+        return context
+
+def _ca_bundle(verify):
+    """The CA bundle file a requests `verify` value stands for, or None if it isn't one."""
+    if verify is True:
+        return extract_zipped_paths(DEFAULT_CA_BUNDLE_PATH)
+    if isinstance(verify, str) and os.path.isfile(verify):
+        return verify
+    return None
+
+def _read_session_tickets(sock):
+    """
+    Take in the session tickets a TLS 1.3 server sends after the handshake.
+    Left unread, they make an idle connection look readable, which urllib3
+    takes to mean the server closed it.
+    """
+    if not isinstance(sock, ssl.SSLSocket) or sock.version() != 'TLSv1.3':
+        return
+    timeout = sock.gettimeout()
+    wait = TICKET_WAIT
+    try:
+        while wait_for_read(sock, timeout=wait):
+            sock.setblocking(False)
+            try:
+                if not sock.recv(1):
+                    raise ConnectionError("closed by the server")
+            except ssl.SSLWantReadError:
+                pass
+            # Tickets come together, don't hang around for more
+            wait = 0.05
+    finally:
+        sock.settimeout(timeout)
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with a keep-alive pool per host sized for concurrent downloads,
+    counted connection reuse, the shared TLS context, and separate connect and
+    read timeouts.
+
+    With adaptive_timeouts, a host's connect and first-byte timeouts come from
+    its observed latency (see HostLatency) once there's enough of it, instead
+    of the timeout the caller passed. Only on the urllib3 release line the
+    hooks were written for (see URLLIB3_HOOKS), otherwise timeouts stay fixed.
+    """
+
+    def __init__(self, adaptive_timeouts=False):
+        self.adaptive_timeouts = adaptive_timeouts
+        self.preconnecting = set()
+        self.preconnect_lock = threading.Lock()
+        super().__init__(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault('socket_options', SOCKET_OPTIONS)
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        if not URLLIB3_HOOKS:
+            return
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        ca_bundle = _ca_bundle(verify)
+        if ca_bundle and host_params['scheme'] == 'https':
+            pool_kwargs.pop('ca_certs', None)
+            pool_kwargs['ssl_context'] = shared_ssl_context(ca_bundle)
+        return host_params, pool_kwargs
+
+    def cert_verify(self, conn, url, verify, cert):
+        super().cert_verify(conn, url, verify, cert)
+        if _ca_bundle(verify) and url.lower().startswith('https'):
+            # Already trusted by the shared context, don't load the bundle again per connection
+            conn.ca_certs = None
+            conn.ca_cert_dir = None
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        # An explicit (connect, read) pair is used as it is
+        if timeout is None or isinstance(timeout, (int, float)):
+            read = DEFAULT_READ_TIMEOUT if timeout is None else timeout
+            connect = min(CONNECT_TIMEOUT, read)
+            if self.adaptive_timeouts and URLLIB3_HOOKS:
+                host = urlparse(request.url).hostname
+                timeout = AdaptiveTimeout(
+                    connect=LATENCY.timeout(host, 'connect', connect),
+                    read=LATENCY.timeout(host, 'ttfb', read),
+                    body_read=read
+                )
+            else:
+                timeout = (connect, read)
+        return super().send(request, stream=stream, timeout=timeout, **kwargs)
+
+    def preconnect(self, url, verify=True):
+        """Connect to url's host in the background, unless its pool has an idle connection already."""
+        try:
+            request = requests.Request('GET', url).prepare()
+            pool = self.get_connection_with_tls_context(request, verify)
+            self.cert_verify(pool, request.url, verify, None)
+        except (requests.RequestException, ValueError) as e:
+            logger.debug(f"Not pre-connecting to {url}: {e}")
+            return
+        with self.preconnect_lock:
+            if pool.host in self.preconnecting:
+                return
+            self.preconnecting.add(pool.host)
+        threading.Thread(target=self._preconnect, args=(pool,), daemon=True, name='preconnect').start()
+
+    def _preconnect(self, pool):
+        try:
+            # An idle connection if the pool has one (dropped ones come back unconnected)
+            conn = pool._get_conn()
+            try:
+                if conn.sock is None:
+                    conn.timeout = CONNECT_TIMEOUT
+                    conn.connect()
+                    _read_session_tickets(conn.sock)
+                    CONNECTION_STATS.record_preconnect(pool.host)
+            except Exception as e:
+                logger.debug(f"Pre-connecting to {pool.host} failed: {e}")
+                conn.close()
+            pool._put_conn(conn)
+        except Exception as e:
+            logger.debug(f"Pre-connecting to {pool.host} failed: {e}")
+        finally:
+            with self.preconnect_lock:
+                self.preconnecting.discard(pool.host)
+
+def mount_pools(session, adaptive_timeouts=False):
+    """Send a session's HTTP and HTTPS requests through its own PooledAdapter."""
+    adapter = PooledAdapter(adaptive_timeouts=adaptive_timeouts)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def preconnect(d, url):
+    """Open a connection for a request d is likely to make next (e.g. the next mirror)."""
+    try:
+        adapter = d.session.get_adapter(url)
+    except requests.exceptions.InvalidSchema:
+        return
+    if isinstance(adapter, PooledAdapter) and URLLIB3_HOOKS and not BREAKER.is_open(urlparse(url).hostname):
+        # The same pool a request would use, which depends on REQUESTS_CA_BUNDLE and the like
+        settings = d.session.merge_environment_settings(url, {}, None, None, None)
+        adapter.preconnect(url, verify=settings['verify'])
+
+# For requests outside the download pipeline (FlareSolverr, settings tests):
+# pooled, but not held to the per-host politeness limits
+SHARED_SESSION = mount_pools(requests.Session())
@@ -1,10 +1,31 @@
 import re
 import time
 import requests
-import shutil
 import hashlib
+import urllib3
+from collections import deque
 from pathlib import Path
 from urllib.parse import urlparse, unquote
+from stacks.downloader.breaker import HostUnavailable
+from stacks.downloader.finalize import FinalizeError, PendingFinalize
+from stacks.downloader.transfer import BlockReader
+from stacks.downloader.ratelimit import SHAPER
+from stacks.downloader.timeline import phase, begin_phase, end_phase
+from stacks.utils.metrics import DOWNLOAD_BYTES, VERIFY_SECONDS
+from stacks.downloader.sniff import ContentMismatch, SNIFF_SIZE, check_response_headers, check_leading_bytes
+from stacks.downloader.resume import (
+    CHECKPOINT_INTERVAL,
+    load_part_meta,
+    save_part_meta,
+    remove_part_meta,
+    get_validator,
+    same_source,
+    parse_content_range_total,
+    rehash_partial,
+)
+
+class StalledTransfer(Exception):
+    """Raised when a transfer stays below the minimum speed for the whole stall window."""
 
 def calculate_md5(filepath):
     """Calculate MD5 hash of a file."""
@@ -14,6 +35,61 @@ def calculate_md5(filepath):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
+def _checkpoint(d, temp_path, part_meta, downloaded, hash_md5, supports_resume):
+    """Save the latest hash checkpoint for a partial download, if there is one."""
+    if not supports_resume or not part_meta or not temp_path.exists():
+        return
+    d.part_manifest.flush()
+    try:
+        if temp_path.stat().st_size == downloaded:
+            part_meta['hash_offset'] = downloaded
+            part_meta['hash_md5'] = hash_md5.hexdigest()
+            save_part_meta(temp_path, part_meta)
+    except Exception:
+        pass
+
+def _verify_md5(d, temp_path, hash_md5, md5):
+    """Check the streaming hash against the expected MD5, discarding the partial on mismatch."""
+    if hasattr(d, 'status_callback'):
+        d.status_callback("Verifying MD5 checksum...")
+    d.logger.info("Verifying MD5 checksum...")
+    start = time.monotonic()
+    with phase('verify'):
+        file_md5 = hash_md5.hexdigest()
+    VERIFY_SECONDS.observe(time.monotonic() - start, stage='md5')
+    if file_md5.lower() != md5.lower():
+        d.logger.error(f"MD5 mismatch: expected {md5}, got {file_md5}")
+        if hasattr(d, 'status_callback'):
+            d.status_callback("MD5 verification failed - file corrupted")
+        # Reset progress to 0%
+        if d.progress_callback:
+            d.progress_callback({
+                'total_size': 0,
+                'downloaded': 0,
+                'percent': 0
+            })
+        temp_path.unlink()
+        remove_part_meta(temp_path)
+        d.part_manifest.forget(md5)
+        return False
+    d.logger.info("MD5 checksum verified")
+    return True
+
+def _finish(d, temp_path, base_final_path, md5):
+    """Move a verified download into place, or hand it to the post-processing stage."""
+    if d.defer_finalize:
+        d.logger.info(f"Transfer finished: {base_final_path.name}, handing off for post-processing")
+        return PendingFinalize(temp_path, base_final_path, md5)
+
+    try:
+        return d.complete_download(temp_path, base_final_path, md5)
+    except FinalizeError as e:
+        # The download itself is fine, keep the .part so nothing has to be fetched again
+        d.logger.error(str(e))
+        if hasattr(d, 'status_callback'):
+            d.status_callback("Failed to move download into place")
+        return None
+
 def download_direct(d, download_url, title=None, total_size=None, supports_resume=True, resume_attempts=3, md5=None, subfolder=None):
     """Download a file directly from a URL with resume support.
 
@@ -26,7 +102,19 @@ def download_direct(d, download_url, title=None, total_size=None, supports_resum
         resume_attempts: Number of resume attempts
         md5: Expected MD5 hash for verification (optional)
         subfolder: Subfolder path to save file to (optional)
+
+    Returns the final path, or a PendingFinalize when d.defer_finalize is set
+    (the caller is then responsible for calling d.complete_download).
+
+    On failure d.last_failure says why ('stalled' when the mirror was too slow,
+    'rejected' when it served something other than the file, 'unavailable' when
+    its circuit breaker is open), so the orchestrator can move on to the next
+    mirror and resume there. On success d.last_speed is the transfer's average
+    speed in bytes/s, for the mirror scoreboard.
     """
+    d.last_failure = None
+    d.last_speed = None
+    end_phase('mirror_page')
     try:
         # Determine filename
         if not title:
@@ -59,31 +147,111 @@ def download_direct(d, download_url, title=None, total_size=None, supports_resum
             base_final_path = d.output_dir / filename
         final_path = d.get_unique_filename(base_final_path)
         temp_path = d.incomplete_dir / f"{final_path.name}.part"
+        if md5 and supports_resume:
+            tracked_path = d.part_manifest.lookup(md5)
+            if tracked_path:
+                # Pick up where this MD5 left off, even if the resolved filename changed since
+                temp_path = tracked_path
+            elif d.part_manifest.owner(temp_path) not in (None, md5):
+                # Another download with the same filename is paused here, don't clobber it
+                temp_path = d.incomplete_dir / f"{md5}-{final_path.name}.part"
         
-        # Check for partial download
+        # Check for partial download, and check it against its sidecar
         downloaded = 0
+        hash_md5 = hashlib.md5()
+        part_meta = load_part_meta(temp_path) if supports_resume else None
         if temp_path.exists() and supports_resume:
             downloaded = temp_path.stat().st_size
             d.logger.info(f"Found partial file: {downloaded}/{total_size if total_size else '?'} bytes")
-        
+
+            if part_meta and md5 and part_meta.get('md5') and part_meta['md5'] != md5.lower():
+                d.logger.warning("Partial file belongs to a different download, starting fresh")
+                downloaded = 0
+                part_meta = None
+            elif part_meta and total_size and part_meta.get('total_size') not in (None, total_size):
+                d.logger.warning("Partial file was for a different file size, starting fresh")
+                downloaded = 0
+                part_meta = None
+            else:
+                # Rebuild the streaming hash, checking the prefix against the last checkpoint
+                rebuilt = rehash_partial(temp_path, downloaded, part_meta)
+                if rebuilt is None:
+                    d.logger.warning("Partial file failed its hash checkpoint, starting fresh")
+                    downloaded = 0
+                    part_meta = None
+                else:
+                    hash_md5 = rebuilt
+                    if total_size is None and part_meta:
+                        total_size = part_meta.get('total_size')
+
+        if downloaded == 0:
+            temp_path.unlink(missing_ok=True)
+            remove_part_meta(temp_path)
+
+        # A partial that's already complete (e.g. interrupted while being moved) only needs finishing
+        if downloaded and total_size and downloaded == total_size:
+            d.logger.info("Partial file is already complete, skipping the transfer")
+            if md5 and not _verify_md5(d, temp_path, hash_md5, md5):
+                return None
+            return _finish(d, temp_path, base_final_path, md5)
+
         # Download with resume
         for attempt in range(resume_attempts):
+            transfer_start = downloaded
+            response = None
             try:
                 headers = {}
                 if downloaded > 0 and supports_resume:
                     headers['Range'] = f'bytes={downloaded}-'
-                    d.logger.info(f"Resuming from byte {downloaded}")
+                    # Validators are per-server; other mirrors are checked against the expected size instead
+                    validator = get_validator(part_meta) if part_meta and same_source(part_meta, download_url) else None
+                    if validator:
+                        headers['If-Range'] = validator
+                    d.logger.info(f"Resuming from byte {downloaded}{' (validated)' if validator else ''}")
 
-                response = d.session.get(download_url, headers=headers, stream=True, timeout=30)
+                with phase('ttfb', attempt=attempt + 1):
+                    response = d.session.get(download_url, headers=headers, stream=True, timeout=30)
 
+                restart_reason = None
                 if downloaded > 0 and response.status_code not in [200, 206]:
-                    d.logger.warning(f"Resume not supported (status {response.status_code}), starting fresh")
+                    restart_reason = f"Resume not supported (status {response.status_code})"
+                elif downloaded > 0 and response.status_code == 200:
+                    # Server ignored the Range header, or If-Range says the object changed
+                    restart_reason = "Mirror does not support resume or the file changed"
+                elif downloaded > 0 and response.status_code == 206:
+                    range_total = parse_content_range_total(response)
+                    expected_total = total_size or (part_meta or {}).get('total_size')
+                    if range_total and expected_total and range_total != expected_total:
+                        restart_reason = f"Mirror has a different file ({range_total} bytes, expected {expected_total})"
+
+                if restart_reason:
+                    d.logger.warning(f"{restart_reason}, starting fresh")
                     downloaded = 0
+                    # The size came from the partial, the fresh response has its own
+                    total_size = None
+                    hash_md5 = hashlib.md5()
                     temp_path.unlink(missing_ok=True)
-                    response = d.session.get(download_url, stream=True, timeout=30)
+                    remove_part_meta(temp_path)
+                    if response.status_code != 200:
+                        response.close()
+                        response = d.session.get(download_url, stream=True, timeout=30)
 
-                # Get total size
-                if total_size is None:
+                # Reject error pages before they touch the .part file
+                resumed = downloaded > 0 and response.status_code == 206
+                check_response_headers(response, file_ext)
+
+                reader = BlockReader(response, d.chunk_size)
+                head = b''
+                if not resumed:
+                    while len(head) < SNIFF_SIZE:
+                        block = reader.read(SNIFF_SIZE - len(head))
+                        if not block:
+                            break
+                        head += bytes(block)
+                    check_leading_bytes(head, file_ext)
+
+                # Get total size (Content-Length is the encoded size if the body is compressed)
+                if total_size is None and response.headers.get('Content-Encoding', 'identity').lower() == 'identity':
                     content_length = response.headers.get('Content-Length')
                     if content_length:
                         if response.status_code == 206:
@@ -91,8 +259,28 @@ def download_direct(d, download_url, title=None, total_size=None, supports_resum
                         else:
                             total_size = int(content_length)
                 
+                # Record where this partial came from, so a later resume can be validated
+                part_meta = {
+                    'url': download_url,
+                    'etag': response.headers.get('ETag') or (part_meta or {}).get('etag'),
+                    'last_modified': response.headers.get('Last-Modified') or (part_meta or {}).get('last_modified'),
+                    'total_size': total_size,
+                    'md5': md5.lower() if md5 else None,
+                    'hash_offset': downloaded,
+                    'hash_md5': hash_md5.hexdigest()
+                }
+                if supports_resume:
+                    save_part_meta(temp_path, part_meta)
+                    if md5:
+                        d.part_manifest.track(md5, temp_path, downloaded)
+                        d.part_manifest.flush()
+                last_checkpoint_time = time.time()
+
                 # Download
                 mode = 'ab' if downloaded > 0 else 'wb'
+                host = urlparse(download_url).hostname
+                transfer_start = downloaded
+                begin_phase('transfer', host=host)
 
                 # Track speed
                 start_time = time.time()
@@ -100,79 +288,137 @@ def download_direct(d, download_url, title=None, total_size=None, supports_resum
                 last_downloaded = downloaded
                 speed_samples = []  # Keep last few samples for smoothing
 
+                # Samples covering the stall window, for minimum-throughput checks
+                stall_samples = deque(maxlen=max(1, int(d.stall_window / 0.5)))
+
                 with open(temp_path, mode) as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-
-                            if d.progress_callback and total_size:
-                                current_time = time.time()
-                                time_diff = current_time - last_update_time
-
-                                # Update speed every 0.5 seconds to avoid excessive updates
-                                if time_diff >= 0.5:
-                                    bytes_diff = downloaded - last_downloaded
-                                    current_speed = bytes_diff / time_diff
-
-                                    # Keep last 5 samples for smoothing
-                                    speed_samples.append(current_speed)
-                                    if len(speed_samples) > 5:
-                                        speed_samples.pop(0)
-
-                                    # Average speed for smoother display
-                                    avg_speed = sum(speed_samples) / len(speed_samples)
-
-                                    percent = (downloaded / total_size) * 100
-                                    should_continue = d.progress_callback({
-                                        'total_size': total_size,
-                                        'downloaded': downloaded,
-                                        'percent': round(percent, 1),
-                                        'speed': int(avg_speed)
-                                    })
-
-                                    # Check if callback returned False (cancel signal)
-                                    if should_continue is False:
-                                        if hasattr(d, 'status_callback'):
-                                            d.status_callback("Stopping download...")
-                                        return None
-
-                                    last_update_time = current_time
-                                    last_downloaded = downloaded
-                
+                    block = head
+                    while True:
+                        if not block:
+                            block = reader.read()
+                            if not block:
+                                break
+
+                        f.write(block)
+                        hash_md5.update(block)
+                        downloaded += len(block)
+                        SHAPER.throttle(host, len(block))
+                        block = None
+
+                        # Everything else happens once per time slice, not per block
+                        current_time = time.time()
+                        time_diff = current_time - last_update_time
+                        if time_diff < 0.5:
+                            continue
+
+                        if md5 and supports_resume:
+                            d.part_manifest.track(md5, temp_path, downloaded)
+
+                        # Checkpoint the hash so an interrupted transfer can be validated on resume
+                        if supports_resume and current_time - last_checkpoint_time >= CHECKPOINT_INTERVAL:
+                            f.flush()
+                            part_meta['hash_offset'] = downloaded
+                            part_meta['hash_md5'] = hash_md5.hexdigest()
+                            save_part_meta(temp_path, part_meta)
+                            last_checkpoint_time = current_time
+
+                        bytes_diff = downloaded - last_downloaded
+                        DOWNLOAD_BYTES.inc(bytes_diff)
+                        current_speed = bytes_diff / time_diff
+                        reader.adapt(current_speed)
+
+                        # Keep last 5 samples for smoothing
+                        speed_samples.append(current_speed)
+                        if len(speed_samples) > 5:
+                            speed_samples.pop(0)
+
+                        # Average speed for smoother display
+                        avg_speed = sum(speed_samples) / len(speed_samples)
+
+                        # Give up on mirrors that trickle for the whole stall window
+                        # (a bandwidth limit below the minimum isn't the mirror's fault)
+                        stall_samples.append(current_speed)
+                        min_speed = d.min_speed
+                        bandwidth_limit = SHAPER.get_limit(host)
+                        if min_speed and bandwidth_limit:
+                            min_speed = min(min_speed, bandwidth_limit // 2)
+                        if min_speed and current_time - start_time >= d.stall_window:
+                            window_speed = sum(stall_samples) / len(stall_samples)
+                            if window_speed < min_speed:
+                                raise StalledTransfer(
+                                    f"{int(window_speed / 1024)} KB/s over the last {d.stall_window}s "
+                                    f"is below the {int(min_speed / 1024)} KB/s minimum"
+                                )
+
+                        if d.progress_callback and total_size:
+                            percent = (downloaded / total_size) * 100
+                            should_continue = d.progress_callback({
+                                'total_size': total_size,
+                                'downloaded': downloaded,
+                                'percent': round(percent, 1),
+                                'speed': int(avg_speed)
+                            })
+
+                            # Check if callback returned False (cancel signal)
+                            if should_continue is False:
+                                if hasattr(d, 'status_callback'):
+                                    d.status_callback("Stopping download...")
+                                response.close()
+                                return None
+
+                        last_update_time = current_time
+                        last_downloaded = downloaded
+
+                # The body was read to its end, so this hands the connection back to the pool
+                response.close()
+
+                # Whatever arrived since the last time slice
+                DOWNLOAD_BYTES.inc(downloaded - last_downloaded)
+                transfer_time = time.time() - start_time
+                transfer_speed = (downloaded - transfer_start) / transfer_time if transfer_time > 0 else None
+
+                if md5 and supports_resume:
+                    d.part_manifest.track(md5, temp_path, downloaded)
+
                 # Verify complete
                 if total_size and downloaded < total_size:
                     raise Exception(f"Incomplete download: {downloaded}/{total_size} bytes")
 
-                # Verify MD5 hash if provided
-                if md5:
-                    if hasattr(d, 'status_callback'):
-                        d.status_callback("Verifying MD5 checksum...")
-                    d.logger.info("Verifying MD5 checksum...")
-                    file_md5 = calculate_md5(temp_path)
-                    if file_md5.lower() != md5.lower():
-                        d.logger.error(f"MD5 mismatch: expected {md5}, got {file_md5}")
-                        if hasattr(d, 'status_callback'):
-                            d.status_callback("MD5 verification failed - file corrupted")
-                        # Reset progress to 0%
-                        if d.progress_callback:
-                            d.progress_callback({
-                                'total_size': 0,
-                                'downloaded': 0,
-                                'percent': 0
-                            })
-                        temp_path.unlink()
-                        return None
-                    d.logger.info("MD5 checksum verified")
+                end_phase('transfer', bytes=downloaded - transfer_start)
+                if md5 and not _verify_md5(d, temp_path, hash_md5, md5):
+                    return None
+                d.last_speed = transfer_speed
+                return _finish(d, temp_path, base_final_path, md5)
+
+            except ContentMismatch as e:
+                # The mirror will keep serving the same page, so don't retry it
+                d.logger.warning(f"Rejected response from mirror: {e}")
+                if hasattr(d, 'status_callback'):
+                    d.status_callback("Mirror returned an invalid file, switching mirror...")
+                response.close()
+                d.last_failure = 'rejected'
+                return None
 
-                # Move to final location
-                final_path.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(temp_path), str(final_path))
+            except StalledTransfer as e:
+                # Retrying the same slow mirror won't help - keep the .part so the next one can resume
+                d.logger.warning(f"Transfer stalled: {e}, abandoning mirror")
+                if hasattr(d, 'status_callback'):
+                    d.status_callback("Mirror too slow, switching mirror...")
+                response.close()
+                _checkpoint(d, temp_path, part_meta, downloaded, hash_md5, supports_resume)
+                d.last_failure = 'stalled'
+                return None
 
-                d.logger.info(f"Downloaded: {final_path.name}")
-                return final_path
-                
-            except requests.exceptions.ChunkedEncodingError:
+            except HostUnavailable as e:
+                # Known to be down, retrying would only be turned away again
+                d.logger.warning(f"{e}, switching mirror")
+                _checkpoint(d, temp_path, part_meta, downloaded, hash_md5, supports_resume)
+                d.last_failure = 'unavailable'
+                return None
+
+            except (requests.exceptions.ChunkedEncodingError, urllib3.exceptions.ProtocolError):
+                # The body ended before its Content-Length or chunked framing said it would
+                _checkpoint(d, temp_path, part_meta, downloaded, hash_md5, supports_resume)
                 if attempt < resume_attempts - 1 and supports_resume:
                     d.logger.warning(f"Connection interrupted, resuming (attempt {attempt + 1}/{resume_attempts})")
                     time.sleep(2 ** attempt)
@@ -182,10 +428,18 @@ def download_direct(d, download_url, title=None, total_size=None, supports_resum
                     
             except Exception as e:
                 d.logger.error(f"Download error: {e}")
+                _checkpoint(d, temp_path, part_meta, downloaded, hash_md5, supports_resume)
                 if attempt < resume_attempts - 1 and supports_resume:
                     time.sleep(2 ** attempt)
                     continue
                 return None
+
+            finally:
+                # No-op when the transfer finished (or never started)
+                end_phase('transfer', bytes=downloaded - transfer_start)
+                # Frees the host's slot before a retry asks for one again
+                if response is not None:
+                    response.close()
         
         return None
         
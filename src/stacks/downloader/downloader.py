@@ -1,21 +1,39 @@
 import logging
-import requests
 from pathlib import Path
 from stacks.utils.md5utils import extract_md5
 from stacks.utils.domainutils import get_working_domain
+from stacks.downloader.connections import mount_pools, preconnect
 from stacks.downloader.cookies import _load_cached_cookies, _save_cookies_to_cache, _prewarm_cookies
 from stacks.downloader.direct import download_direct
 from stacks.downloader.fast_download import try_fast_download, get_fast_download_info, refresh_fast_download_info
+from stacks.downloader.finalize import detect_filesystem_layout, finalize_download, complete_download
 from stacks.downloader.flaresolver import solve_with_flaresolverr
-from stacks.downloader.html import get_download_links, parse_download_link_from_html
+from stacks.downloader.html import get_download_links, get_page_info, parse_download_link_from_html
+from stacks.downloader.manifest import PartManifest
 from stacks.downloader.mirrors import download_from_mirror
 from stacks.downloader.orchestrator import orchestrate_download
+from stacks.downloader.politeness import PoliteSession, predict_next_host
+from stacks.downloader.page_cache import _load_cached_page, _save_page_to_cache, _invalidate_page_cache, _reparse_cached_page, _prune_page_cache
 from stacks.downloader.utils import get_unique_filename
 
+# Settings configure() sets as they are:
+#   flaresolverr_timeout  ms
+#   prefer_title_naming, include_hash  ("none", "prefix" or "suffix")
+#   page_cache_ttl        seconds the /md5/ page cache is used for (0 disables it)
+#   min_speed, stall_window  abandon a mirror below min_speed bytes/s for stall_window seconds
+#   chunk_size            bytes, the largest single read and write of a transfer
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'
+CONFIGURABLE_SETTINGS = (
+    'flaresolverr_timeout', 'prefer_title_naming', 'include_hash', 'page_cache_ttl',
+    'min_speed', 'stall_window', 'chunk_size'
+)
+
 class AnnaDownloader:
     def __init__(self, output_dir="./downloads", incomplete_dir=None, progress_callback=None,
                  fast_download_config=None, flaresolverr_url=None, flaresolverr_timeout=60000,
-                 status_callback=None, prefer_title_naming=False, include_hash="none"):
+                 status_callback=None, prefer_title_naming=False, include_hash="none", page_cache_ttl=86400,
+                 min_speed=0, stall_window=60, defer_finalize=False, chunk_size=1024 * 1024):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -25,50 +43,78 @@ class AnnaDownloader:
             self.incomplete_dir = self.output_dir / "incomplete"
         self.incomplete_dir.mkdir(parents=True, exist_ok=True)
 
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36'
-        })
+        # Partial downloads in incomplete_dir, indexed by MD5
+        self.part_manifest = PartManifest(self.incomplete_dir)
+
+        # Every request goes through the per-host politeness scheduler, on pooled keep-alive
+        # connections, with timeouts that follow each host's latency
+        self.session = mount_pools(PoliteSession(), adaptive_timeouts=True)
+        self.session.headers.update({'User-Agent': USER_AGENT})
         self.logger = logging.getLogger('stacks_downloader')
         self.progress_callback = progress_callback
         self.status_callback = status_callback
         
-        # Fast download configuration
-        self.fast_download_config = fast_download_config or {}
-        self.fast_download_enabled = self.fast_download_config.get('enabled', False)
-        self.fast_download_key = self.fast_download_config.get('key')
-        
-        # Fast download state
-        self.fast_download_info = {
-            'available': bool(self.fast_download_enabled and self.fast_download_key),
-            'downloads_left': None,
-            'downloads_per_day': None,
-            'last_refresh': 0
-        }
-        
         self.fast_download_refresh_cooldown = 3600  # 1 hour
-        
-        # FlareSolverr configuration
-        # Normalize URL: add http:// if no scheme is present
-        if flaresolverr_url and not flaresolverr_url.startswith(('http://', 'https://')):
-            flaresolverr_url = f"http://{flaresolverr_url}"
-
-        self.flaresolverr_url = flaresolverr_url
-        self.flaresolverr_timeout = flaresolverr_timeout
-
-        # Filename preference configuration
-        self.prefer_title_naming = prefer_title_naming
-        self.include_hash = include_hash  # "none", "prefix", or "suffix"
-
-        if flaresolverr_url:
-            self.logger.info(f"FlareSolverr enabled: {flaresolverr_url}")
-            self.logger.info("Using ALL download sources (Anna's Archive slow_download + external mirrors)")
-        else:
-            self.logger.info("FlareSolverr not configured - using external mirrors and slow_download with cached cookies")
+        self.last_failure = None
+        self.last_speed = None
+
+        self.configure(
+            fast_download_config=fast_download_config or {},
+            flaresolverr_url=flaresolverr_url,
+            flaresolverr_timeout=flaresolverr_timeout,
+            prefer_title_naming=prefer_title_naming,
+            include_hash=include_hash,
+            page_cache_ttl=page_cache_ttl,
+            min_speed=min_speed,
+            stall_window=stall_window,
+            chunk_size=chunk_size
+        )
+
+        # Return a PendingFinalize instead of moving finished downloads into place ourselves
+        self.defer_finalize = defer_finalize
 
         # Always try to load cached cookies (useful for slow_download even without FlareSolverr)
         self.load_cached_cookies()
+
+        # Drop page cache entries that expired while we weren't looking
+        self.prune_page_cache()
+
+        # Rename or copy finished downloads into place, depending on the mount layout
+        detect_filesystem_layout(self)
     
+    def configure(self, **settings):
+        """
+        Apply settings (any of the constructor's, except the folders and
+        callbacks) to this downloader in place, keeping its session, cookies
+        and connections. A download in progress picks them up as it goes.
+        """
+        for name, value in settings.items():
+            if name == 'fast_download_config':
+                self.fast_download_config = value
+                self.fast_download_enabled = value.get('enabled', False)
+                self.fast_download_key = value.get('key')
+                # Unknown until the new key is checked
+                self.fast_download_info = {
+                    'available': bool(self.fast_download_enabled and self.fast_download_key),
+                    'downloads_left': None,
+                    'downloads_per_day': None,
+                    'last_refresh': 0
+                }
+            elif name == 'flaresolverr_url':
+                # Normalize URL: add http:// if no scheme is present
+                if value and not value.startswith(('http://', 'https://')):
+                    value = f"http://{value}"
+                self.flaresolverr_url = value
+                if value:
+                    self.logger.info(f"FlareSolverr enabled: {value}")
+                    self.logger.info("Using ALL download sources (Anna's Archive slow_download + external mirrors)")
+                else:
+                    self.logger.info("FlareSolverr not configured - using external mirrors and slow_download with cached cookies")
+            elif name in CONFIGURABLE_SETTINGS:
+                setattr(self, name, value)
+            else:
+                raise TypeError(f"Can't change {name} on a running downloader")
+
     # Cookies
     def load_cached_cookies(self, domain=None):
         return _load_cached_cookies(self, domain)
@@ -80,14 +126,43 @@ class AnnaDownloader:
         return _prewarm_cookies(self)
     
     
+    # Page cache
+    def load_cached_page(self, md5):
+        return _load_cached_page(self, md5)
+
+    def save_page_to_cache(self, md5, meta, html_content=None):
+        return _save_page_to_cache(self, md5, meta, html_content)
+
+    def invalidate_page_cache(self, md5=None):
+        return _invalidate_page_cache(self, md5)
+
+    def reparse_cached_page(self, md5):
+        return _reparse_cached_page(self, md5)
+
+    def prune_page_cache(self):
+        return _prune_page_cache(self)
+
+
     # Direct
     def download_direct(self, download_url, title=None, total_size=None, supports_resume=True, resume_attempts=3, md5=None, subfolder=None):
         return download_direct(self, download_url, title, total_size, supports_resume, resume_attempts, md5, subfolder)
+
+    def finalize_download(self, temp_path, base_final_path):
+        return finalize_download(self, temp_path, base_final_path)
+
+    def complete_download(self, temp_path, base_final_path, md5=None):
+        return complete_download(self, temp_path, base_final_path, md5)
     
     
     # Download orchestrator
     def download(self, input_string, prefer_mirror=None, resume_attempts=3, filename=None, links=None, subfolder=None):
         return orchestrate_download(self, input_string, prefer_mirror, resume_attempts, filename, links, subfolder)
+
+    def predict_next_host(self, mirror_host=None):
+        return predict_next_host(self, mirror_host)
+
+    def preconnect(self, url):
+        return preconnect(self, url)
  
  
     # Fast Download
@@ -112,6 +187,9 @@ class AnnaDownloader:
 
     def get_download_links(self, md5):
         return get_download_links(self, md5)
+
+    def get_page_info(self, md5):
+        return get_page_info(self, md5)
     
     
     # Mirrors
@@ -129,8 +207,36 @@ class AnnaDownloader:
     def cleanup(self):
         """Cleanup resources (close session, etc.)"""
         try:
+            self.part_manifest.flush()
             if hasattr(self, 'session') and self.session:
                 self.logger.info("Closing HTTP session...")
                 self.session.close()
         except Exception as e:
-            self.logger.error(f"Error during cleanup: {e}")
\ No newline at end of file
+            self.logger.error(f"Error during cleanup: {e}")
+
+class PageLookup:
+    """
+    Looks up /md5/ pages on its own session, for the queue lookahead.
+
+    Runs next to a downloader that's busy downloading, so it keeps none of its
+    state: no cookies, no per-download fields. The page cache on disk, the
+    politeness scheduler and the circuit breakers are shared.
+    """
+
+    def __init__(self, page_cache_ttl=86400):
+        self.session = mount_pools(PoliteSession(), adaptive_timeouts=True)
+        self.session.headers.update({'User-Agent': USER_AGENT})
+        self.logger = logging.getLogger('stacks_downloader')
+        self.page_cache_ttl = page_cache_ttl
+
+    def load_cached_page(self, md5):
+        return _load_cached_page(self, md5)
+
+    def save_page_to_cache(self, md5, meta, html_content=None):
+        return _save_page_to_cache(self, md5, meta, html_content)
+
+    def get_page_info(self, md5):
+        return get_page_info(self, md5)
+
+    def cleanup(self):
+        self.session.close()
@@ -0,0 +1,218 @@
+import os
+import errno
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+from stacks.downloader.resume import remove_part_meta
+from stacks.downloader.timeline import phase
+from stacks.utils.metrics import VERIFY_SECONDS
+
+# Bytes handed to the kernel per copy call, small enough for regular progress updates
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Errors that mean an in-kernel copy isn't available for this pair of files
+UNSUPPORTED_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF)
+
+# Held while a destination name is picked and the file renamed onto it, so two
+# post-processing workers finishing books with the same name don't both take it
+_claim_lock = threading.Lock()
+
+class FinalizeError(Exception):
+    """Raised when a finished download can't be moved into place."""
+
+class PendingFinalize:
+    """A verified download whose move into place was handed to the post-processing stage."""
+
+    def __init__(self, temp_path, base_final_path, md5=None):
+        self.temp_path = temp_path
+        self.base_final_path = base_final_path
+        self.md5 = md5
+
+    @property
+    def name(self):
+        return self.base_final_path.name
+
+    def __str__(self):
+        return str(self.base_final_path)
+
+def get_device(path):
+    """Get the device id of the filesystem holding path (or its nearest existing parent)."""
+    path = Path(path)
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path.stat().st_dev
+
+def detect_filesystem_layout(d):
+    """
+    Check whether the incomplete folder is on the same filesystem as the output folder.
+
+    Called once at startup; when they match, finished downloads are renamed into place.
+    """
+    try:
+        d.incomplete_device = get_device(d.incomplete_dir)
+        d.output_device = get_device(d.output_dir)
+    except OSError as e:
+        d.logger.warning(f"Could not check filesystem layout: {e}")
+        d.incomplete_device = d.output_device = None
+
+    if d.incomplete_device is not None and d.incomplete_device == d.output_device:
+        d.logger.debug("Incomplete and output folders share a filesystem, finished downloads will be renamed into place")
+    else:
+        d.logger.info("Incomplete folder is on a different filesystem, finished downloads will be copied into place")
+
+def _is_same_filesystem(d, destination_dir):
+    if d.incomplete_device is None:
+        return False
+    # Subfolders can be separate mounts too, only trust the startup check for the output folder itself
+    if destination_dir == d.output_dir:
+        return d.incomplete_device == d.output_device
+    try:
+        return d.incomplete_device == get_device(destination_dir)
+    except OSError:
+        return False
+
+def _copy_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+def _read_write(src_fd, dst_fd, offset, count):
+    data = os.pread(src_fd, min(count, 1024 * 1024), offset)
+    written = 0
+    while written < len(data):
+        written += os.write(dst_fd, data[written:])
+    return written
+
+def copy_file(d, src, dst, size):
+    """
+    Copy src to dst in the kernel where possible, reporting progress.
+
+    Tries copy_file_range, then sendfile, then a plain read/write loop.
+    The destination is fsynced before returning.
+    """
+    methods = [(method, name) for method, name in (
+        (_copy_range, 'copy_file_range'),
+        (_sendfile, 'sendfile')
+    ) if hasattr(os, name)] + [(_read_write, 'read/write')]
+
+    last_update = time.time()
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        src_fd = src_file.fileno()
+        dst_fd = dst_file.fileno()
+        offset = 0
+        method, method_name = methods.pop(0)
+        while offset < size:
+            try:
+                copied = method(src_fd, dst_fd, offset, min(COPY_CHUNK_SIZE, size - offset))
+            except OSError as e:
+                # Only fall back before anything was written, so the destination never has gaps
+                if e.errno in UNSUPPORTED_COPY_ERRORS and offset == 0 and methods:
+                    d.logger.debug(f"{method_name} not supported here ({e}), falling back")
+                    method, method_name = methods.pop(0)
+                    continue
+                raise
+            if copied == 0:
+                break
+            offset += copied
+            # Sendfile and copy_file_range don't move the destination's file position
+            if method is not _read_write:
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+
+            current_time = time.time()
+            if current_time - last_update >= 0.5 and hasattr(d, 'status_callback'):
+                d.status_callback(f"Moving to library... {offset * 100 // size}%")
+                last_update = current_time
+
+        dst_file.flush()
+        os.fsync(dst_fd)
+    return offset
+
+def finalize_download(d, temp_path, base_final_path):
+    """
+    Move a finished, verified .part file to its final location.
+
+    Renames atomically when the incomplete and destination folders share a
+    filesystem. Otherwise the file is copied next to the destination, fsynced,
+    checked for size and renamed into place. The download was already hashed
+    while streaming, so the copy is not hashed again.
+
+    Args:
+        d: Downloader instance
+        temp_path: Path to the finished .part file
+        base_final_path: Wanted destination path (made unique at move time)
+
+    Returns:
+        Path the file ended up at
+
+    Raises:
+        FinalizeError
+    """
+    base_final_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if _is_same_filesystem(d, base_final_path.parent):
+        try:
+            # Something may have claimed the name while we were downloading
+            with _claim_lock:
+                final_path = d.get_unique_filename(base_final_path)
+                os.replace(temp_path, final_path)
+            return final_path
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise FinalizeError(f"Failed to move {temp_path.name} into place: {e}")
+            d.logger.debug("Rename crossed a filesystem boundary, copying instead")
+
+    temp_stat = temp_path.stat()
+    size = temp_stat.st_size
+    if hasattr(d, 'status_callback'):
+        d.status_callback("Moving to library...")
+    d.logger.info(f"Copying {base_final_path.name} to the library ({size} bytes)")
+
+    try:
+        # Each job copies into its own hidden file next to the destination
+        fd, copy_name = tempfile.mkstemp(prefix=f".{base_final_path.name}.", suffix='.stacks-tmp', dir=base_final_path.parent)
+        os.close(fd)
+        # mkstemp makes it private, keep the permissions the .part file was given
+        os.chmod(copy_name, stat.S_IMODE(temp_stat.st_mode))
+    except OSError as e:
+        raise FinalizeError(f"Failed to copy {base_final_path.name} into place: {e}")
+    copy_path = Path(copy_name)
+
+    try:
+        copied = copy_file(d, temp_path, copy_path, size)
+        if copied != size or copy_path.stat().st_size != size:
+            raise FinalizeError(f"Copy of {base_final_path.name} is incomplete: {copied}/{size} bytes")
+        with _claim_lock:
+            final_path = d.get_unique_filename(base_final_path)
+            os.replace(copy_path, final_path)
+    except FinalizeError:
+        copy_path.unlink(missing_ok=True)
+        raise
+    except OSError as e:
+        copy_path.unlink(missing_ok=True)
+        raise FinalizeError(f"Failed to copy {base_final_path.name} into place: {e}")
+
+    temp_path.unlink(missing_ok=True)
+    return final_path
+
+def complete_download(d, temp_path, base_final_path, md5=None):
+    """
+    Move a finished download into place and drop its resume bookkeeping.
+
+    Returns:
+        Path the file ended up at
+
+    Raises:
+        FinalizeError
+    """
+    start = time.monotonic()
+    with phase('finalize'):
+        final_path = finalize_download(d, temp_path, base_final_path)
+    VERIFY_SECONDS.observe(time.monotonic() - start, stage='finalize')
+    remove_part_meta(temp_path)
+    if md5:
+        d.part_manifest.forget(md5)
+    d.logger.info(f"Downloaded: {final_path.name}")
+    return final_path
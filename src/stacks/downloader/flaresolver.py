@@ -1,5 +1,9 @@
+import time
 import requests
 from urllib.parse import urlparse
+from stacks.downloader.connections import SHARED_SESSION
+from stacks.downloader.timeline import begin_phase, end_phase
+from stacks.utils.metrics import FLARESOLVERR_SOLVES, FLARESOLVERR_SECONDS
 
 def solve_with_flaresolverr(d, url):
     """Use FlareSolverr to bypass DDoS-Guard/Cloudflare protection."""
@@ -8,6 +12,8 @@ def solve_with_flaresolverr(d, url):
     
     d.logger.info("Using FlareSolverr to solve protection challenge...")
     
+    start = time.monotonic()
+    begin_phase('flaresolverr')
     try:
         payload = {
             "cmd": "request.get",
@@ -15,7 +21,7 @@ def solve_with_flaresolverr(d, url):
             "maxTimeout": d.flaresolverr_timeout
         }
         
-        response = requests.post(
+        response = SHARED_SESSION.post(
             f"{d.flaresolverr_url}/v1",
             json=payload,
             timeout=d.flaresolverr_timeout / 1000 + 10
@@ -23,8 +29,10 @@ def solve_with_flaresolverr(d, url):
         response.raise_for_status()
         
         data = response.json()
+        FLARESOLVERR_SECONDS.observe(time.monotonic() - start)
         
         if data.get('status') == 'ok':
+            FLARESOLVERR_SOLVES.inc(outcome='success')
             solution = data.get('solution', {})
             cookies_list = solution.get('cookies', [])
             cookies_dict = {cookie['name']: cookie['value'] for cookie in cookies_list}
@@ -44,13 +52,18 @@ def solve_with_flaresolverr(d, url):
 
             return True, cookies_dict, html_content
         else:
+            FLARESOLVERR_SOLVES.inc(outcome='failure')
             error_msg = data.get('message', 'Unknown error')
             d.logger.error(f"FlareSolverr failed: {error_msg}")
             return False, {}, None
             
     except requests.Timeout:
+        FLARESOLVERR_SOLVES.inc(outcome='timeout')
         d.logger.error("FlareSolverr timeout")
         return False, {}, None
     except Exception as e:
+        FLARESOLVERR_SOLVES.inc(outcome='error')
         d.logger.error(f"FlareSolverr error: {e}")
-        return False, {}, None
\ No newline at end of file
+        return False, {}, None
+    finally:
+        end_phase('flaresolverr')
\ No newline at end of file
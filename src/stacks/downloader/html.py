@@ -1,10 +1,14 @@
 import re
 from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup
 from stacks.downloader.sites.zlib import parse_zlib_download_link, is_zlib_domain
+from stacks.downloader.timeline import annotate_phase
 from stacks.constants import LEGAL_FILES, ANNAS_ARCHIVE_DOMAINS
 from stacks.utils.domainutils import get_working_domain, try_domains_until_success
 
+# File sizes as shown on /md5/ pages
+RE_FILE_SIZE = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMGT]?B)$', re.IGNORECASE)
+SIZE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
 def parse_download_link_from_html(d, html_content, md5, mirror_url=None):
         """
         Parse HTML to extract the actual download link.
@@ -30,6 +34,8 @@ def parse_download_link_from_html(d, html_content, md5, mirror_url=None):
                 d.logger.debug("Z-Library scraper didn't find link, falling back to generic parser")
 
         # Fall back to generic parsing
+        # Imported here, bs4 takes longer to load than the rest of the server
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(html_content, 'html.parser')
         
         # Get first 12 chars of MD5 - this is what appears in download URLs
@@ -120,212 +126,295 @@ def parse_download_link_from_html(d, html_content, md5, mirror_url=None):
 
         return None
     
-def _get_download_links_single_domain(d, md5, domain):
-    """Get download links from Anna's Archive using a specific domain."""
-    url = f"https://{domain}/md5/{md5}"
-
-    d.logger.debug(f"Fetching download links from {domain}")
+def _extract_from_filepath(d, soup):
+    """Extract the original filename from the Filepath metadata tabs."""
+    filepath_elements = soup.find_all('a', class_='js-md5-codes-tabs-tab')
+    for element in filepath_elements:
+        # Look for the span that says "Filepath"
+        label_span = element.find('span', class_='bg-[#aaa]')
+        if label_span and 'Filepath' in label_span.get_text():
+            # Get the actual filepath from the second span
+            filepath_span = element.find_all('span')[1] if len(element.find_all('span')) > 1 else None
+            if filepath_span:
+                filepath_text = filepath_span.get_text().strip()
+
+                # First, handle Windows-style paths (R:\...\filename)
+                if '\\' in filepath_text:
+                    filename = filepath_text.split('\\')[-1]
+                # Then handle Unix-style paths (lgli/filename or lgrsfic/filename)
+                elif '/' in filepath_text:
+                    filename = filepath_text.split('/')[-1]
+                else:
+                    filename = filepath_text
+
+                # URL decode the filename (replace + with space, etc.)
+                filename = filename.replace('+', ' ')
+
+                # If we found a valid filename, use it
+                if filename and filename.strip():
+                    d.logger.info(f"Extracted filename from Filepath metadata: {filename}")
+                    return filename
+    return None
+
+def _find_metadata_div(soup):
+    """Find the block listing language, format, size and so on, separated by middle dots."""
+    return soup.find('div', class_=lambda x: x and 'text-gray-800' in x and 'font-semibold' in x and 'text-sm' in x and 'mt-4' in x)
+
+def _extract_size(d, soup):
+    """Extract the file size in bytes from the metadata block (e.g. "2.3MB")."""
+    metadata_div = _find_metadata_div(soup)
+    if not metadata_div:
+        return None
 
-    try:
-        response = d.session.get(url, timeout=30)
-        response.raise_for_status()
+    metadata_text = metadata_div.get_text(separator=' ', strip=True)
+    for part in metadata_text.split('·'):
+        match = RE_FILE_SIZE.match(part.strip())
+        if match:
+            size = int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+            d.logger.debug(f"Extracted size from metadata: {size} bytes")
+            return size
+    return None
+
+def _extract_title_and_extension(d, soup):
+    """Extract the book title and file extension from the book info block."""
+    # Try to extract title from the book info div
+    title_div = soup.find('div', class_=lambda x: x and 'font-semibold' in x and 'text-2xl' in x and 'leading-[1.2]' in x)
+    title = None
+    extension = None
+
+    if title_div:
+        # Get text content without nested tags (like the search icon link)
+        title = title_div.get_text(strip=True)
+        # Remove the search emoji if present
+        title = title.replace('🔍', '').strip()
+        d.logger.info(f"Extracted title from book info div: {title}")
+    else:
+        d.logger.warning("Could not find title div with required classes")
+
+    # Try to extract file extension from the metadata div
+    metadata_div = _find_metadata_div(soup)
+
+    if metadata_div:
+        # Get the text and split by middle dot (·)
+        metadata_text = metadata_div.get_text(separator=' ', strip=True)
+        parts = [part.strip() for part in metadata_text.split('·')]
+
+        # Look for a part that matches our legal file extensions
+        for part in parts:
+            part_upper = part.upper()
+            for legal_ext in LEGAL_FILES:
+                # Check if this part is the extension (e.g., "PDF", "EPUB")
+                if part_upper == legal_ext.upper().replace('.', ''):
+                    extension = legal_ext
+                    d.logger.info(f"Extracted extension from metadata: {extension}")
+                    break
+            if extension:
+                break
+
+    return title, extension
+
+def _filename_from_title(d, title, extension):
+    """Build a filename from an extracted title and extension."""
+    if title and extension:
+        # Clean title of invalid filename characters
+        title = re.sub(r'[<>:"/\\|?*]', '_', title)
+        # Strip trailing periods and spaces to avoid double extensions like "title..pdf"
+        title = title.rstrip('. ')
+        return f"{title}{extension}"
+    elif title:
+        # No extension found, just use title
+        d.logger.warning("Could not extract file extension from metadata")
+        return title
+    else:
+        # No title found
+        return None
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Helper function to extract filename from Filepath metadata
-        def extract_from_filepath():
-            filepath_elements = soup.find_all('a', class_='js-md5-codes-tabs-tab')
-            for element in filepath_elements:
-                # Look for the span that says "Filepath"
-                label_span = element.find('span', class_='bg-[#aaa]')
-                if label_span and 'Filepath' in label_span.get_text():
-                    # Get the actual filepath from the second span
-                    filepath_span = element.find_all('span')[1] if len(element.find_all('span')) > 1 else None
-                    if filepath_span:
-                        filepath_text = filepath_span.get_text().strip()
-
-                        # First, handle Windows-style paths (R:\...\filename)
-                        if '\\' in filepath_text:
-                            filename = filepath_text.split('\\')[-1]
-                        # Then handle Unix-style paths (lgli/filename or lgrsfic/filename)
-                        elif '/' in filepath_text:
-                            filename = filepath_text.split('/')[-1]
-                        else:
-                            filename = filepath_text
-
-                        # URL decode the filename (replace + with space, etc.)
-                        filename = filename.replace('+', ' ')
-
-                        # If we found a valid filename, use it
-                        if filename and filename.strip():
-                            d.logger.info(f"Extracted filename from Filepath metadata: {filename}")
-                            return filename
-            return None
+def compose_filename(d, md5, meta):
+    """
+    Pick the filename for a download from parsed page metadata.
 
-        # Helper function to extract filename from page title
-        def extract_from_title():
-            # Try to extract title from the book info div
-            title_div = soup.find('div', class_=lambda x: x and 'font-semibold' in x and 'text-2xl' in x and 'leading-[1.2]' in x)
-            title = None
-            extension = None
-
-            if title_div:
-                # Get text content without nested tags (like the search icon link)
-                title = title_div.get_text(strip=True)
-                # Remove the search emoji if present
-                title = title.replace('🔍', '').strip()
-                d.logger.info(f"Extracted title from book info div: {title}")
-            else:
-                d.logger.warning("Could not find title div with required classes")
-
-            # Try to extract file extension from the metadata div
-            metadata_div = soup.find('div', class_=lambda x: x and 'text-gray-800' in x and 'font-semibold' in x and 'text-sm' in x and 'mt-4' in x)
-
-            if metadata_div:
-                # Get the text and split by middle dot (·)
-                metadata_text = metadata_div.get_text(separator=' ', strip=True)
-                parts = [part.strip() for part in metadata_text.split('·')]
-
-                # Look for a part that matches our legal file extensions
-                for part in parts:
-                    part_upper = part.upper()
-                    for legal_ext in LEGAL_FILES:
-                        # Check if this part is the extension (e.g., "PDF", "EPUB")
-                        if part_upper == legal_ext.upper().replace('.', ''):
-                            extension = legal_ext
-                            d.logger.info(f"Extracted extension from metadata: {extension}")
-                            break
-                    if extension:
-                        break
-
-            # Construct the filename
-            if title and extension:
-                # Clean title of invalid filename characters
-                title = re.sub(r'[<>:"/\\|?*]', '_', title)
-                # Strip trailing periods and spaces to avoid double extensions like "title..pdf"
-                title = title.rstrip('. ')
-                return f"{title}{extension}"
-            elif title:
-                # No extension found, just use title
-                d.logger.warning("Could not extract file extension from metadata")
-                return title
-            else:
-                # No title found
-                return None
-
-        # Try extraction methods based on user preference
-        filename = None
-        if d.prefer_title_naming:
-            # Prefer title-based naming
-            d.logger.info("Using title-based filename extraction (preferred)")
-            filename = extract_from_title()
-            if not filename or filename == "Unknown":
-                d.logger.warning("Title extraction failed, falling back to filepath metadata")
-                filename = extract_from_filepath()
-        else:
-            # Prefer filepath metadata (default)
-            filename = extract_from_filepath()
-            if not filename:
-                d.logger.warning("No Filepath metadata found, falling back to title extraction")
-                filename = extract_from_title()
-
-        # Final fallback - use MD5 hash in filename
+    Applied on every lookup rather than at parse time, so naming settings
+    take effect for cached pages too.
+    """
+    filepath_name = meta.get('filepath_name')
+    title_name = _filename_from_title(d, meta.get('title'), meta.get('extension'))
+
+    # Try extraction methods based on user preference
+    filename = None
+    if d.prefer_title_naming:
+        # Prefer title-based naming
+        d.logger.info("Using title-based filename extraction (preferred)")
+        filename = title_name
+        if not filename or filename == "Unknown":
+            d.logger.warning("Title extraction failed, falling back to filepath metadata")
+            filename = filepath_name
+    else:
+        # Prefer filepath metadata (default)
+        filename = filepath_name
         if not filename:
-            d.logger.warning("No filename found, falling back to Unknown")
-            filename = f"Unknown ({md5})"
-        elif d.include_hash == "prefix":
-            filename = f"{md5} - {filename}"
-        elif d.include_hash == "suffix":
-            filename = f"{filename} - {md5}"
+            d.logger.warning("No Filepath metadata found, falling back to title extraction")
+            filename = title_name
 
+    # Final fallback - use MD5 hash in filename
+    if not filename:
+        d.logger.warning("No filename found, falling back to Unknown")
+        filename = f"Unknown ({md5})"
+    elif d.include_hash == "prefix":
+        filename = f"{md5} - {filename}"
+    elif d.include_hash == "suffix":
+        filename = f"{filename} - {md5}"
 
-        links = []
-        
-        # Find the downloads panel
-        downloads_panel = soup.find('div', id='md5-panel-downloads')
-        if not downloads_panel:
-            d.logger.warning("Could not find downloads panel on page")
-            return filename, links
-        
-        # Slow_download links - only accept "no waitlist" ones
-        for li in downloads_panel.find_all('li', class_='list-disc'):
-            a = li.find('a', href=True)
-            if not a:
-                continue
-            
-            href = a['href']
-            li_text = li.get_text().strip()
-            
-            # Skip fast_download links (we handle those via API)
-            if '/fast_download/' in href:
-                continue
-            
-            # Only accept slow_download links
-            if '/slow_download/' in href:
-                # Skip waitlist servers (they have 60-second JavaScript countdown)
-                if 'slightly faster but with waitlist' in li_text.lower():
-                    d.logger.debug(f"Skipping waitlist server: {a.get_text().strip()}")
-                    continue
-                
-                # Accept no-waitlist servers
-                if 'no waitlist' in li_text.lower():
-                    full_url = urljoin(url, href)
-                    server_name = a.get_text().strip() or "Slow Partner Server"
-                    
-                    links.append({
-                        'url': full_url,
-                        'domain': domain,
-                        'text': server_name,
-                        'type': 'slow_download'
-                    })
-                    d.logger.debug(f"Added no-waitlist server: {server_name}")
-        
-        # External mirrors - look in js-show-external ul
-        external_ul = downloads_panel.find('ul', class_='js-show-external')
-        if external_ul:
-            for a in external_ul.find_all('a', href=True):
-                href = a['href']
-
-                # Only add absolute URLs
-                if not href.startswith('http'):
-                    continue
+    return filename
 
-                # Skip .onion URLs
-                if '.onion' in href.lower():
-                    d.logger.debug(f"Skipping .onion URL: {href}")
-                    continue
+def parse_md5_page(d, html_content, md5, url, domain):
+    """
+    Parse an Anna's Archive /md5/ page into cacheable metadata.
 
-                parsed = urlparse(href)
-                domain = parsed.netloc
+    Args:
+        d: Downloader instance
+        html_content: HTML of the /md5/ page
+        md5: MD5 hash of the file
+        url: URL the page was fetched from (used to resolve relative links)
+        domain: Anna's Archive domain the page was fetched from
 
-                # Skip if no valid domain
-                if not domain:
-                    continue
+    Returns:
+        Dict with filepath_name, title, extension, size and links
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    title, extension = _extract_title_and_extension(d, soup)
+    meta = {
+        'md5': md5,
+        'url': url,
+        'domain': domain,
+        'filepath_name': _extract_from_filepath(d, soup),
+        'title': title,
+        'extension': extension,
+        'size': _extract_size(d, soup),
+        'links': []
+    }
+    links = meta['links']
+
+    # Find the downloads panel
+    downloads_panel = soup.find('div', id='md5-panel-downloads')
+    if not downloads_panel:
+        d.logger.warning("Could not find downloads panel on page")
+        return meta
+
+    # Slow_download links - only accept "no waitlist" ones
+    for li in downloads_panel.find_all('li', class_='list-disc'):
+        a = li.find('a', href=True)
+        if not a:
+            continue
+
+        href = a['href']
+        li_text = li.get_text().strip()
+
+        # Skip fast_download links (we handle those via API)
+        if '/fast_download/' in href:
+            continue
+
+        # Only accept slow_download links
+        if '/slow_download/' in href:
+            # Skip waitlist servers (they have 60-second JavaScript countdown)
+            if 'slightly faster but with waitlist' in li_text.lower():
+                d.logger.debug(f"Skipping waitlist server: {a.get_text().strip()}")
+                continue
+
+            # Accept no-waitlist servers
+            if 'no waitlist' in li_text.lower():
+                full_url = urljoin(url, href)
+                server_name = a.get_text().strip() or "Slow Partner Server"
 
                 links.append({
-                    'url': href,
+                    'url': full_url,
                     'domain': domain,
-                    'text': domain,
-                    'type': 'external_mirror'
+                    'text': server_name,
+                    'type': 'slow_download'
                 })
-                d.logger.debug(f"Added external mirror: {domain}")
+                d.logger.debug(f"Added no-waitlist server: {server_name}")
 
-        return filename, links
+    # External mirrors - look in js-show-external ul
+    external_ul = downloads_panel.find('ul', class_='js-show-external')
+    if external_ul:
+        for a in external_ul.find_all('a', href=True):
+            href = a['href']
+
+            # Only add absolute URLs
+            if not href.startswith('http'):
+                continue
+
+            # Skip .onion URLs
+            if '.onion' in href.lower():
+                d.logger.debug(f"Skipping .onion URL: {href}")
+                continue
+
+            parsed = urlparse(href)
+            mirror_domain = parsed.netloc
+
+            # Skip if no valid domain
+            if not mirror_domain:
+                continue
+
+            links.append({
+                'url': href,
+                'domain': mirror_domain,
+                'text': mirror_domain,
+                'type': 'external_mirror'
+            })
+            d.logger.debug(f"Added external mirror: {mirror_domain}")
+
+    return meta
+
+def _get_download_links_single_domain(d, md5, domain):
+    """Fetch and parse the /md5/ page from Anna's Archive using a specific domain."""
+    url = f"https://{domain}/md5/{md5}"
+
+    d.logger.debug(f"Fetching download links from {domain}")
+
+    try:
+        response = d.session.get(url, timeout=30)
+        response.raise_for_status()
+
+        meta = parse_md5_page(d, response.text, md5, url, domain)
+
+        # Only cache pages that gave us something to download from
+        if meta['links']:
+            d.save_page_to_cache(md5, meta, response.text)
+
+        return meta
 
     except Exception as e:
         d.logger.error(f"Error fetching download links from {domain}: {e}")
         raise  # Re-raise to allow domain rotation
 
 
-def get_download_links(d, md5):
+def get_page_info(d, md5):
     """
-    Get download links from Anna's Archive with automatic domain rotation.
+    Get parsed /md5/ page metadata from the cache or Anna's Archive.
 
     This function will try different Anna's Archive domains until one succeeds.
-    When a domain works, it's saved for future use.
+    When a domain works, it's saved for future use. Parsed pages are cached on
+    disk, so retries and requeues skip the page fetch until the cache expires.
+
+    Returns:
+        Metadata dict (see parse_md5_page), or None if every domain failed
     """
-    try:
-        return try_domains_until_success(_get_download_links_single_domain, d, md5)
-    except Exception as e:
-        d.logger.error(f"Failed to fetch download links from all domains: {e}")
-        return "Unknown", []
\ No newline at end of file
+    meta = d.load_cached_page(md5)
+    annotate_phase('page', cached=meta is not None)
+    if meta is None:
+        try:
+            meta = try_domains_until_success(_get_download_links_single_domain, d, md5)
+        except Exception as e:
+            d.logger.error(f"Failed to fetch download links from all domains: {e}")
+            return None
+    return meta
+
+def get_download_links(d, md5):
+    """Get the filename and download links for an MD5 (see get_page_info)."""
+    meta = get_page_info(d, md5)
+    if meta is None:
+        return "Unknown", []
+
+    return compose_filename(d, md5, meta), [dict(link) for link in meta['links']]
\ No newline at end of file
@@ -0,0 +1,100 @@
+import bisect
+import threading
+
+# Bucket upper bounds (seconds), each 25% above the last, from 10 ms to about 5 minutes
+BUCKETS = tuple(round(0.01 * 1.25 ** index, 4) for index in range(47))
+
+# Observations a host needs before its timeouts are derived from them
+MIN_SAMPLES = 20
+
+# Once a histogram holds this many observations the older ones count half,
+# so it follows a host that gets faster or slower
+DECAY_AT = 200
+
+# Timeouts are TIMEOUT_FACTOR times the host's TIMEOUT_PERCENTILE latency,
+# within these bounds (seconds)
+TIMEOUT_PERCENTILE = 99
+TIMEOUT_FACTOR = 3
+TIMEOUT_BOUNDS = {
+    'connect': (2, 30),
+    'ttfb': (5, 120)
+}
+
+class LatencyHistogram:
+    """Latencies counted into exponential buckets, with older counts decaying."""
+
+    def __init__(self):
+        self.counts = [0.0] * len(BUCKETS)
+        self.total = 0.0
+
+    def observe(self, seconds):
+        index = min(bisect.bisect_left(BUCKETS, seconds), len(BUCKETS) - 1)
+        self.counts[index] += 1
+        self.total += 1
+        if self.total >= DECAY_AT:
+            self.counts = [count / 2 for count in self.counts]
+            self.total /= 2
+
+    def percentile(self, percent):
+        """Upper bound of the bucket the percentile falls in, None without observations."""
+        if not self.total:
+            return None
+        target = self.total * percent / 100
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return BUCKETS[-1]
+
+class HostLatency:
+    """
+    Per-host histograms of connect time (TCP and TLS) and time to first byte,
+    from successful requests, and the timeouts they call for.
+
+    Requests that time out aren't observed: a dead host would otherwise push
+    its own timeout up to the maximum. The factor over p99 leaves room for the
+    slow responses that get cut off.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def observe(self, host, kind, seconds):
+        with self.lock:
+            histograms = self.hosts.get(host)
+            if histograms is None:
+                histograms = self.hosts[host] = {name: LatencyHistogram() for name in TIMEOUT_BOUNDS}
+            histograms[kind].observe(seconds)
+
+    def _timeout(self, histogram, kind):
+        if histogram.total < MIN_SAMPLES:
+            return None
+        low, high = TIMEOUT_BOUNDS[kind]
+        return min(high, max(low, histogram.percentile(TIMEOUT_PERCENTILE) * TIMEOUT_FACTOR))
+
+    def timeout(self, host, kind, default):
+        """Timeout for a connect or ttfb wait on host, or default until it has enough observations."""
+        with self.lock:
+            histograms = self.hosts.get(host)
+            timeout = self._timeout(histograms[kind], kind) if histograms else None
+        return default if timeout is None else timeout
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                host: {
+                    kind: {
+                        'samples': int(histogram.total),
+                        'p50': histogram.percentile(50),
+                        'p99': histogram.percentile(TIMEOUT_PERCENTILE),
+                        'timeout': self._timeout(histogram, kind)
+                    }
+                    for kind, histogram in histograms.items()
+                }
+                for host, histograms in self.hosts.items()
+            }
+
+# Shared by all downloader instances, like the politeness scheduler
+LATENCY = HostLatency()
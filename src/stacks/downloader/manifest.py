@@ -0,0 +1,244 @@
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from stacks.downloader.resume import get_meta_path, load_part_meta
+
+MANIFEST_NAME = "manifest.json"
+
+# How often in-memory progress is written back to disk during a transfer
+FLUSH_INTERVAL = 5
+
+# .part files the manifest can't tie to an MD5 (left by older versions, or
+# without a sidecar) are only reclaimed once they've been idle this long,
+# a queued item may still resume them by filename
+UNTRACKED_MAX_AGE = 7 * 86400
+
+class PartManifest:
+    """
+    Index of partial downloads in the incomplete folder, keyed by MD5.
+
+    .part names come from the resolved filename, so they can't be found by MD5
+    with a directory glob. Paths are stored relative to the incomplete folder so
+    the manifest stays valid when the folder is migrated.
+    """
+
+    def __init__(self, incomplete_dir):
+        self.incomplete_dir = Path(incomplete_dir)
+        self.path = self.incomplete_dir / MANIFEST_NAME
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger('part_manifest')
+        self.entries = {}
+        self.dirty = False
+        self.last_flush = 0
+        self.load()
+
+    def load(self):
+        """
+        Load the manifest from disk, dropping entries whose .part file is gone
+        and indexing untracked .part files whose sidecar names their MD5.
+        """
+        with self.lock:
+            self.entries = {}
+            if self.path.exists():
+                try:
+                    with open(self.path, 'r') as f:
+                        entries = json.load(f).get('parts', {})
+                    self.entries = {
+                        md5: entry for md5, entry in entries.items()
+                        if (self.incomplete_dir / entry['name']).exists()
+                    }
+                    self.dirty = len(self.entries) != len(entries)
+                except Exception as e:
+                    self.logger.warning(f"Failed to load part manifest: {e}")
+            self._index_untracked()
+
+    def _index_untracked(self):
+        if not self.incomplete_dir.exists():
+            return
+        tracked = {entry['name'] for entry in self.entries.values()}
+        for part_path in self.incomplete_dir.glob('*.part'):
+            if part_path.name in tracked:
+                continue
+            md5 = (load_part_meta(part_path) or {}).get('md5')
+            if not md5 or md5 in self.entries:
+                continue
+            try:
+                stat = part_path.stat()
+            except OSError:
+                continue
+            self.entries[md5] = {'name': part_path.name, 'size': stat.st_size, 'last_activity': stat.st_mtime}
+            self.dirty = True
+            self.logger.info(f"Indexed partial download {part_path.name} for {md5}")
+
+    def _write(self):
+        self.incomplete_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'parts': self.entries}, f, indent=2)
+        tmp_path.replace(self.path)
+        self.dirty = False
+        self.last_flush = time.time()
+
+    def flush(self):
+        """Write pending changes to disk."""
+        with self.lock:
+            if not self.dirty:
+                return
+            try:
+                self._write()
+            except Exception as e:
+                self.logger.warning(f"Failed to save part manifest: {e}")
+
+    def track(self, md5, part_path, size):
+        """
+        Record activity on a partial download.
+
+        Called on every write, so the entry is only updated in memory and
+        flushed to disk at most every FLUSH_INTERVAL seconds.
+        """
+        now = time.time()
+        with self.lock:
+            self.entries[md5] = {
+                'name': Path(part_path).name,
+                'size': size,
+                'last_activity': now
+            }
+            self.dirty = True
+            if now - self.last_flush < FLUSH_INTERVAL:
+                return
+            try:
+                self._write()
+            except Exception as e:
+                self.logger.warning(f"Failed to save part manifest: {e}")
+
+    def lookup(self, md5):
+        """Get the .part path for an MD5, or None if there isn't one."""
+        with self.lock:
+            entry = self.entries.get(md5)
+        if not entry:
+            return None
+        part_path = self.incomplete_dir / entry['name']
+        return part_path if part_path.exists() else None
+
+    def owner(self, part_path):
+        """Get the MD5 a .part path is tracked under, or None."""
+        name = Path(part_path).name
+        with self.lock:
+            for md5, entry in self.entries.items():
+                if entry['name'] == name:
+                    return md5
+        return None
+
+    def forget(self, md5):
+        """Stop tracking an MD5 (its .part file has been moved or removed)."""
+        with self.lock:
+            if self.entries.pop(md5, None) is None:
+                return
+            self.dirty = True
+        self.flush()
+
+    def discard(self, md5):
+        """
+        Delete the partial download for an MD5, along with its resume sidecar.
+
+        Returns:
+            List of removed file names
+        """
+        part_path = self.lookup(md5)
+        removed = []
+        if part_path:
+            for file in (part_path, get_meta_path(part_path)):
+                try:
+                    if file.exists():
+                        file.unlink()
+                        removed.append(file.name)
+                except Exception as e:
+                    self.logger.warning(f"Failed to remove partial file {file.name}: {e}")
+        self.forget(md5)
+        return removed
+
+    def adopt(self, entries):
+        """Merge entries from another manifest (used when the folder is migrated)."""
+        with self.lock:
+            self.entries.update(entries)
+            self.dirty = True
+        self.flush()
+
+    def get_usage(self):
+        """Total size of everything in the incomplete folder, in bytes."""
+        if not self.incomplete_dir.exists():
+            return 0
+        total = 0
+        for file in self.incomplete_dir.iterdir():
+            try:
+                if file.is_file():
+                    total += file.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def reclaim(self, budget, keep=()):
+        """
+        Remove orphaned partial downloads, oldest first, until the folder fits the budget.
+
+        Orphans are tracked partials whose MD5 isn't in keep (queued or downloading),
+        and .part files the manifest doesn't know about that have been idle for
+        UNTRACKED_MAX_AGE (a queued item may still resume those by filename).
+
+        Args:
+            budget: Disk budget in bytes (0 disables the janitor)
+            keep: MD5s whose partials must be left alone
+
+        Returns:
+            Number of bytes reclaimed
+        """
+        if not budget:
+            return 0
+
+        usage = self.get_usage()
+        if usage <= budget:
+            return 0
+
+        keep = set(keep)
+        with self.lock:
+            tracked = {entry['name']: (md5, entry) for md5, entry in self.entries.items()}
+
+        candidates = []
+        for md5, entry in tracked.values():
+            if md5 not in keep:
+                candidates.append((entry.get('last_activity', 0), md5, self.incomplete_dir / entry['name']))
+        untracked_before = time.time() - UNTRACKED_MAX_AGE
+        for part_path in self.incomplete_dir.glob('*.part'):
+            if part_path.name not in tracked:
+                try:
+                    mtime = part_path.stat().st_mtime
+                except OSError:
+                    continue
+                if mtime < untracked_before:
+                    candidates.append((mtime, None, part_path))
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        reclaimed = 0
+        for _, md5, part_path in candidates:
+            if usage - reclaimed <= budget:
+                break
+            for file in (part_path, get_meta_path(part_path)):
+                try:
+                    if file.exists():
+                        size = file.stat().st_size
+                        file.unlink()
+                        reclaimed += size
+                except Exception as e:
+                    self.logger.warning(f"Failed to remove orphaned partial {file.name}: {e}")
+            if md5:
+                with self.lock:
+                    self.entries.pop(md5, None)
+                    self.dirty = True
+            self.logger.info(f"Reclaimed orphaned partial download: {part_path.name}")
+
+        self.flush()
+        if reclaimed:
+            self.logger.info(f"Reclaimed {reclaimed / 1024 / 1024:.1f} MB of orphaned partial downloads")
+        return reclaimed
@@ -1,3 +1,6 @@
+from urllib.parse import urlparse
+from stacks.downloader.breaker import BREAKER, HostUnavailable
+
 def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_attempts=3, subfolder=None):
     """
     Download from any mirror with stale cookie handling.
@@ -8,7 +11,17 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
 
     Args:
         subfolder: Subfolder path to save file to (optional)
+
+    Mirrors whose circuit breaker is open are skipped, with d.last_failure set to 'unavailable'.
     """
+    d.last_failure = None
+    d.last_speed = None
+    host = urlparse(mirror_url).hostname
+    if BREAKER.is_open(host):
+        d.logger.info(f"Skipping mirror, {host} is unavailable")
+        d.last_failure = 'unavailable'
+        return None
+
     try:
         if mirror_type == 'slow_download':
             d.logger.debug("Accessing slow download (via cookies)")
@@ -71,6 +84,8 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
                 d.logger.info("Found download URL, downloading...")
                 return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
 
+            except HostUnavailable:
+                raise
             except Exception as e:
                 d.logger.error(f"Error accessing slow_download page: {e}")
                 return None
@@ -148,10 +163,17 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
 
                 return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
 
+            except HostUnavailable:
+                raise
             except Exception as e:
                 d.logger.error(f"Error accessing external mirror: {e}")
                 return None
     
+    except HostUnavailable as e:
+        # The breaker opened after the check above, same as skipping it there
+        d.logger.info(f"Skipping mirror, {e}")
+        d.last_failure = 'unavailable'
+        return None
     except Exception as e:
         d.logger.error(f"Error downloading from mirror: {e}")
         return None
\ No newline at end of file
@@ -1,4 +1,6 @@
-import random
+from stacks.downloader.scoreboard import SCOREBOARD
+from stacks.downloader.timeline import phase, begin_phase, end_phase, set_timeline_info
+from stacks.utils.metrics import FAST_DOWNLOAD_ATTEMPTS, MIRROR_ATTEMPTS
 
 def _is_cancelled(d):
     """Check if download should be cancelled via progress callback"""
@@ -37,7 +39,8 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
         if hasattr(d, 'status_callback'):
             d.status_callback("Trying fast download...")
 
-        success, result = d.try_fast_download(md5)
+        with phase('fast_api'):
+            success, result = d.try_fast_download(md5)
 
         if success:
             d.logger.info("Using fast download")
@@ -46,22 +49,28 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
 
             filepath = d.download_direct(result, title=filename, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
             if filepath:
+                FAST_DOWNLOAD_ATTEMPTS.inc(outcome='success')
+                set_timeline_info(method='fast')
                 d.logger.info("Fast download successful")
                 return True, True, filepath
             else:
                 # Check if cancelled
                 if _is_cancelled(d):
+                    FAST_DOWNLOAD_ATTEMPTS.inc(outcome='cancelled')
                     if hasattr(d, 'status_callback'):
                         d.status_callback("Stopping download...")
                     return False, False, None
 
+                FAST_DOWNLOAD_ATTEMPTS.inc(outcome='failure')
                 d.logger.warning("Fast download failed, falling back to mirrors")
         else:
+            FAST_DOWNLOAD_ATTEMPTS.inc(outcome='unavailable')
             d.logger.info(f"Fast download not available: {result}")
 
 
     if not links:
         d.logger.error("No download links found")
+        d.invalidate_page_cache(md5)
         return False, False, None
 
     d.logger.info(f"Found {len(links)} mirror(s)")
@@ -73,8 +82,8 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
         others = [link for link in links if prefer_mirror.lower() not in link['domain'].lower()]
         links = preferred + others
     else:
-        # Shuffle to spread load across mirrors (unless user has preference)
-        random.shuffle(links)
+        # Best-performing mirrors first, equal ones shuffled to spread load (unless user has preference)
+        links = SCOREBOARD.rank(links)
 
     # Try each mirror
     for i, mirror_link in enumerate(links):
@@ -91,6 +100,12 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
         if hasattr(d, 'status_callback'):
             d.status_callback(f"Accessing mirror {i+1}/{len(links)}: {mirror_name}")
 
+        # Have a connection to the next mirror ready in case this one fails
+        if i + 1 < len(links):
+            d.preconnect(links[i + 1]['url'])
+
+        # Ended by download_direct once the mirror page gave us a file link
+        begin_phase('mirror_page', mirror=mirror_name)
         filepath = d.download_from_mirror(
             mirror_link['url'],
             mirror_link['type'],
@@ -99,8 +114,14 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
             resume_attempts=resume_attempts,
             subfolder=subfolder
         )
+        end_phase('mirror_page')
+
+        mirror_key = SCOREBOARD.key_for(mirror_link)
 
         if filepath:
+            SCOREBOARD.record(mirror_key, 'success', speed=d.last_speed)
+            MIRROR_ATTEMPTS.inc(outcome='success')
+            set_timeline_info(method='mirror', mirror=mirror_name)
             d.logger.info("Download successful")
             if hasattr(d, 'status_callback'):
                 d.status_callback("Verifying download...")
@@ -108,15 +129,29 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
         else:
             # Check if download was cancelled (not just failed)
             if _is_cancelled(d):
+                MIRROR_ATTEMPTS.inc(outcome='cancelled')
                 if hasattr(d, 'status_callback'):
                     d.status_callback("Stopping download...")
                 return False, False, None
 
-            d.logger.warning(f"Mirror {mirror_name} failed")
+            if d.last_failure == 'unavailable':
+                # Not tried, so not held against its score
+                MIRROR_ATTEMPTS.inc(outcome='skipped')
+                d.logger.warning(f"Mirror {mirror_name} skipped, it's unavailable")
+            elif d.last_failure in ('stalled', 'rejected'):
+                SCOREBOARD.record(mirror_key, d.last_failure)
+                MIRROR_ATTEMPTS.inc(outcome=d.last_failure)
+                d.logger.warning(f"Mirror {mirror_name} {d.last_failure}")
+            else:
+                SCOREBOARD.record(mirror_key, 'failure')
+                MIRROR_ATTEMPTS.inc(outcome='failure')
+                d.logger.warning(f"Mirror {mirror_name} failed")
             if i < len(links) - 1:
                 d.logger.info("Trying next mirror...")
                 if hasattr(d, 'status_callback'):
                     d.status_callback("Mirror failed, trying next mirror...")
 
     d.logger.error("All mirrors failed")
+    # The cached links may have gone stale, fetch a fresh page on the next attempt
+    d.invalidate_page_cache(md5)
     return False, False, None
\ No newline at end of file
@@ -0,0 +1,186 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+import time
+from stacks.constants import PAGE_CACHE_DIR
+
+# Bump when the /md5/ page parser changes so cached pages get re-parsed offline
+PAGE_PARSER_VERSION = 2
+
+MD5_PATTERN = re.compile(r'[0-9a-fA-F]{32}')
+
+def _get_page_cache_files(md5):
+    """Return the (metadata, html) cache file paths for an MD5.
+
+    Raises:
+        ValueError if md5 isn't a 32 character hex digest, so no caller can
+        reach a path outside the cache folder
+    """
+    if not isinstance(md5, str) or not MD5_PATTERN.fullmatch(md5):
+        raise ValueError(f"Not an MD5: {md5!r}")
+    return PAGE_CACHE_DIR / f"{md5}.json", PAGE_CACHE_DIR / f"{md5}.html.gz"
+
+def _replace_file(path, data):
+    """Write data to path through a temporary file of its own, so concurrent writers never mix."""
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+def _load_cached_page(d, md5):
+    """Load parsed /md5/ page metadata from the cache.
+
+    Args:
+        d: Downloader instance
+        md5: MD5 hash of the file
+
+    Returns:
+        Metadata dict, or None if not cached, expired or caching is disabled.
+        Entries written by an older parser are re-parsed from the cached HTML.
+    """
+    if not d.page_cache_ttl:
+        return None
+
+    try:
+        # An invalid md5 is just a miss
+        meta_file, _ = _get_page_cache_files(md5)
+        if not meta_file.exists():
+            return None
+
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+
+        age = time.time() - meta.get('timestamp', 0)
+        if age > d.page_cache_ttl:
+            d.logger.debug(f"Cached page for {md5} expired ({int(age)}s old)")
+            _invalidate_page_cache(d, md5)
+            return None
+
+        if meta.get('parser_version') != PAGE_PARSER_VERSION:
+            d.logger.info(f"Cached page for {md5} was parsed by an older scraper, re-parsing offline")
+            meta = _reparse_cached_page(d, md5)
+            if not meta:
+                return None
+
+        d.logger.info(f"Using cached page info for {md5} ({len(meta.get('links', []))} mirror(s))")
+        return meta
+    except Exception as e:
+        d.logger.debug(f"Failed to load cached page for {md5}: {e}")
+        return None
+
+def _save_page_to_cache(d, md5, meta, html_content=None):
+    """Save parsed /md5/ page metadata, and optionally the raw HTML, to the cache.
+
+    Args:
+        d: Downloader instance
+        md5: MD5 hash of the file
+        meta: Parsed page metadata (filename parts and links)
+        html_content: Raw page HTML, stored gzip-compressed for offline re-parsing
+    """
+    if not d.page_cache_ttl:
+        return False
+
+    meta_file, html_file = _get_page_cache_files(md5)
+    try:
+        PAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+        if html_content is not None:
+            _replace_file(html_file, gzip.compress(html_content.encode('utf-8')))
+
+        meta = dict(meta)
+        meta['timestamp'] = meta.get('timestamp') or time.time()
+        meta['parser_version'] = PAGE_PARSER_VERSION
+
+        # Write metadata last so a half-written entry is never picked up
+        _replace_file(meta_file, json.dumps(meta, indent=2).encode('utf-8'))
+
+        d.logger.debug(f"Cached page info for {md5}")
+        return True
+    except Exception as e:
+        d.logger.debug(f"Failed to cache page for {md5}: {e}")
+        return False
+
+def _invalidate_page_cache(d, md5=None):
+    """Remove a cached page, or every cached page if md5 is None.
+
+    Returns:
+        Number of cache entries removed
+    """
+    if not PAGE_CACHE_DIR.exists():
+        return 0
+
+    if md5:
+        meta_files = [_get_page_cache_files(md5)[0]]
+    else:
+        meta_files = [meta_file for meta_file in PAGE_CACHE_DIR.glob('*.json') if MD5_PATTERN.fullmatch(meta_file.stem)]
+
+    removed = 0
+    for meta_file in meta_files:
+        entry_md5 = meta_file.stem
+        for cache_file in _get_page_cache_files(entry_md5):
+            try:
+                if cache_file.exists():
+                    cache_file.unlink()
+                    if cache_file == meta_file:
+                        removed += 1
+            except Exception as e:
+                d.logger.warning(f"Failed to remove cached page {cache_file.name}: {e}")
+
+    if removed:
+        d.logger.info(f"Invalidated {removed} cached page(s)")
+    return removed
+
+def _reparse_cached_page(d, md5):
+    """Re-parse a cached /md5/ page from its stored HTML without touching the network.
+
+    Returns:
+        Updated metadata dict, or None if there's no HTML to re-parse
+    """
+    from stacks.downloader.html import parse_md5_page
+
+    meta_file, html_file = _get_page_cache_files(md5)
+    if not html_file.exists():
+        d.logger.debug(f"No cached HTML for {md5}, can't re-parse")
+        _invalidate_page_cache(d, md5)
+        return None
+
+    try:
+        with open(meta_file, 'r') as f:
+            old_meta = json.load(f)
+        with gzip.open(html_file, 'rt', encoding='utf-8') as f:
+            html_content = f.read()
+
+        meta = parse_md5_page(d, html_content, md5, old_meta['url'], old_meta['domain'])
+        # Keep the original fetch time so re-parsing doesn't extend the TTL
+        meta['timestamp'] = old_meta.get('timestamp')
+        _save_page_to_cache(d, md5, meta)
+        return meta
+    except Exception as e:
+        d.logger.warning(f"Failed to re-parse cached page for {md5}: {e}")
+        _invalidate_page_cache(d, md5)
+        return None
+
+def _prune_page_cache(d):
+    """Remove expired entries from the page cache."""
+    if not PAGE_CACHE_DIR.exists():
+        return 0
+
+    pruned = 0
+    for meta_file in PAGE_CACHE_DIR.glob('*.json'):
+        try:
+            with open(meta_file, 'r') as f:
+                timestamp = json.load(f).get('timestamp', 0)
+            if not d.page_cache_ttl or time.time() - timestamp > d.page_cache_ttl:
+                pruned += _invalidate_page_cache(d, meta_file.stem)
+        except Exception as e:
+            d.logger.debug(f"Failed to check cached page {meta_file.name}: {e}")
+
+    if pruned:
+        d.logger.info(f"Pruned {pruned} expired cached page(s)")
+    return pruned
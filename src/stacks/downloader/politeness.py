@@ -0,0 +1,186 @@
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+from stacks.downloader.breaker import BREAKER
+
+# Longer backoffs than this fail the request right away instead of blocking the worker
+MAX_REQUEST_WAIT = 30
+
+# Ignore Retry-After values beyond this (seconds)
+MAX_RETRY_AFTER = 3600
+
+# Backoff when a 429 comes without a usable Retry-After
+DEFAULT_BACKOFF = 60
+
+class HostBackoff(requests.exceptions.RequestException):
+    """Raised when a host asked us to back off for longer than we're willing to wait."""
+
+def parse_retry_after(value, now=None):
+    """Turn a Retry-After header (seconds or HTTP date) into seconds from now, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(int(value), MAX_RETRY_AFTER)
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return min(max(0, retry_at - (now or time.time())), MAX_RETRY_AFTER)
+
+class HostScheduler:
+    """
+    Per-host politeness: spacing between items, a cap on concurrent requests,
+    and backoff when a host answers 429 or 503 with Retry-After.
+    """
+
+    def __init__(self, spacing=2, max_per_host=2):
+        self.lock = threading.Lock()
+        self.spacing = spacing
+        self.max_per_host = max_per_host
+        self.last_used = {}
+        self.blocked_until = {}
+        self.slots = {}
+
+    def configure(self, spacing, max_per_host):
+        with self.lock:
+            self.spacing = spacing
+            if max_per_host != self.max_per_host:
+                self.max_per_host = max_per_host
+                # Requests holding an old slot release it into the old semaphore
+                self.slots = {}
+
+    def _get_slot(self, host):
+        with self.lock:
+            slot = self.slots.get(host)
+            if slot is None:
+                slot = self.slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def record_response(self, host, response):
+        """Note activity on a host, and back off if it told us to."""
+        now = time.time()
+        with self.lock:
+            self.last_used[host] = now
+            if response.status_code == 429 or (response.status_code == 503 and 'Retry-After' in response.headers):
+                delay = parse_retry_after(response.headers.get('Retry-After'), now)
+                if delay is None:
+                    delay = DEFAULT_BACKOFF
+                self.blocked_until[host] = max(self.blocked_until.get(host, 0), now + delay)
+
+    def get_backoff(self, host):
+        """Seconds until a host's Retry-After expires (0 if it isn't backing us off)."""
+        with self.lock:
+            return max(0, self.blocked_until.get(host, 0) - time.time())
+
+    def ready_at(self, host):
+        """When a new item may start using a host."""
+        with self.lock:
+            return max(self.last_used.get(host, 0) + self.spacing, self.blocked_until.get(host, 0))
+
+    def is_ready(self, host):
+        return self.ready_at(host) <= time.time()
+
+    def acquire(self, host):
+        """
+        Wait for a host's backoff and a free request slot.
+
+        Raises:
+            HostBackoff if the host wants us to wait longer than MAX_REQUEST_WAIT
+        """
+        backoff = self.get_backoff(host)
+        if backoff > MAX_REQUEST_WAIT:
+            raise HostBackoff(f"{host} asked us to back off for another {int(backoff)}s")
+        if backoff:
+            time.sleep(backoff)
+        slot = self._get_slot(host)
+        slot.acquire()
+        return slot
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            return {
+                host: {
+                    'last_used': self.last_used.get(host),
+                    'backoff': max(0, self.blocked_until.get(host, 0) - now)
+                }
+                for host in set(self.last_used) | set(self.blocked_until)
+            }
+
+# Shared by all downloader instances so backoffs survive config reloads
+POLITENESS = HostScheduler()
+
+def _release_on_close(response, slot):
+    """Release slot once, when response is closed or garbage collected."""
+    release = weakref.finalize(response, slot.release)
+    # Only a weak reference, so a response that's never closed can still be collected
+    response_ref = weakref.ref(response)
+
+    def close():
+        response = response_ref()
+        if response is not None:
+            requests.Response.close(response)
+        release()
+
+    response.close = close
+
+class PoliteSession(requests.Session):
+    """
+    requests.Session that goes through the per-host scheduler and circuit breaker for every request.
+
+    A stream=True response keeps its host slot until it's closed, so
+    max_per_host caps body transfers too. Close streamed responses before
+    making another request to the same host.
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlparse(url).hostname
+        slot = POLITENESS.acquire(host)
+        try:
+            BREAKER.acquire(host)
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                BREAKER.record_failure(host, e)
+                raise
+            except Exception:
+                BREAKER.release(host)
+                raise
+        except BaseException:
+            slot.release()
+            raise
+        BREAKER.record_response(host, response)
+        POLITENESS.record_response(host, response)
+        if kwargs.get('stream'):
+            _release_on_close(response, slot)
+        else:
+            slot.release()
+        return response
+
+def best_mirror_host(links):
+    """Host of the mirror a download would try first, or None without links."""
+    from stacks.downloader.scoreboard import SCOREBOARD
+
+    if not links:
+        return None
+    best = SCOREBOARD.rank(links)[0]
+    return urlparse(best['url']).hostname or best.get('domain')
+
+def predict_next_host(d, mirror_host=None):
+    """
+    Guess which host an item will talk to first.
+
+    Items whose /md5/ page the lookahead already found (mirror_host, see
+    best_mirror_host) go straight to that mirror; everything else starts with
+    a page fetch (or fast download API call) on Anna's Archive. Runs on every
+    scheduling pass, so it doesn't touch the disk.
+    """
+    from stacks.utils.domainutils import get_working_domain
+
+    if mirror_host and not (d.fast_download_enabled and d.fast_download_key):
+        return mirror_host
+    return get_working_domain()
@@ -0,0 +1,131 @@
+import threading
+import time
+from datetime import datetime
+from stacks.constants import SCHEDULE_DAYS
+
+# Burst allowance in seconds of traffic at the current rate
+BURST_SECONDS = 0.5
+
+class TokenBucket:
+    """Token bucket that lets callers reserve bytes and tells them how long to wait."""
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = 0
+        self.last_refill = time.monotonic()
+
+    def set_rate(self, rate):
+        if rate != self.rate:
+            self.rate = rate
+            # Don't let debt from an old, lower rate carry over
+            self.tokens = max(self.tokens, 0)
+
+    def reserve(self, nbytes):
+        """Take nbytes from the bucket, returning the seconds to wait before using them."""
+        if not self.rate:
+            return 0
+
+        now = time.monotonic()
+        burst = self.rate * BURST_SECONDS
+        self.tokens = min(burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        self.tokens -= nbytes
+        return -self.tokens / self.rate if self.tokens < 0 else 0
+
+def _parse_time(value):
+    hours, minutes = value.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def _entry_active(entry, now):
+    days = entry.get('days') or SCHEDULE_DAYS
+    if SCHEDULE_DAYS[now.weekday()] not in days:
+        return False
+    start = _parse_time(entry['start'])
+    end = _parse_time(entry['end'])
+    minute = now.hour * 60 + now.minute
+    if start <= end:
+        return start <= minute < end
+    # Wraps past midnight (e.g. 22:00-06:00)
+    return minute >= start or minute < end
+
+def _host_matches(host, pattern):
+    return host == pattern or host.endswith('.' + pattern)
+
+class BandwidthShaper:
+    """
+    Global and per-host bandwidth limits, with an optional weekly schedule.
+
+    Limits are in bytes/s, 0 means unlimited. A schedule entry that is active
+    replaces the global limit; per-host limits apply on top of it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limit = 0
+        self.host_limits = {}
+        self.schedule = []
+        self.global_bucket = TokenBucket()
+        self.host_buckets = {}
+
+    def configure(self, limit=0, host_limits=None, schedule=None):
+        """Apply new limits, takes effect on the next block of any running transfer."""
+        with self.lock:
+            self.limit = limit
+            self.host_limits = dict(host_limits or {})
+            self.schedule = list(schedule or [])
+            # Buckets for hosts that no longer have a limit are dropped
+            self.host_buckets = {
+                pattern: bucket for pattern, bucket in self.host_buckets.items()
+                if pattern in self.host_limits
+            }
+
+    def get_global_limit(self, now=None):
+        """Get the global limit in effect right now (schedule first, then the base limit)."""
+        now = now or datetime.now()
+        for entry in self.schedule:
+            if _entry_active(entry, now):
+                return entry.get('limit', 0)
+        return self.limit
+
+    def get_host_limit(self, host):
+        """Get the per-host limit for a host, or 0 if it has none."""
+        for pattern, limit in self.host_limits.items():
+            if host and _host_matches(host, pattern):
+                return limit
+        return 0
+
+    def get_limit(self, host=None):
+        """Get the effective limit for a transfer from host (0 = unlimited)."""
+        with self.lock:
+            limits = [limit for limit in (self.get_global_limit(), self.get_host_limit(host)) if limit]
+        return min(limits) if limits else 0
+
+    def throttle(self, host, nbytes):
+        """Account for nbytes received from host, sleeping as long as the limits require."""
+        with self.lock:
+            self.global_bucket.set_rate(self.get_global_limit())
+            wait = self.global_bucket.reserve(nbytes)
+
+            for pattern, limit in self.host_limits.items():
+                if host and _host_matches(host, pattern):
+                    bucket = self.host_buckets.setdefault(pattern, TokenBucket())
+                    bucket.set_rate(limit)
+                    wait = max(wait, bucket.reserve(nbytes))
+                    break
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def snapshot(self):
+        """Get the current limits."""
+        with self.lock:
+            return {
+                'limit': self.limit,
+                'active_limit': self.get_global_limit(),
+                'host_limits': dict(self.host_limits),
+                'schedule': list(self.schedule)
+            }
+
+# Shared by all downloader instances so limits hold across config reloads
+SHAPER = BandwidthShaper()
@@ -0,0 +1,88 @@
+import json
+import time
+import hashlib
+from pathlib import Path
+from urllib.parse import urlparse
+
+# How often the hash checkpoint in the sidecar is refreshed during a transfer
+CHECKPOINT_INTERVAL = 5
+
+def get_meta_path(temp_path):
+    """Sidecar path for a .part file (foo.epub.part -> foo.epub.part.meta)."""
+    return Path(f"{temp_path}.meta")
+
+def load_part_meta(temp_path):
+    """Load the resume sidecar for a .part file, or None if missing or unreadable."""
+    meta_path = get_meta_path(temp_path)
+    if not meta_path.exists():
+        return None
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def save_part_meta(temp_path, meta):
+    """Atomically write the resume sidecar for a .part file."""
+    meta_path = get_meta_path(temp_path)
+    meta['updated_at'] = time.time()
+    tmp_path = meta_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    tmp_path.replace(meta_path)
+
+def remove_part_meta(temp_path):
+    """Remove the resume sidecar for a .part file."""
+    get_meta_path(temp_path).unlink(missing_ok=True)
+
+def get_validator(meta):
+    """
+    Pick the If-Range validator from a sidecar.
+
+    Weak ETags can't be used with If-Range, fall back to Last-Modified for those.
+    """
+    etag = meta.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return meta.get('last_modified')
+
+def same_source(meta, url):
+    """Whether a sidecar was written for the same server as url (validators are per-server)."""
+    return urlparse(meta.get('url') or '').netloc == urlparse(url).netloc
+
+def parse_content_range_total(response):
+    """Get the full object size from a 206 Content-Range header, or None."""
+    content_range = response.headers.get('Content-Range', '')
+    total = content_range.rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+def rehash_partial(temp_path, length, meta=None):
+    """
+    Rebuild the streaming MD5 for the first `length` bytes of a .part file.
+
+    If the sidecar has a hash checkpoint, the prefix it covers is checked against it.
+
+    Returns:
+        hashlib md5 object, or None if the checkpoint doesn't match (corrupt partial)
+    """
+    hash_md5 = hashlib.md5()
+    checkpoint_offset = (meta or {}).get('hash_offset') or 0
+    checkpoint_md5 = (meta or {}).get('hash_md5')
+    if checkpoint_offset > length:
+        return None
+
+    position = 0
+    with open(temp_path, 'rb') as f:
+        while position < length:
+            # Stop exactly at the checkpoint so it can be compared
+            limit = checkpoint_offset if position < checkpoint_offset else length
+            chunk = f.read(min(1024 * 1024, limit - position))
+            if not chunk:
+                break
+            hash_md5.update(chunk)
+            position += len(chunk)
+            if checkpoint_md5 and position == checkpoint_offset:
+                if hash_md5.hexdigest() != checkpoint_md5:
+                    return None
+
+    return hash_md5 if position == length else None
@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+
+# Assumed transfer speed (bytes/s) before any mirror has reported one
+DEFAULT_SPEED = 1024 * 1024
+
+class MirrorScoreboard:
+    """Track how well each mirror has performed so the best ones are tried first."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mirrors = {}
+
+    @staticmethod
+    def key_for(link):
+        """Slow download servers share a domain, so tell them apart by name."""
+        if link.get('type') == 'slow_download':
+            return link.get('text') or link.get('domain')
+        return link.get('domain')
+
+    def record(self, key, outcome, speed=None):
+        """Record the outcome of a download attempt.
+
+        Args:
+            key: Mirror key (see key_for)
+            outcome: 'success', 'failure', 'stalled' or 'rejected'
+            speed: Average transfer speed in bytes/s (optional)
+        """
+        with self.lock:
+            stats = self.mirrors.setdefault(key, {
+                'success': 0,
+                'failure': 0,
+                'stalled': 0,
+                'rejected': 0,
+                'speed': None,
+                'last_outcome': None,
+                'last_seen': 0
+            })
+            stats[outcome] = stats.get(outcome, 0) + 1
+            stats['last_outcome'] = outcome
+            stats['last_seen'] = time.time()
+            if speed:
+                # Smooth so one fast or slow transfer doesn't dominate
+                stats['speed'] = speed if stats['speed'] is None else 0.7 * stats['speed'] + 0.3 * speed
+
+    def score(self, key):
+        """Estimated chance of success (stalls and rejected bodies count double), 0.5 for unknown mirrors."""
+        with self.lock:
+            stats = self.mirrors.get(key)
+            if not stats:
+                return 0.5
+            failures = stats['failure'] + 2 * (stats['stalled'] + stats['rejected'])
+            return (stats['success'] + 1) / (stats['success'] + failures + 2)
+
+    def rank(self, links):
+        """Order links best-first, shuffling mirrors with equal scores to spread load."""
+        shuffled = list(links)
+        random.shuffle(shuffled)
+        return sorted(shuffled, key=lambda link: self.score(self.key_for(link)), reverse=True)
+
+    def get_speed(self, key=None):
+        """Smoothed speed of a mirror, falling back to the average over all mirrors."""
+        with self.lock:
+            stats = self.mirrors.get(key)
+            if stats and stats['speed']:
+                return stats['speed']
+            speeds = [stats['speed'] for stats in self.mirrors.values() if stats['speed']]
+        return sum(speeds) / len(speeds) if speeds else DEFAULT_SPEED
+
+    def estimate(self, links, size):
+        """
+        Estimate a download from its links and size.
+
+        Returns:
+            (expected transfer time in seconds or None if size is unknown,
+             chance of success on the best mirror)
+        """
+        best = max(links, key=lambda link: self.score(self.key_for(link)), default=None)
+        key = self.key_for(best) if best else None
+        chance = self.score(key) if best else 0.5
+        if not size:
+            return None, chance
+        return size / self.get_speed(key), chance
+
+    def snapshot(self):
+        """Get a copy of all mirror stats."""
+        with self.lock:
+            return {key: dict(stats) for key, stats in self.mirrors.items()}
+
+# Shared across downloader instances so scores survive config reloads
+SCOREBOARD = MirrorScoreboard()
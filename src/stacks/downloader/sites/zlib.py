@@ -1,7 +1,6 @@
 """Z-Library (z-lib.fm) specific scraper."""
 
 from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
 
 
 def parse_zlib_download_link(d, html_content, mirror_url):
@@ -21,6 +20,8 @@ def parse_zlib_download_link(d, html_content, mirror_url):
     Returns:
         Download URL or None
     """
+    # Imported here, bs4 takes longer to load than the rest of the server
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html_content, 'html.parser')
     parsed_url = urlparse(mirror_url)
     base_domain = f"{parsed_url.scheme}://{parsed_url.netloc}"
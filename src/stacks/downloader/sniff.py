@@ -0,0 +1,92 @@
+"""Early content checks to catch error pages served in place of the real file."""
+
+# How many leading bytes to look at before accepting a response
+SNIFF_SIZE = 1024
+
+# Formats where an HTML/text body is legitimate (old .doc files are often saved HTML)
+TEXT_EXTENSIONS = ['.htm', '.html', '.htmlz', '.mht', '.txt', '.json', '.fb2', '.rtf', '.doc']
+
+ZIP = [(0, b'PK\x03\x04')]
+MOBI = [(60, b'BOOKMOBI'), (0, b'TPZ')]
+
+# Signatures as (offset, bytes) - any match is accepted, offset None matches anywhere
+# in the sniffed block. Only formats with reliable signatures are listed; anything
+# else just gets the HTML check.
+MAGIC_BYTES = {
+    '.pdf': [(None, b'%PDF')],
+    '.epub': ZIP,
+    '.zip': ZIP,
+    '.cbz': ZIP,
+    '.docx': ZIP,
+    '.xlsx': ZIP,
+    '.pptx': ZIP,
+    '.odt': ZIP,
+    '.htmlz': ZIP,
+    '.rar': [(0, b'Rar!\x1a\x07')],
+    '.cbr': [(0, b'Rar!\x1a\x07'), (0, b'PK\x03\x04')],
+    '.7z': [(0, b"7z\xbc\xaf'\x1c")],
+    '.cb7': [(0, b"7z\xbc\xaf'\x1c")],
+    '.gz': [(0, b'\x1f\x8b')],
+    '.djvu': [(0, b'AT&TFORM')],
+    '.mobi': MOBI,
+    '.azw': MOBI,
+    '.azw3': MOBI,
+    '.chm': [(0, b'ITSF')],
+    '.lit': [(0, b'ITOLITLS')],
+    '.lrf': [(0, b'L\x00R\x00F\x00')],
+    '.snb': [(0, b'SNBP000B')],
+    '.jpg': [(0, b'\xff\xd8\xff')],
+    '.tif': [(0, b'II*\x00'), (0, b'MM\x00*')],
+}
+
+HTML_MARKERS = [b'<!doctype html', b'<html', b'<head', b'<body', b'<script', b'<title']
+
+class ContentMismatch(Exception):
+    """Raised when a response clearly isn't the file we asked for."""
+
+def looks_like_html(head):
+    """Check whether the leading bytes of a body are an HTML document."""
+    text = head.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    return any(text.startswith(marker) for marker in HTML_MARKERS)
+
+def _matches(head, offset, magic):
+    if offset is None:
+        return magic in head[:SNIFF_SIZE]
+    return head[offset:offset + len(magic)] == magic
+
+def check_response_headers(response, file_ext):
+    """
+    Reject responses whose headers don't fit the expected file.
+
+    Args:
+        response: Streaming requests response
+        file_ext: Expected file extension (e.g. '.epub')
+
+    Raises:
+        ContentMismatch
+    """
+    if response.status_code >= 400:
+        raise ContentMismatch(f"Got HTTP {response.status_code} error page")
+
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_type in ('text/html', 'application/xhtml+xml') and file_ext not in TEXT_EXTENSIONS:
+        raise ContentMismatch(f"Got {content_type} response for a {file_ext or 'binary'} file")
+
+def check_leading_bytes(head, file_ext):
+    """
+    Reject bodies whose first bytes don't match the expected format.
+
+    Only meaningful for the start of a file, not for resumed ranges.
+
+    Raises:
+        ContentMismatch
+    """
+    if not head:
+        raise ContentMismatch("Empty response body")
+
+    if file_ext not in TEXT_EXTENSIONS and looks_like_html(head):
+        raise ContentMismatch(f"Got an HTML page instead of a {file_ext or 'binary'} file")
+
+    signatures = MAGIC_BYTES.get(file_ext)
+    if signatures and not any(_matches(head, offset, magic) for offset, magic in signatures):
+        raise ContentMismatch(f"Leading bytes don't look like a {file_ext} file")
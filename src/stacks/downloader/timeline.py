@@ -0,0 +1,119 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Phases in the order they usually happen, for reports
+PHASES = ('page', 'fast_api', 'flaresolverr', 'mirror_page', 'ttfb', 'transfer', 'verify', 'finalize')
+
+_local = threading.local()
+
+class PhaseTimeline:
+    """
+    Start and end of each phase of one download, relative to when it started.
+
+    Phases can overlap (a FlareSolverr solve happens inside a page fetch) and
+    repeat (one ttfb and transfer per attempt, one mirror_page per mirror).
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now().isoformat()
+        self.origin = time.monotonic()
+        self.lock = threading.Lock()
+        self.phases = []
+        self.info = {}
+
+    def _now(self):
+        return round(time.monotonic() - self.origin, 3)
+
+    def begin(self, name, **info):
+        entry = {'phase': name, 'start': self._now(), 'end': None, **info}
+        with self.lock:
+            self.phases.append(entry)
+        return entry
+
+    def end(self, name, **info):
+        """Close the latest open phase with this name, if there is one."""
+        with self.lock:
+            for entry in reversed(self.phases):
+                if entry['phase'] == name and entry['end'] is None:
+                    entry['end'] = self._now()
+                    entry.update(info)
+                    return entry
+        return None
+
+    def annotate(self, name, **info):
+        """Add details to the latest phase with this name."""
+        with self.lock:
+            for entry in reversed(self.phases):
+                if entry['phase'] == name:
+                    entry.update(info)
+                    return
+
+    def set(self, **info):
+        """Add details about the download as a whole (mirror used, method)."""
+        with self.lock:
+            self.info.update(info)
+
+    def to_dict(self):
+        now = self._now()
+        with self.lock:
+            phases = [dict(entry, end=now if entry['end'] is None else entry['end']) for entry in self.phases]
+            info = dict(self.info)
+        attempts = sum(1 for entry in phases if entry['phase'] == 'ttfb')
+        return {
+            'started_at': self.started_at,
+            'total': now,
+            **info,
+            'bytes': sum(entry.get('bytes', 0) for entry in phases if entry['phase'] == 'transfer'),
+            'retries': max(0, attempts - 1),
+            'phases': phases
+        }
+
+def start_timeline():
+    """Start recording phases for a new download on this thread."""
+    _local.timeline = PhaseTimeline()
+    return _local.timeline
+
+def use_timeline(timeline):
+    """Record this thread's phases into an existing timeline (None to stop)."""
+    _local.timeline = timeline
+
+def stop_timeline():
+    """Stop recording on this thread, returning the timeline."""
+    timeline = current_timeline()
+    _local.timeline = None
+    return timeline
+
+def current_timeline():
+    return getattr(_local, 'timeline', None)
+
+# Helpers for instrumented code, no-ops on threads that aren't recording (like the lookahead)
+
+def begin_phase(name, **info):
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.begin(name, **info)
+
+def end_phase(name, **info):
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.end(name, **info)
+
+def annotate_phase(name, **info):
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.annotate(name, **info)
+
+def set_timeline_info(**info):
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.set(**info)
+
+@contextmanager
+def phase(name, **info):
+    begin_phase(name, **info)
+    try:
+        yield
+    finally:
+        end_phase(name)
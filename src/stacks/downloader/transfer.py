@@ -0,0 +1,58 @@
+"""Buffered reads from a streaming response into one reusable buffer."""
+
+# Default size of the transfer buffer (the largest single read and write)
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Smallest read, and the alignment of larger ones. Reads block until they're
+# full, so slow links get small reads to keep progress and stall checks timely.
+MIN_READ_SIZE = 16 * 1024
+
+# Aim for one read per progress time slice
+READ_SLICE = 0.5
+
+class BlockReader:
+    """
+    Read a streaming requests response into a preallocated buffer.
+
+    Reads go through urllib3's readinto, which checks the body against its
+    Content-Length (or chunked framing) and hands the connection back to the
+    pool once the body ends. Bodies with a Content-Encoding need decoding and
+    fall back to iter_content.
+    """
+
+    def __init__(self, response, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = max(MIN_READ_SIZE, chunk_size - chunk_size % MIN_READ_SIZE)
+        self.buffer = bytearray(self.chunk_size)
+        self.view = memoryview(self.buffer)
+        self.read_size = MIN_READ_SIZE
+        self.chunks = None
+        self._readinto = response.raw.readinto
+
+        encoding = response.headers.get('Content-Encoding', '').strip().lower()
+        if encoding and encoding != 'identity':
+            self.chunks = response.iter_content(chunk_size=self.chunk_size)
+
+    def read(self, size=None):
+        """
+        Read the next block.
+
+        Args:
+            size: Bytes to read (defaults to the current adaptive read size)
+
+        Returns:
+            memoryview into the shared buffer (only valid until the next read),
+            or bytes on the iter_content fallback. Empty at end of stream.
+        """
+        if self.chunks is not None:
+            return next(self.chunks, b'')
+
+        size = min(size or self.read_size, self.chunk_size)
+        view = self.view[:size]
+        filled = self._readinto(view)
+        return view[:filled or 0]
+
+    def adapt(self, speed):
+        """Size the next reads so one takes about READ_SLICE seconds at the current speed."""
+        wanted = int(speed * READ_SLICE)
+        wanted -= wanted % MIN_READ_SIZE
+        self.read_size = min(self.chunk_size, max(MIN_READ_SIZE, wanted))
@@ -89,7 +89,7 @@ def setup_signal_handlers(app):
         if hasattr(app, 'stacks_queue') and app.stacks_queue:
             print(f"{INFO}  Saving queue state...{RESET}")
             sys.stdout.flush()
-            app.stacks_queue.save()
+            app.stacks_queue.flush()
 
         print(f"{GOOD}◼ Shutdown complete{RESET}")
         sys.stdout.flush()
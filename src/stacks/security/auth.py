@@ -99,7 +99,7 @@ def require_login(f):
     """Require a logged-in session for HTML pages (index, etc.)."""
     @wraps(f)    
     def wrapper(*args, **kwargs):
-        cfg = current_app.stacks_config
+        cfg = current_app.stacks_config.snapshot
         disable_auth = cfg.get("login", "disable")
 
         if disable_auth:
@@ -111,9 +111,10 @@ def require_login(f):
         return f(*args, **kwargs)
     return wrapper
 
-def validate_api_key(provided_key):
+def validate_api_key(provided_key, cfg=None):
     """
-    Validate an API key and return its type.
+    Validate an API key and return its type, against the config snapshot
+    the caller already holds (or the current one).
     Returns: (is_valid: bool, key_type: str | None)
     - "admin": Full access admin key
     - "downloader": Limited downloader key
@@ -122,7 +123,7 @@ def validate_api_key(provided_key):
     if not provided_key:
         return False, None
 
-    cfg = current_app.stacks_config
+    cfg = cfg or current_app.stacks_config.snapshot
     admin_key = cfg.get("api", "key")
     downloader_key = cfg.get("api", "downloader_key", default=None)
 
@@ -145,7 +146,7 @@ def require_auth(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         # Allow for disabled auth altogether
-        cfg = current_app.stacks_config
+        cfg = current_app.stacks_config.snapshot
         disable_auth = cfg.get("login", "disable")
 
         if disable_auth:
@@ -160,7 +161,7 @@ def require_auth(f):
             or request.args.get("api_key")
         )
 
-        is_valid, key_type = validate_api_key(provided_key)
+        is_valid, key_type = validate_api_key(provided_key, cfg)
         if is_valid:
             # Store key type in request context for permission checking
             request.key_type = key_type
@@ -192,7 +193,7 @@ def require_auth_with_permissions(allow_downloader=False):
         @wraps(f)
         def wrapper(*args, **kwargs):
             # Allow for disabled auth altogether
-            cfg = current_app.stacks_config
+            cfg = current_app.stacks_config.snapshot
             disable_auth = cfg.get("login", "disable")
 
             if disable_auth:
@@ -208,7 +209,7 @@ def require_auth_with_permissions(allow_downloader=False):
                 or request.args.get("api_key")
             )
 
-            is_valid, key_type = validate_api_key(provided_key)
+            is_valid, key_type = validate_api_key(provided_key, cfg)
 
             if not is_valid:
                 return (
@@ -242,7 +243,7 @@ def require_session_only(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
         # Allow for disabled auth altogether
-        cfg = current_app.stacks_config
+        cfg = current_app.stacks_config.snapshot
         disable_auth = cfg.get("login", "disable")
 
         if disable_auth:
@@ -0,0 +1,113 @@
+import bisect
+from stacks.constants import HISTORY_STATUSES
+
+def get_history_status(item):
+    return 'success' if item.get('success') else 'failed'
+
+class HistoryIndex:
+    """
+    Download history, oldest first, with ids and per-status indexes for paging.
+
+    Every entry gets an increasing id. Pages run newest first from a cursor
+    (the id to continue below) found by bisecting the id lists, so fetching a
+    page costs O(log n + limit) whatever the size of the history or the filter.
+    """
+
+    def __init__(self, max_items=0):
+        self.max_items = max_items
+        self.next_id = 1
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        self.ids = []
+        self.entries = []
+        self.by_status = {status: ([], []) for status in HISTORY_STATUSES}
+        self.version += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def _add(self, item):
+        if not isinstance(item.get('id'), int) or (self.ids and item['id'] <= self.ids[-1]):
+            item['id'] = self.next_id
+        self.next_id = max(self.next_id, item['id'] + 1)
+        self.ids.append(item['id'])
+        self.entries.append(item)
+        ids, entries = self.by_status[get_history_status(item)]
+        ids.append(item['id'])
+        entries.append(item)
+
+    def _trim(self):
+        excess = len(self.entries) - self.max_items if self.max_items else 0
+        if excess <= 0:
+            return
+        # The oldest overall are also the oldest of their status
+        dropped = {status: 0 for status in HISTORY_STATUSES}
+        for item in self.entries[:excess]:
+            dropped[get_history_status(item)] += 1
+        for status, count in dropped.items():
+            ids, entries = self.by_status[status]
+            del ids[:count]
+            del entries[:count]
+        del self.ids[:excess]
+        del self.entries[:excess]
+
+    def resize(self, max_items):
+        """Change how many entries are kept (0 = unlimited), dropping the oldest."""
+        self.max_items = max_items
+        self._trim()
+
+    def load(self, items):
+        """Replace the history with saved items, giving ids to those without one."""
+        self.clear()
+        for item in items:
+            self._add(item)
+        self._trim()
+
+    def append(self, item):
+        """Add a finished download, returning its id."""
+        self._add(item)
+        self._trim()
+        self.version += 1
+        return item['id']
+
+    def remove_md5(self, md5):
+        """Remove every entry for an MD5, returning how many were removed."""
+        kept = [item for item in self.entries if item['md5'] != md5]
+        removed = len(self.entries) - len(kept)
+        if removed:
+            self.load(kept)
+        return removed
+
+    def recent(self, count):
+        """The last count entries, oldest first."""
+        return self.entries[-count:] if count else []
+
+    def counts(self):
+        return {status: len(ids) for status, (ids, _) in self.by_status.items()}
+
+    def page(self, cursor=None, limit=50, status=None):
+        """
+        Get a page of history, newest first.
+
+        Args:
+            cursor: Only return entries with a lower id (None starts at the newest)
+            limit: Most entries to return
+            status: 'success' or 'failed' to filter, None for all
+
+        Returns:
+            (entries, cursor for the next page or None at the end, total matching)
+        """
+        ids, entries = self.by_status[status] if status else (self.ids, self.entries)
+        end = len(ids) if cursor is None else bisect.bisect_left(ids, cursor)
+        start = max(0, end - limit)
+        page = entries[start:end][::-1]
+        next_cursor = ids[start] if start > 0 else None
+        return page, next_cursor, len(ids)
+
+    def to_list(self):
+        return list(self.entries)
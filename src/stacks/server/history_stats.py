@@ -0,0 +1,190 @@
+import time
+from collections import deque
+from datetime import datetime
+from stacks.downloader.timeline import PHASES
+from stacks.server.history_index import get_history_status
+
+# Rolling windows reported by /api/stats, in seconds
+STATS_WINDOWS = {'1h': 3600, '24h': 86400}
+
+# Completions are counted into buckets this many seconds wide
+BUCKET_SECONDS = 60
+
+# Percentiles in phase reports
+REPORT_PERCENTILES = (50, 90, 99)
+
+def _completed_timestamp(item, default):
+    try:
+        return datetime.fromisoformat(item['completed_at']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return default
+
+def _empty_counts():
+    return {'success': 0, 'failed': 0, 'bytes': 0}
+
+def _add_counts(counts, other, sign=1):
+    for key in counts:
+        counts[key] += sign * other[key]
+
+class RollingWindow:
+    """
+    Counts over the last `seconds`, kept as a running sum of minute buckets.
+
+    Adding a completion touches the newest bucket, and expired buckets are
+    subtracted from the sum as they fall out, so reading it is O(1) amortized.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.buckets = deque()
+        self.totals = _empty_counts()
+
+    def _expire(self, now):
+        cutoff = now - self.seconds
+        while self.buckets and self.buckets[0][0] + BUCKET_SECONDS <= cutoff:
+            _, counts = self.buckets.popleft()
+            _add_counts(self.totals, counts, -1)
+
+    def add(self, counts, now):
+        self._expire(now)
+        start = now - now % BUCKET_SECONDS
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append((start, _empty_counts()))
+        _add_counts(self.buckets[-1][1], counts)
+        _add_counts(self.totals, counts)
+
+    def get(self, now):
+        self._expire(now)
+        return dict(self.totals)
+
+    def to_list(self):
+        return [[start, counts] for start, counts in self.buckets]
+
+    def load(self, buckets, now):
+        self.buckets = deque()
+        self.totals = _empty_counts()
+        for start, counts in buckets:
+            counts = {key: counts.get(key, 0) for key in _empty_counts()}
+            self.buckets.append((start, counts))
+            _add_counts(self.totals, counts)
+        self._expire(now)
+
+class HistoryStats:
+    """
+    Running download statistics, updated on every completion.
+
+    Unlike the history list these aren't trimmed by queue.max_history or
+    reset by clearing the history, they count everything since `since`.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.since = time.time()
+        self.totals = _empty_counts()
+        self.fast = 0
+        self.mirror = 0
+        self.subfolders = {}
+        self.windows = {name: RollingWindow(seconds) for name, seconds in STATS_WINDOWS.items()}
+
+    def record(self, item, now=None):
+        """Count a finished download (a history entry)."""
+        now = now or time.time()
+        counts = _empty_counts()
+        counts[get_history_status(item)] = 1
+        if item.get('success'):
+            counts['bytes'] = item.get('size') or 0
+            if item.get('used_fast_download'):
+                self.fast += 1
+            else:
+                self.mirror += 1
+
+        _add_counts(self.totals, counts)
+        subfolder = item.get('subfolder') or ''
+        _add_counts(self.subfolders.setdefault(subfolder, _empty_counts()), counts)
+        for window in self.windows.values():
+            window.add(counts, now)
+
+    def get(self, now=None):
+        now = now or time.time()
+        return {
+            'since': self.since,
+            **self.totals,
+            'fast': self.fast,
+            'mirror': self.mirror,
+            'subfolders': {name: dict(counts) for name, counts in self.subfolders.items()},
+            'windows': {name: window.get(now) for name, window in self.windows.items()}
+        }
+
+    def to_dict(self):
+        return {
+            'since': self.since,
+            'totals': self.totals,
+            'fast': self.fast,
+            'mirror': self.mirror,
+            'subfolders': self.subfolders,
+            'windows': {name: window.to_list() for name, window in self.windows.items()}
+        }
+
+    def load(self, data, history=()):
+        """
+        Restore saved stats. Without any (a queue file from an older version)
+        they're rebuilt from the history that's left.
+        """
+        self.reset()
+        now = time.time()
+        if not data:
+            for item in history:
+                completed = _completed_timestamp(item, now)
+                self.since = min(self.since, completed)
+                self.record(item, now=completed)
+            return
+        self.since = data.get('since', self.since)
+        self.totals.update(data.get('totals', {}))
+        self.fast = data.get('fast', 0)
+        self.mirror = data.get('mirror', 0)
+        self.subfolders = {
+            name: dict(_empty_counts(), **counts)
+            for name, counts in data.get('subfolders', {}).items()
+        }
+        for name, buckets in data.get('windows', {}).items():
+            if name in self.windows:
+                self.windows[name].load(buckets, now)
+
+def _percentile(ordered, percent):
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+def phase_report(items):
+    """
+    Percentiles of the time spent in each phase, over history entries with a timeline.
+
+    A phase that happened more than once for a download (one transfer per
+    attempt, one mirror page per mirror) counts as its total for that download.
+    """
+    durations = {}
+    count = 0
+    for item in items:
+        timeline = item.get('timeline')
+        if not timeline:
+            continue
+        count += 1
+        per_item = {'total': timeline.get('total', 0)}
+        for entry in timeline.get('phases', []):
+            per_item[entry['phase']] = per_item.get(entry['phase'], 0) + entry['end'] - entry['start']
+        for name, seconds in per_item.items():
+            durations.setdefault(name, []).append(seconds)
+
+    order = {name: index for index, name in enumerate(PHASES + ('total',))}
+    phases = {}
+    for name in sorted(durations, key=lambda name: order.get(name, len(order))):
+        values = sorted(durations[name])
+        phases[name] = {
+            'count': len(values),
+            'mean': round(sum(values) / len(values), 3),
+            **{f'p{percent}': round(_percentile(values, percent), 3) for percent in REPORT_PERCENTILES},
+            'max': round(values[-1], 3)
+        }
+    return {'downloads': count, 'phases': phases}
@@ -0,0 +1,137 @@
+import os
+import shlex
+import logging
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from stacks.downloader.finalize import FinalizeError
+from stacks.downloader.timeline import use_timeline
+
+# Overrides postprocess.hook from the config file. The hook can't be set
+# through the settings API, it would run any command in the container
+HOOK_ENV = 'POSTPROCESS_HOOK'
+
+class PostProcessor:
+    """
+    Finishes downloads off the worker thread.
+
+    Moving a finished file into place and running the user hook can take a
+    while for large files on another mount, so they run in a small bounded
+    pool while the worker moves on to the next transfer.
+    """
+
+    def __init__(self, queue, config):
+        self.queue = queue
+        self.config = config
+        self.logger = logging.getLogger('postprocess')
+        self.lock = threading.Lock()
+        self.executor = None
+        # Pools replaced by a config change, still finishing their jobs
+        self.retired = []
+        self.slots = None
+        self.workers = 0
+        self.reconfigure()
+
+    def reconfigure(self):
+        """Apply the post-processing pool size from config"""
+        workers = self.config.get('postprocess', 'workers', default=2)
+        with self.lock:
+            if workers == self.workers:
+                return
+            old_executor = self.executor
+            if old_executor:
+                self.retired.append(old_executor)
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='postprocess')
+            # Bounded backlog: the worker waits here instead of piling up finished files
+            self.slots = threading.BoundedSemaphore(workers * 2)
+            self.workers = workers
+
+        if old_executor:
+            # Jobs already handed off finish on the old pool, stop() waits for them
+            old_executor.shutdown(wait=False)
+        self.logger.debug(f"Post-processing pool size: {workers}")
+
+    def submit(self, downloader, item, pending, used_fast_download=False, filename=None, timeline=None):
+        """
+        Hand a finished download to the pool.
+
+        Blocks while the backlog is full, so a slow disk slows down
+        downloading instead of filling up the incomplete folder.
+        """
+        with self.lock:
+            executor = self.executor
+            slots = self.slots
+
+        slots.acquire()
+        self.queue.mark_processing(item['md5'])
+        try:
+            future = executor.submit(self._process, downloader, item, pending, used_fast_download, filename, timeline)
+        except RuntimeError:
+            # Pool was swapped out by a config change in the meantime, finish inline
+            slots.release()
+            self._process(downloader, item, pending, used_fast_download, filename, timeline)
+            return
+        future.add_done_callback(lambda _: slots.release())
+
+    def _process(self, downloader, item, pending, used_fast_download, filename, timeline=None):
+        # The finalize phase goes on the download's own timeline
+        use_timeline(timeline)
+        try:
+            self._complete(downloader, item, pending, used_fast_download, filename, timeline)
+        finally:
+            use_timeline(None)
+
+    def _complete(self, downloader, item, pending, used_fast_download, filename, timeline):
+        md5 = item['md5']
+        subfolder = item.get('subfolder')
+        try:
+            self.queue.set_processing_status(md5, "Moving to library...")
+            filepath = downloader.complete_download(pending.temp_path, pending.base_final_path, pending.md5)
+        except FinalizeError as e:
+            self.logger.error(str(e))
+            self.queue.mark_complete(md5, False, error=f"Failed to move download into place: {e}", filename=filename, subfolder=subfolder, timeline=timeline)
+            return
+        except Exception as e:
+            self.logger.error(f"Post-processing error: {md5} - {e}")
+            self.queue.mark_complete(md5, False, error=str(e), filename=filename, subfolder=subfolder, timeline=timeline)
+            return
+
+        self._run_hook(item, filepath)
+        self.queue.mark_complete(md5, True, filepath=filepath, used_fast_download=used_fast_download, filename=filename, subfolder=subfolder, timeline=timeline)
+
+    def _run_hook(self, item, filepath):
+        """Run the user's post-processing command, if one is configured"""
+        hook = os.environ.get(HOOK_ENV) or self.config.get('postprocess', 'hook', default=None)
+        if not hook:
+            return
+
+        timeout = self.config.get('postprocess', 'hook_timeout', default=300)
+        env = dict(os.environ)
+        env.update({
+            'STACKS_FILE': str(filepath),
+            'STACKS_FILENAME': filepath.name,
+            'STACKS_MD5': item['md5'],
+            'STACKS_SUBFOLDER': item.get('subfolder') or ''
+        })
+
+        self.queue.set_processing_status(item['md5'], "Running post-processing hook...")
+        try:
+            result = subprocess.run(shlex.split(hook), env=env, capture_output=True, text=True, timeout=timeout)
+            if result.returncode != 0:
+                self.logger.warning(f"Post-processing hook exited with {result.returncode} for {filepath.name}: {result.stderr.strip()[:500]}")
+            else:
+                self.logger.info(f"Post-processing hook finished for {filepath.name}")
+        except subprocess.TimeoutExpired:
+            self.logger.warning(f"Post-processing hook timed out after {timeout}s for {filepath.name}")
+        except Exception as e:
+            self.logger.warning(f"Failed to run post-processing hook: {e}")
+
+    def stop(self):
+        """Wait for everything already handed off to finish"""
+        with self.lock:
+            executors = self.retired + ([self.executor] if self.executor else [])
+            self.retired = []
+        if executors:
+            self.logger.info("Waiting for post-processing to finish...")
+        for executor in executors:
+            executor.shutdown(wait=True)
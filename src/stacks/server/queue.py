@@ -1,21 +1,53 @@
+import atexit
+import copy
 import threading
 from pathlib import Path
 import json
 import logging
+import time
 from datetime import datetime
 from stacks.constants import QUEUE_FILE
+from stacks.server.history_index import HistoryIndex
+from stacks.server.history_stats import HistoryStats, phase_report
+from stacks.utils.metrics import DOWNLOADS
+from stacks.server.queue_index import QueueIndex, DEFAULT_EXPECTED_TIME, ESTIMATE_FIELDS
+
+# Seconds changes are gathered before the queue file is written, so a burst of
+# adds, moves or completions is written once
+SAVE_DELAY = 1
 
 class DownloadQueue:
     def __init__(self, config):
         self.config = config
         self.storage_file = Path(QUEUE_FILE)
         self.storage_file.parent.mkdir(parents=True, exist_ok=True)
-        self.queue = []
+        self.queue = QueueIndex()
         self.current_download = None
-        self.history = []
+        self.processing = []
+        self.history = HistoryIndex()
+        self.stats = HistoryStats()
+        # Cumulative expected times over the ordered queue, for ETAs on any page
+        self._eta_offsets = (None, [])
         self.lock = threading.Lock()
+        # Writes happen on a background thread, outside self.lock (see save)
+        self.save_lock = threading.Lock()
+        self.save_pending = threading.Event()
         self.logger = logging.getLogger('queue')
+        self.reconfigure()
         self.load()
+        threading.Thread(target=self._save_loop, daemon=True, name='queue-save').start()
+        # Don't lose the last SAVE_DELAY seconds of changes on exit
+        atexit.register(self.flush)
+
+    def reconfigure(self):
+        """Apply queue ordering settings from config"""
+        with self.lock:
+            self.queue.configure(
+                fairness=self.config.get('queue', 'fairness', default='round_robin'),
+                scheduling=self.config.get('queue', 'scheduling', default='arrival'),
+                aging=self.config.get('queue', 'aging', default=100)
+            )
+            self.history.resize(self.config.get('queue', 'max_history', default=100))
     
     def load(self):
         """Load queue from disk"""
@@ -23,39 +55,75 @@ class DownloadQueue:
             try:
                 with open(self.storage_file, 'r') as f:
                     data = json.load(f)
-                    self.queue = data.get('queue', [])
-                    self.history = data.get('history', [])
+                    self.queue.load(data.get('queue', []))
+                    self.history.load(data.get('history', []))
+                    self.stats.load(data.get('stats'), self.history)
+                    # Post-processing that was cut short goes back to the front, its .part is kept
+                    for item in reversed(data.get('processing', [])):
+                        self.queue.push_front({
+                            'md5': item['md5'],
+                            'source': item.get('source'),
+                            'added_at': item.get('added_at'),
+                            'status': 'queued',
+                            'subfolder': item.get('subfolder'),
+                            'priority': item.get('priority')
+                        })
                 self.logger.info(f"Loaded queue: {len(self.queue)} items, {len(self.history)} history")
             except Exception as e:
                 self.logger.error(f"Failed to load queue: {e}")
     
     def save(self):
-        """Save queue to disk"""
-        try:
-            max_history = self.config.get('queue', 'max_history', default=100)
-            history_to_save = self.history if max_history == 0 else self.history[-max_history:]
-            
-            with open(self.storage_file, 'w') as f:
-                json.dump({
-                    'queue': self.queue,
-                    'history': history_to_save
-                }, f, indent=2)
-        except Exception as e:
-            self.logger.error(f"Failed to save queue: {e}")
+        """
+        Schedule a save to disk.
+
+        Only sets a flag, so it's fine to call while holding self.lock. The
+        background saver writes within SAVE_DELAY seconds; use flush to write now.
+        """
+        self.save_pending.set()
+
+    def _save_loop(self):
+        while True:
+            self.save_pending.wait()
+            time.sleep(SAVE_DELAY)
+            self.flush()
+
+    def flush(self):
+        """Write the queue to disk now. Must not be called while holding self.lock."""
+        with self.save_lock:
+            self.save_pending.clear()
+            # Copy under the lock, serialize and write without it
+            with self.lock:
+                data = {
+                    'queue': self.queue.dump(),
+                    'processing': [dict(item) for item in self.processing],
+                    'history': self.history.to_list(),
+                    'stats': copy.deepcopy(self.stats.to_dict())
+                }
+            try:
+                tmp_path = self.storage_file.with_suffix('.tmp')
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f)
+                tmp_path.replace(self.storage_file)
+            except Exception as e:
+                self.logger.error(f"Failed to save queue: {e}")
     
-    def add(self, md5, source=None, subfolder=None):
+    def add(self, md5, source=None, subfolder=None, priority=None):
         """Add item to queue"""
         with self.lock:
             # Check if in queue
-            if any(item['md5'] == md5 for item in self.queue):
+            if md5 in self.queue:
                 return False, "Already in queue"
 
             # Check if currently downloading
             if self.current_download and self.current_download['md5'] == md5:
                 return False, "Currently downloading"
 
+            # Check if being post-processed
+            if any(item['md5'] == md5 for item in self.processing):
+                return False, "Currently processing"
+
             # Check if recently SUCCESSFULLY downloaded (allow retry of failures)
-            if any(item['md5'] == md5 and item.get('success', False) for item in self.history[-50:]):
+            if any(item['md5'] == md5 and item.get('success', False) for item in self.history.recent(50)):
                 return False, "Recently downloaded"
 
             item = {
@@ -63,23 +131,95 @@ class DownloadQueue:
                 'source': source,
                 'added_at': datetime.now().isoformat(),
                 'status': 'queued',
-                'subfolder': subfolder
+                'subfolder': subfolder,
+                'priority': priority or 'normal'
             }
 
-            self.queue.append(item)
+            self.queue.push(item)
             self.save()
             self.logger.info(f"Added to queue: {md5}{f' (subfolder: {subfolder})' if subfolder else ''}")
             return True, "Added to queue"
     
-    def get_next(self):
-        """Get next item from queue"""
+    def get_next(self, eligible=None, scan_limit=20):
+        """
+        Get next item from queue.
+
+        Args:
+            eligible: Optional check for whether an item can start now, the first
+                      eligible item among the first scan_limit is taken
+            scan_limit: How far down the queue to look for an eligible item
+        """
+        if eligible is None:
+            with self.lock:
+                return self.queue.pop()
+
+        # The check may hit disk, so don't hold the lock while running it
+        with self.lock:
+            candidates = self.queue.peek(scan_limit)
+
+        for candidate in candidates:
+            if not eligible(candidate):
+                continue
+            with self.lock:
+                item = self.queue.take(candidate['md5'])
+                if item:
+                    return item
+        return None
+
+    def move(self, md5, position):
+        """Move a queued item to 'top', 'bottom' or a zero-based position"""
+        with self.lock:
+            moved = self.queue.move(md5, position)
+            if moved:
+                self.save()
+                self.logger.info(f"Moved {md5} to {position if isinstance(position, str) else f'position {position}'}")
+            return moved
+
+    def set_estimate(self, md5, size, expected_time, success_chance, next_host=None):
+        """Record the size, expected download time and first mirror of a queued item"""
         with self.lock:
-            if self.queue:
-                return self.queue.pop(0)
-            return None
+            return self.queue.update(md5, size=size, expected_time=expected_time, success_chance=success_chance, next_host=next_host)
+
+    def set_priority(self, md5, priority):
+        """Change the priority of a queued item"""
+        with self.lock:
+            changed = self.queue.set_priority(md5, priority)
+            if changed:
+                self.save()
+                self.logger.info(f"Set priority of {md5} to {priority}")
+            return changed
     
-    def mark_complete(self, md5, success, filepath=None, error=None, used_fast_download=False, filename=None, subfolder=None):
-        """Mark download as complete"""
+    def mark_processing(self, md5):
+        """Move the current download to the post-processing list, freeing the worker for the next item"""
+        with self.lock:
+            if not self.current_download or self.current_download['md5'] != md5:
+                return False
+
+            item = self.current_download
+            item['status'] = 'processing'
+            item['status_message'] = "Waiting for post-processing..."
+            item.pop('progress', None)
+            self.processing.append(item)
+            self.current_download = None
+            self.save()
+            return True
+
+    def set_processing_status(self, md5, status_message):
+        """Update the status message of an item being post-processed"""
+        with self.lock:
+            for item in self.processing:
+                if item['md5'] == md5:
+                    item['status_message'] = status_message
+
+    def mark_complete(self, md5, success, filepath=None, error=None, used_fast_download=False, filename=None, subfolder=None, timeline=None):
+        """Mark download as complete, with its phase timeline if one was recorded"""
+        size = None
+        if success and filepath:
+            try:
+                size = Path(filepath).stat().st_size
+            except OSError:
+                pass
+
         with self.lock:
             # Use provided filename, or extract from filepath if available
             if not filename and filepath:
@@ -93,10 +233,17 @@ class DownloadQueue:
                 'filepath': str(filepath) if filepath else None,
                 'error': error,
                 'used_fast_download': used_fast_download,
-                'subfolder': subfolder
+                'subfolder': subfolder,
+                'size': size,
+                'timeline': timeline.to_dict() if timeline else None
             }
             self.history.append(item)
-            self.current_download = None
+            self.stats.record(item)
+            DOWNLOADS.inc(result='success' if success else 'failed', method='fast' if used_fast_download else 'mirror')
+            # Post-processing finishes in the background, don't clear a newer current download
+            self.processing = [p for p in self.processing if p['md5'] != md5]
+            if self.current_download and self.current_download['md5'] == md5:
+                self.current_download = None
             self.save()
 
             if success:
@@ -106,22 +253,105 @@ class DownloadQueue:
             else:
                 self.logger.warning(f"Download failed: {filename or md5} - {error}")
     
+    def _get_remaining_time(self, item):
+        """Estimate the seconds left on the current download"""
+        progress = item.get('progress') or {}
+        if progress.get('speed') and progress.get('total_size'):
+            return max(0, progress['total_size'] - progress.get('downloaded', 0)) / progress['speed']
+        return item.get('expected_time') or DEFAULT_EXPECTED_TIME
+
+    def _get_eta_offsets(self):
+        """Seconds from the end of the current download to the end of each queued item"""
+        version, offsets = self._eta_offsets
+        if version != self.queue.version:
+            # Items without an estimate count as the average of those with one
+            queue = self.queue.ordered()
+            known = [item['expected_time'] for item in queue if item.get('expected_time') is not None]
+            fallback = sum(known) / len(known) if known else DEFAULT_EXPECTED_TIME
+
+            offsets = []
+            total = 0
+            for item in queue:
+                expected = item.get('expected_time')
+                total += fallback if expected is None else expected
+                offsets.append(total)
+            self._eta_offsets = (self.queue.version, offsets)
+        return offsets
+
+    def _get_queue_start(self):
+        """When the first queued item should start (after the current download)"""
+        if self.current_download:
+            return time.time() + self._get_remaining_time(self.current_download)
+        return time.time()
+
     def get_status(self):
-        """Get current queue status"""
+        """Get current queue status: counts and the items being worked on"""
         with self.lock:
+            current = self.current_download
+            if current:
+                current = dict(current, eta=datetime.fromtimestamp(self._get_queue_start()).isoformat())
+
             return {
-                'current': self.current_download,
-                'queue': self.queue.copy(),
+                'current': current,
+                'processing': [item.copy() for item in self.processing],
                 'queue_size': len(self.queue),
-                'recent_history': self.history[-10:][::-1]
+                'queue_version': self.queue.version,
+                'history_size': len(self.history),
+                'history_counts': self.history.counts(),
+                'history_version': self.history.version
+            }
+
+    def get_queue_page(self, offset=0, limit=50):
+        """Get a page of the queue in download order, with estimated completion times"""
+        with self.lock:
+            start = self._get_queue_start()
+            offsets = self._get_eta_offsets()
+            items = [
+                dict(item, eta=datetime.fromtimestamp(start + offsets[offset + i]).isoformat())
+                for i, item in enumerate(self.queue.page(offset, limit))
+            ]
+            return {
+                'items': items,
+                'offset': offset,
+                'limit': limit,
+                'total': len(self.queue),
+                'version': self.queue.version
+            }
+
+    def get_history_page(self, cursor=None, limit=50, status=None):
+        """Get a page of history, newest first"""
+        with self.lock:
+            items, next_cursor, total = self.history.page(cursor, limit, status)
+            return {
+                'items': [item.copy() for item in items],
+                'next_cursor': next_cursor,
+                'total': total,
+                'counts': self.history.counts(),
+                'version': self.history.version
             }
     
+    def get_stats(self):
+        """Get download statistics since they were last reset"""
+        with self.lock:
+            return self.stats.get()
+
+    def get_phase_report(self, limit=None, status=None):
+        """Phase timing percentiles over the most recent history entries"""
+        with self.lock:
+            items, _, _ = self.history.page(None, limit or len(self.history), status)
+        return phase_report(items)
+
+    def reset_stats(self):
+        """Start the download statistics over"""
+        with self.lock:
+            self.stats.reset()
+            self.save()
+            self.logger.info("Reset download statistics")
+
     def remove_from_queue(self, md5):
         """Remove item from queue"""
         with self.lock:
-            original_length = len(self.queue)
-            self.queue = [item for item in self.queue if item['md5'] != md5]
-            removed = original_length != len(self.queue)
+            removed = self.queue.remove(md5) is not None
             if removed:
                 self.save()
                 self.logger.info(f"Removed from queue: {md5}")
@@ -131,7 +361,7 @@ class DownloadQueue:
         """Clear all items from queue"""
         with self.lock:
             count = len(self.queue)
-            self.queue = []
+            self.queue.clear()
             self.save()
             self.logger.info(f"Cleared queue: {count} items removed")
             return count
@@ -140,7 +370,7 @@ class DownloadQueue:
         """Clear all items from history"""
         with self.lock:
             count = len(self.history)
-            self.history = []
+            self.history.clear()
             self.save()
             self.logger.info(f"Cleared history: {count} items removed")
             return count
@@ -159,7 +389,7 @@ class DownloadQueue:
                 return False, "Item not found in failed history"
 
             # Remove from history
-            self.history = [item for item in self.history if item['md5'] != md5]
+            self.history.remove_md5(md5)
 
             # Add back to queue
             new_item = {
@@ -169,7 +399,7 @@ class DownloadQueue:
                 'status': 'queued'
             }
 
-            self.queue.append(new_item)
+            self.queue.push(new_item)
             self.save()
             self.logger.info(f"Retrying failed download: {md5}")
             return True, "Added to queue for retry"
@@ -188,11 +418,13 @@ class DownloadQueue:
                 'source': self.current_download.get('source', 'paused'),
                 'added_at': datetime.now().isoformat(),
                 'status': 'queued',
-                'subfolder': self.current_download.get('subfolder')
+                'subfolder': self.current_download.get('subfolder'),
+                'priority': self.current_download.get('priority'),
+                **{key: self.current_download[key] for key in ESTIMATE_FIELDS if key in self.current_download}
             }
 
             # Add to front of queue
-            self.queue.insert(0, item)
+            self.queue.push_front(item)
             self.current_download = None
             self.save()
             self.logger.info(f"Requeued current download: {md5}")
@@ -0,0 +1,364 @@
+import bisect
+import heapq
+import itertools
+import time
+from datetime import datetime
+from stacks.constants import QUEUE_PRIORITIES
+
+# Rebuild the heap once this share of its entries has been removed or moved
+COMPACT_RATIO = 0.5
+
+# Expected download time (seconds) for items whose size isn't known yet
+DEFAULT_EXPECTED_TIME = 60
+
+# Item fields set by the lookahead, carried over when an item is requeued
+ESTIMATE_FIELDS = ('size', 'expected_time', 'success_chance', 'next_host')
+
+# Floor for the success chance, so unreliable items are pushed back but not forever
+MIN_SUCCESS_CHANCE = 0.05
+
+def _added_timestamp(item):
+    try:
+        return datetime.fromisoformat(item['added_at']).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+
+class QueueIndex:
+    """
+    Download queue ordered by priority, then by a per-item order key.
+
+    Items live in a heap of [rank, order, seq, md5] entries with an md5 index,
+    so popping the next item, adding one, removing one and moving one to the
+    top or bottom are O(log n). Moved and removed entries are left in the heap
+    as tombstones and skipped. Peeking at the next few items walks the top of
+    the heap. Listing the queue in order, finding an item's position and moving
+    it to a numbered position use a sorted list of entries, built once and then
+    kept up to date with bisect (a list insert or delete) rather than re-sorted.
+
+    Order keys implement the fairness policy: with 'round_robin' each subfolder
+    is its own lane and new items are stamped start-time fair queueing style, so
+    lanes take turns instead of one large batch holding up the others. With
+    'fifo' items go strictly in the order they were added.
+
+    With scheduling set to 'shortest_first' the order key is the expected cost
+    of an item (transfer time over chance of success) plus its add time scaled
+    by aging, so small, reliable items go first but a large one waiting long
+    enough still gets its turn. Lanes don't apply in this mode.
+    """
+
+    def __init__(self, fairness='round_robin', scheduling='arrival', aging=100):
+        self.fairness = fairness
+        self.scheduling = scheduling
+        self.aging = aging
+        self.heap = []
+        self.entries = {}
+        self.items = {}
+        self.seq = itertools.count()
+        self.lane_tags = {}
+        # Order key of the last item handed out, new lanes start from here
+        self.clock = 0
+        self.front = 0
+        self.back = 0
+        self.stale = 0
+        self.rank_counts = [0] * len(QUEUE_PRIORITIES)
+        # Live entries in download order, built on first use (see _sorted_entries)
+        self._sorted = None
+        self._ordered = None
+        # Bumped on every change, survives clear and load
+        self.version = getattr(self, 'version', 0) + 1
+
+    @staticmethod
+    def get_rank(item):
+        priority = item.get('priority') or 'normal'
+        return QUEUE_PRIORITIES.index(priority) if priority in QUEUE_PRIORITIES else QUEUE_PRIORITIES.index('normal')
+
+    @staticmethod
+    def get_lane(item):
+        return item.get('subfolder') or ''
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __contains__(self, md5):
+        return md5 in self.items
+
+    def __iter__(self):
+        return iter(self.ordered())
+
+    def get(self, md5):
+        return self.items.get(md5)
+
+    def md5s(self):
+        return set(self.items)
+
+    def _changed(self):
+        self._ordered = None
+        self.version += 1
+
+    def _sorted_entries(self):
+        if self._sorted is None:
+            self._sorted = sorted(self.entries.values())
+        return self._sorted
+
+    def _unsort(self, entry):
+        # Before the entry becomes a tombstone, while it still compares as itself
+        if self._sorted is not None:
+            del self._sorted[bisect.bisect_left(self._sorted, entry)]
+
+    def _insert(self, item, rank, order):
+        md5 = item['md5']
+        if md5 in self.entries:
+            self._drop(md5)
+        item['priority'] = QUEUE_PRIORITIES[rank]
+        entry = [rank, order, next(self.seq), md5]
+        heapq.heappush(self.heap, entry)
+        if self._sorted is not None:
+            bisect.insort(self._sorted, entry)
+        self.entries[md5] = entry
+        self.items[md5] = item
+        self.rank_counts[rank] += 1
+        self.front = min(self.front, order)
+        self.back = max(self.back, order)
+        self._changed()
+
+    def _drop(self, md5):
+        entry = self.entries.pop(md5)
+        self._unsort(entry)
+        entry[-1] = None
+        self.rank_counts[entry[0]] -= 1
+        self.stale += 1
+        self._changed()
+        if self.stale > COMPACT_RATIO * len(self.heap) and self.stale > 64:
+            self.heap = [live for live in self.heap if live[-1] is not None]
+            heapq.heapify(self.heap)
+            self.stale = 0
+        return self.items.pop(md5)
+
+    def configure(self, fairness, scheduling, aging):
+        """Apply new policies, re-sorting the queue if the scheduling mode changed."""
+        self.fairness = fairness
+        if (scheduling, aging) == (self.scheduling, self.aging):
+            return
+        items = self.ordered()
+        self.scheduling = scheduling
+        self.aging = aging
+        if scheduling == 'shortest_first':
+            # Manual placement made under the old keys doesn't carry over
+            for item in items:
+                item.pop('pinned', None)
+                item.pop('_order', None)
+        self.load(items)
+
+    def _cost_order(self, item):
+        expected = item.get('expected_time')
+        if expected is None:
+            expected = DEFAULT_EXPECTED_TIME
+        cost = expected / max(item.get('success_chance') or 0.5, MIN_SUCCESS_CHANCE)
+        return cost + self.aging / 100 * _added_timestamp(item)
+
+    def _next_order(self, item):
+        if self.scheduling == 'shortest_first':
+            return self._cost_order(item)
+        if self.fairness == 'fifo':
+            return max(self.back, self.clock) + 1
+        lane = self.get_lane(item)
+        tag = max(self.lane_tags.get(lane, self.clock), self.clock) + 1
+        self.lane_tags[lane] = tag
+        return tag
+
+    def push(self, item):
+        """Add an item at the end of its lane."""
+        self._insert(item, self.get_rank(item), self._next_order(item))
+
+    def push_front(self, item):
+        """Add an item ahead of everything else at its priority (used to requeue)."""
+        self._insert(item, self.get_rank(item), self.front - 1)
+
+    def pop(self):
+        """Take the next item, or None if the queue is empty."""
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            md5 = entry[-1]
+            if md5 is None:
+                self.stale -= 1
+                continue
+            del self.entries[md5]
+            self._unsort(entry)
+            self.rank_counts[entry[0]] -= 1
+            self.clock = max(self.clock, entry[1])
+            self._changed()
+            return self.items.pop(md5)
+        return None
+
+    def take(self, md5):
+        """
+        Take a specific item for download, out of turn.
+
+        The fairness clock only moves up to the head of the queue, so skipping
+        ahead to an item far down one lane doesn't push other lanes back.
+        """
+        if md5 not in self.entries:
+            return None
+        while self.heap[0][-1] is None:
+            heapq.heappop(self.heap)
+            self.stale -= 1
+        self.clock = max(self.clock, min(self.entries[md5][1], self.heap[0][1]))
+        return self._drop(md5)
+
+    def remove(self, md5):
+        """Remove an item, returning it (or None if it isn't queued)."""
+        if md5 not in self.entries:
+            return None
+        return self._drop(md5)
+
+    def update(self, md5, **fields):
+        """Update an item's fields, re-sorting it if they change its cost."""
+        item = self.items.get(md5)
+        if item is None:
+            return False
+        item.update(fields)
+        self._changed()
+        if self.scheduling == 'shortest_first' and not item.get('pinned'):
+            rank = self.entries[md5][0]
+            self._drop(md5)
+            self._insert(item, rank, self._cost_order(item))
+        return True
+
+    def clear(self):
+        self.__init__(self.fairness, self.scheduling, self.aging)
+
+    def ordered(self):
+        """All items in the order they'll be downloaded."""
+        if self._ordered is None:
+            self._ordered = [self.items[entry[-1]] for entry in self._sorted_entries()]
+        return self._ordered
+
+    def page(self, offset, limit):
+        """Items offset to offset + limit in download order."""
+        return [self.items[entry[-1]] for entry in self._sorted_entries()[offset:offset + limit]]
+
+    def peek(self, count):
+        """The next count items, without removing them, from the top of the heap."""
+        found = []
+        # Heap positions whose entries may come next, smallest first
+        frontier = [(self.heap[0], 0)] if self.heap else []
+        while frontier and len(found) < count:
+            entry, position = heapq.heappop(frontier)
+            if entry[-1] is not None:
+                found.append(self.items[entry[-1]])
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(self.heap):
+                    heapq.heappush(frontier, (self.heap[child], child))
+        return found
+
+    def index(self, md5):
+        entry = self.entries.get(md5)
+        if entry is None:
+            return None
+        return bisect.bisect_left(self._sorted_entries(), entry)
+
+    def move(self, md5, position):
+        """
+        Move an item to 'top', 'bottom' or a zero-based position.
+
+        The item takes the priority of the items it lands between, so it
+        really is downloaded at that point in the queue.
+
+        Returns:
+            True if the item was found
+        """
+        if md5 not in self.entries:
+            return False
+
+        # Keep it where it was put, even once its size is known
+        self.items[md5]['pinned'] = True
+
+        if position in ('top', 'bottom'):
+            item = self._drop(md5)
+            ranks = [rank for rank, count in enumerate(self.rank_counts) if count]
+            if position == 'top':
+                self._insert(item, min(ranks, default=self.get_rank(item)), self.front - 1)
+            else:
+                self._insert(item, max(ranks, default=self.get_rank(item)), self.back + 1)
+            return True
+
+        item = self._drop(md5)
+        others = self._sorted_entries()
+        position = max(0, min(int(position), len(others)))
+
+        if not others:
+            self._insert(item, self.get_rank(item), self.front - 1)
+        elif position == 0:
+            self._insert(item, others[0][0], self.front - 1)
+        elif position == len(others):
+            self._insert(item, others[-1][0], self.back + 1)
+        else:
+            before, after = others[position - 1], others[position]
+            if before[0] != after[0]:
+                # Last of the higher priority
+                self._insert(item, before[0], before[1] + 1)
+            else:
+                order = (before[1] + after[1]) / 2
+                if order in (before[1], after[1]):
+                    # Out of float precision between these two, spread the keys out and try again
+                    self._insert(item, before[0], before[1])
+                    self._renumber()
+                    return self.move(md5, position)
+                self._insert(item, before[0], order)
+        return True
+
+    def set_priority(self, md5, priority):
+        """Change an item's priority, keeping its place among items of that priority."""
+        if md5 not in self.entries or priority not in QUEUE_PRIORITIES:
+            return False
+        entry = self.entries[md5]
+        item = self._drop(md5)
+        self._insert(item, QUEUE_PRIORITIES.index(priority), entry[1])
+        return True
+
+    def _renumber(self):
+        """Spread order keys evenly over their current range, keeping the current order."""
+        entries = sorted(self.entries.values())
+        low = min(entry[1] for entry in entries)
+        high = max(entry[1] for entry in entries)
+        step = max((high - low) / max(len(entries) - 1, 1), 1)
+        self.lane_tags = {}
+        for position, entry in enumerate(entries):
+            entry[1] = low + position * step
+            lane = self.get_lane(self.items[entry[-1]])
+            self.lane_tags[lane] = entry[1]
+        self._sorted = entries
+        self.heap = list(entries)
+        self.stale = 0
+        self.front = low
+        self.back = entries[-1][1]
+        self._changed()
+
+    def dump(self):
+        """Items in download order with their order keys, for saving."""
+        return [dict(self.items[entry[-1]], _order=entry[1]) for entry in self._sorted_entries()]
+
+    def load(self, items):
+        """
+        Replace the contents with items, already in download order.
+
+        Saved order keys (see dump) are kept, otherwise they're numbered in
+        order, or priced in shortest_first mode.
+        """
+        self.__init__(self.fairness, self.scheduling, self.aging)
+        keep_keys = all('_order' in item for item in items)
+        for position, item in enumerate(items):
+            order = item.pop('_order', None)
+            if not keep_keys:
+                if self.scheduling == 'shortest_first' and not item.get('pinned'):
+                    order = self._cost_order(item)
+                else:
+                    order = position
+            self._insert(item, self.get_rank(item), order)
+            lane = self.get_lane(item)
+            self.lane_tags[lane] = max(self.lane_tags.get(lane, order), order)
+        # New lanes go right after the first item, like after a fresh dequeue
+        self.clock = min((entry[1] for entry in self.entries.values()), default=0)
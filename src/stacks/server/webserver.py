@@ -39,6 +39,13 @@ def create_app(config_path: str = None, debug_mode: bool = False):
     config = Config(config_path)
     setup_logging(config)
 
+    # ---- Re-apply logging settings when they change ----
+    def on_config_change(old, new):
+        if old.get("logging") != new.get("logging"):
+            setup_logging(config)
+
+    config.subscribe(on_config_change)
+
     # ---- Set secret key from config ----
     app.secret_key = config.get("api", "session_secret")
 
@@ -3,9 +3,23 @@ import logging
 import time
 from datetime import datetime
 from pathlib import Path
-from stacks.downloader.downloader import AnnaDownloader
+from stacks.downloader.breaker import BREAKER
+from stacks.downloader.connections import SHARED_SESSION
+from stacks.downloader.downloader import AnnaDownloader, PageLookup
+from stacks.downloader.finalize import PendingFinalize
+from stacks.downloader.politeness import POLITENESS, best_mirror_host
+from stacks.downloader.ratelimit import SHAPER
+from stacks.downloader.scoreboard import SCOREBOARD
+from stacks.downloader.timeline import phase, start_timeline, stop_timeline
+from stacks.server.postprocess import PostProcessor
+from stacks.server.queue_index import ESTIMATE_FIELDS
+from stacks.utils.domainutils import get_working_domain
+from stacks.utils.metrics import QUEUE_DEPTH, PROCESSING, DOWNLOADING, RESOLVE_SECONDS, TRANSFER_SECONDS
 from stacks.constants import DOWNLOAD_PATH, PROJECT_ROOT
 
+# Services checked in the background at startup and when their settings change
+SERVICE_CHECKS = ('fast_download', 'flaresolverr')
+
 class DownloadWorker:
     def __init__(self, queue, config):
         self.queue = queue
@@ -14,7 +28,17 @@ class DownloadWorker:
         self.paused = False
         self.cancel_current = False
         self.thread = None
+        self.lookahead_thread = None
         self.logger = logging.getLogger('worker')
+
+        # Results of the fast download key and FlareSolverr checks, for /api/ready(/details)
+        self.checks_lock = threading.Lock()
+        self.service_checks = {name: {'status': 'disabled'} for name in SERVICE_CHECKS}
+
+        # Read when /metrics is scraped, nothing to update on the hot path
+        QUEUE_DEPTH.set_function(lambda: len(self.queue.queue))
+        PROCESSING.set_function(lambda: len(self.queue.processing))
+        DOWNLOADING.set_function(lambda: 1 if self.queue.current_download else 0)
         
         # Progress callback to update current download
         def progress_callback(progress):
@@ -41,92 +65,200 @@ class DownloadWorker:
                         'status_message': status_message
                     })
 
+        # Finished downloads are moved into place off the worker thread
+        self.postprocessor = PostProcessor(queue, config)
+
         # Initialize downloader
         self.progress_callback = progress_callback
         self.status_callback = status_callback
+        self.configure_bandwidth()
+        self.configure_politeness()
+        # The lookahead fetches pages while the downloader is busy, so it gets its own session
+        self.page_lookup = PageLookup()
         self.recreate_downloader()
     
-    def recreate_downloader(self):
-        """Recreate downloader with current config"""
-        # Cleanup old downloader if it exists
-        if hasattr(self, 'downloader') and self.downloader:
-            self.downloader.cleanup()
-
-        # Get fast download config from main config
+    def downloader_settings(self):
+        """AnnaDownloader settings from the current config"""
         fast_config = {
             'enabled': self.config.get('fast_download', 'enabled', default=False),
             'key': self.config.get('fast_download', 'key'),
             'path_index': 0,
             'domain_index': 0
         }
-        
-        # Get FlareSolverr config
+
+        # Pass None if FlareSolverr is disabled, otherwise pass the URL
         flaresolverr_enabled = self.config.get('flaresolverr', 'enabled', default=False)
         flaresolverr_url = self.config.get('flaresolverr', 'url', default='http://localhost:8191')
-        flaresolverr_timeout = self.config.get('flaresolverr', 'timeout', default=60)
-        
-        # Convert timeout to milliseconds (downloader expects milliseconds)
-        flaresolverr_timeout_ms = flaresolverr_timeout * 1000
-        
-        # Get file naming config
-        prefer_title_naming = self.config.get('downloads', 'prefer_title_naming', default=False)
-        include_hash = self.config.get('downloads', 'include_hash', default="none")
 
-        # Get incomplete folder path from config
         incomplete_folder_path = self.config.get('downloads', 'incomplete_folder_path', default='/download/incomplete')
-        incomplete_dir = PROJECT_ROOT / incomplete_folder_path.lstrip('/')
 
-        # Pass None if FlareSolverr is disabled, otherwise pass the URL
+        return {
+            'incomplete_dir': PROJECT_ROOT / incomplete_folder_path.lstrip('/'),
+            'fast_download_config': fast_config,
+            'flaresolverr_url': flaresolverr_url if flaresolverr_enabled else None,
+            # Seconds in config, milliseconds in downloader
+            'flaresolverr_timeout': self.config.get('flaresolverr', 'timeout', default=60) * 1000,
+            'prefer_title_naming': self.config.get('downloads', 'prefer_title_naming', default=False),
+            'include_hash': self.config.get('downloads', 'include_hash', default="none"),
+            # Hours in config, seconds in downloader
+            'page_cache_ttl': self.config.get('cache', 'page_ttl', default=24) * 3600,
+            # KB/s in config, bytes/s in downloader
+            'min_speed': self.config.get('downloads', 'min_speed', default=10) * 1024,
+            'stall_window': self.config.get('downloads', 'stall_window', default=60),
+            # KB in config, bytes in downloader
+            'chunk_size': self.config.get('downloads', 'chunk_size', default=1024) * 1024
+        }
+
+    def recreate_downloader(self):
+        """Recreate downloader with current config"""
+        # Cleanup old downloader if it exists
+        if hasattr(self, 'downloader') and self.downloader:
+            self.downloader.cleanup()
+
+        settings = self.downloader_settings()
+        self.page_lookup.page_cache_ttl = settings['page_cache_ttl']
         self.downloader = AnnaDownloader(
             output_dir=DOWNLOAD_PATH,
-            incomplete_dir=incomplete_dir,
             progress_callback=self.progress_callback,
             status_callback=self.status_callback,
-            fast_download_config=fast_config,
-            flaresolverr_url=flaresolverr_url if flaresolverr_enabled else None,
-            flaresolverr_timeout=flaresolverr_timeout_ms,
-            prefer_title_naming=prefer_title_naming,
-            include_hash=include_hash
+            defer_finalize=True,
+            **settings
         )
-        
+        self.applied_settings = settings
+        self.check_services(fast_download=True, flaresolverr=True)
+        self.logger.info("Downloader recreated with updated config")
+
+    def apply_downloader_settings(self):
+        """
+        Apply changed settings to the running downloader, keeping its session
+        and cookies. Only a new incomplete folder needs a new downloader.
+        """
+        settings = self.downloader_settings()
+        changed = {name: value for name, value in settings.items() if self.applied_settings.get(name) != value}
+        if not changed:
+            return
+        if 'incomplete_dir' in changed:
+            self.recreate_downloader()
+            return
+
+        self.downloader.configure(**changed)
+        self.page_lookup.page_cache_ttl = settings['page_cache_ttl']
+        self.applied_settings = settings
+        self.logger.info(f"Downloader settings updated: {', '.join(sorted(changed))}")
+        self.check_services(
+            fast_download='fast_download_config' in changed,
+            flaresolverr='flaresolverr_url' in changed
+        )
+
+    def check_services(self, fast_download=False, flaresolverr=False):
+        """Test the fast download key and FlareSolverr in the background, recording the result"""
+        downloader = self.downloader
+        enabled = {
+            'fast_download': bool(downloader.fast_download_enabled and downloader.fast_download_key),
+            'flaresolverr': bool(downloader.flaresolverr_url)
+        }
+        requested = {'fast_download': fast_download, 'flaresolverr': flaresolverr}
+        pending = []
+        with self.checks_lock:
+            for name in SERVICE_CHECKS:
+                if not enabled[name]:
+                    self.service_checks[name] = {'status': 'disabled'}
+                elif requested[name]:
+                    self.service_checks[name] = {'status': 'pending'}
+                    pending.append(name)
+        if pending:
+            # The pending entries identify this round, a later one replaces them
+            checks = {name: self.service_checks[name] for name in pending}
+            threading.Thread(
+                target=self._check_services, args=(downloader, checks),
+                name='service-check', daemon=True
+            ).start()
+
+    def get_service_checks(self):
+        with self.checks_lock:
+            return {name: dict(check) for name, check in self.service_checks.items()}
+
+    def _record_check(self, checks, name, ok, message):
+        with self.checks_lock:
+            # Settings changed again while testing, a newer check will report
+            if self.service_checks[name] is checks[name]:
+                self.service_checks[name] = {
+                    'status': 'ok' if ok else 'failed',
+                    'message': message,
+                    'checked_at': datetime.now().isoformat()
+                }
+
+    def _check_services(self, downloader, checks):
         # Test fast download key if enabled and key is present
-        if fast_config['enabled'] and fast_config['key']:
+        if 'fast_download' in checks:
             self.logger.info("Testing fast download key...")
             try:
-                success = self.downloader.refresh_fast_download_info(force=True)
-                
+                success = downloader.refresh_fast_download_info(force=True)
+
                 if success:
-                    info = self.downloader.get_fast_download_info()
-                    self.logger.info(f"Fast download key valid - {info.get('downloads_left')}/{info.get('downloads_per_day')} downloads available")
+                    info = downloader.get_fast_download_info()
+                    message = f"Fast download key valid - {info.get('downloads_left')}/{info.get('downloads_per_day')} downloads available"
+                    self.logger.info(message)
                 else:
-                    self.logger.warning("Fast download key test failed")
+                    message = "Fast download key test failed"
+                    self.logger.warning(message)
             except Exception as e:
-                self.logger.error(f"Failed to test fast download key: {e}")
-        
-        # Test FlareSolverr if enabled
-        if flaresolverr_enabled and flaresolverr_url:
-            # Normalize URL for testing (same as downloader does)
-            test_url = flaresolverr_url
-            if not test_url.startswith(('http://', 'https://')):
-                test_url = f"http://{test_url}"
+                success, message = False, f"Failed to test fast download key: {e}"
+                self.logger.error(message)
+            self._record_check(checks, 'fast_download', success, message)
 
+        # Test FlareSolverr if enabled (the downloader has normalized the URL)
+        if 'flaresolverr' in checks:
+            test_url = downloader.flaresolverr_url
             self.logger.info(f"Testing FlareSolverr connection at {test_url}...")
+            success = False
             try:
-                import requests
-                response = requests.get(test_url, timeout=5)
-                if response.status_code == 200:
-                    self.logger.info("FlareSolverr connection successful")
+                response = SHARED_SESSION.get(test_url, timeout=5)
+                success = response.status_code == 200
+                if success:
+                    message = "FlareSolverr connection successful"
+                    self.logger.info(message)
                 else:
-                    self.logger.warning(f"FlareSolverr returned status {response.status_code}")
+                    message = f"FlareSolverr returned status {response.status_code}"
+                    self.logger.warning(message)
             except Exception as e:
-                self.logger.error(f"Failed to connect to FlareSolverr: {e}")
+                message = f"Failed to connect to FlareSolverr: {e}"
+                self.logger.error(message)
                 self.logger.warning("Downloads will fall back to external mirrors only")
-        
-        self.logger.info("Downloader recreated with updated config")
-    
+            self._record_check(checks, 'flaresolverr', success, message)
+
+    def configure_bandwidth(self):
+        """Apply bandwidth limits from config, running transfers pick them up on their next block"""
+        # KB/s in config, bytes/s in shaper
+        limit = self.config.get('bandwidth', 'limit', default=0) * 1024
+        host_limits = {
+            host: host_limit * 1024
+            for host, host_limit in (self.config.get('bandwidth', 'host_limits', default={}) or {}).items()
+        }
+        schedule = [
+            dict(entry, limit=entry['limit'] * 1024)
+            for entry in self.config.get('bandwidth', 'schedule', default=[]) or []
+        ]
+        SHAPER.configure(limit, host_limits, schedule)
+
+    def configure_politeness(self):
+        """Apply per-host spacing, concurrency limits and circuit breakers from config"""
+        POLITENESS.configure(
+            spacing=self.config.get('downloads', 'delay', default=2),
+            max_per_host=self.config.get('downloads', 'max_per_host', default=2)
+        )
+        BREAKER.configure(
+            threshold=self.config.get('downloads', 'breaker_failures', default=3),
+            cooldown=self.config.get('downloads', 'breaker_cooldown', default=60)
+        )
+
     def update_config(self):
-        """Update downloader with new config (called when config changes)"""
-        self.recreate_downloader()
+        """Apply new config (called when config changes), in place where possible"""
+        self.configure_bandwidth()
+        self.configure_politeness()
+        self.postprocessor.reconfigure()
+        self.queue.reconfigure()
+        self.apply_downloader_settings()
     
     def start(self):
         """Start worker thread"""
@@ -134,6 +266,8 @@ class DownloadWorker:
             self.running = True
             self.thread = threading.Thread(target=self._worker_loop, daemon=True)
             self.thread.start()
+            self.lookahead_thread = threading.Thread(target=self._lookahead_loop, daemon=True)
+            self.lookahead_thread.start()
             self.logger.info("Download worker started")
     
     def stop(self):
@@ -147,17 +281,23 @@ class DownloadWorker:
                 item = self.queue.current_download
                 self.logger.warning(f"Cancelling active download: {item.get('title', 'Unknown')}")
                 # Put it back in the queue so it can be resumed later
-                self.queue.queue.insert(0, {
+                self.queue.queue.push_front({
                     'md5': item['md5'],
                     'title': item.get('title', 'Unknown'),
                     'source': item.get('source'),
                     'added_at': item.get('added_at'),
                     'status': 'queued',
-                    'subfolder': item.get('subfolder')
+                    'subfolder': item.get('subfolder'),
+                    'priority': item.get('priority'),
+                    **{key: item[key] for key in ESTIMATE_FIELDS if key in item}
                 })
                 self.queue.current_download = None
                 self.queue.save()
 
+        if self.lookahead_thread:
+            self.lookahead_thread.join(timeout=5)
+        self.page_lookup.cleanup()
+
         if self.thread:
             self.thread.join(timeout=5)
             if self.thread.is_alive():
@@ -165,6 +305,9 @@ class DownloadWorker:
             else:
                 self.logger.info("Download worker stopped")
 
+        # Let files that already finished downloading land in the library
+        self.postprocessor.stop()
+
     def pause(self):
         """Pause the worker"""
         if not self.paused:
@@ -212,19 +355,74 @@ class DownloadWorker:
     def _cleanup_partial_file(self, md5):
         """Clean up partial download file in incomplete directory"""
         try:
-            incomplete_folder_path = self.config.get('downloads', 'incomplete_folder_path', default='/download/incomplete')
-            incomplete_dir = PROJECT_ROOT / incomplete_folder_path.lstrip('/')
+            for name in self.downloader.part_manifest.discard(md5):
+                self.logger.info(f"Cleaned up partial file: {name}")
+        except Exception as e:
+            self.logger.warning(f"Error during partial file cleanup: {e}")
+
+    def _reclaim_incomplete_space(self):
+        """Remove orphaned partial downloads if the incomplete folder is over its disk budget"""
+        try:
+            # MB in config, bytes in manifest
+            budget = self.config.get('downloads', 'incomplete_budget', default=5120) * 1024 * 1024
+            with self.queue.lock:
+                keep = self.queue.queue.md5s() | {item['md5'] for item in self.queue.processing}
+                if self.queue.current_download:
+                    keep.add(self.queue.current_download['md5'])
+            self.downloader.part_manifest.reclaim(budget, keep)
+        except Exception as e:
+            self.logger.warning(f"Error while reclaiming incomplete folder space: {e}")
+
+    def _is_host_ready(self, item):
+        """Check whether the host an item would start on is free to use"""
+        try:
+            return POLITENESS.is_ready(self.downloader.predict_next_host(item.get('next_host')))
+        except Exception as e:
+            self.logger.debug(f"Could not predict host for {item['md5']}: {e}")
+            return True
 
-            # Look for any files with this MD5 in incomplete directory
-            if incomplete_dir.exists():
-                for file in incomplete_dir.glob(f"*{md5}*"):
+    def _estimate_item(self, md5):
+        """
+        Look up an item's size and estimate its download time.
+
+        Returns:
+            True if this needed a page fetch from Anna's Archive
+        """
+        meta = self.page_lookup.load_cached_page(md5)
+        fetched = False
+        if meta is None:
+            # One page fetch at a time, spaced like any other request to the domain
+            if not POLITENESS.is_ready(get_working_domain()):
+                return False
+            meta = self.page_lookup.get_page_info(md5)
+            fetched = True
+
+        if meta is None:
+            # Don't keep retrying, the download itself will try again
+            self.queue.set_estimate(md5, None, None, None)
+        else:
+            expected_time, success_chance = SCOREBOARD.estimate(meta.get('links', []), meta.get('size'))
+            # Kept on the item so scheduling passes don't read the page cache
+            next_host = best_mirror_host(meta.get('links'))
+            self.queue.set_estimate(md5, meta.get('size'), expected_time, success_chance, next_host)
+        return fetched
+
+    def _lookahead_loop(self):
+        """Find the size of items near the head of the queue, for scheduling and ETAs"""
+        while self.running:
+            count = self.config.get('queue', 'lookahead', default=5)
+            if count and not self.paused:
+                with self.queue.lock:
+                    pending = [item['md5'] for item in self.queue.queue.peek(count) if 'size' not in item]
+                for md5 in pending:
+                    if not self.running:
+                        break
                     try:
-                        file.unlink()
-                        self.logger.info(f"Cleaned up partial file: {file.name}")
+                        if self._estimate_item(md5):
+                            break
                     except Exception as e:
-                        self.logger.warning(f"Failed to remove partial file {file.name}: {e}")
-        except Exception as e:
-            self.logger.warning(f"Error during partial file cleanup: {e}")
+                        self.logger.debug(f"Lookahead failed for {md5}: {e}")
+            time.sleep(1)
 
     def get_fast_download_info(self):
         """Get current fast download status"""
@@ -236,7 +434,6 @@ class DownloadWorker:
     
     def _worker_loop(self):
         """Main worker loop"""
-        delay = self.config.get('downloads', 'delay', default=2)
         resume_attempts = self.config.get('downloads', 'resume_attempts', default=3)
 
         while self.running:
@@ -245,10 +442,12 @@ class DownloadWorker:
                 time.sleep(1)
                 continue
 
-            item = self.queue.get_next()
+            # Take the first item whose host isn't cooling down or backing us off
+            item = self.queue.get_next(eligible=self._is_host_ready)
 
             if item is None:
-                time.sleep(1)
+                # Poll quickly while items wait on a host, slowly when the queue is empty
+                time.sleep(0.25 if self.queue.queue else 1)
                 continue
             
             # Set as current download FIRST (before fetching download info)
@@ -258,10 +457,17 @@ class DownloadWorker:
                 self.queue.current_download['status'] = 'downloading'
                 self.queue.current_download['started_at'] = datetime.now().isoformat()
 
+            # Make room for this download by dropping orphaned partials
+            self._reclaim_incomplete_space()
+
             # Fetch download info
             self.logger.info(f"Fetching download info: {item['md5']}")
+            start_timeline()
+            resolve_start = time.monotonic()
             try:
-                filename, links = self.downloader.get_download_links(item['md5'])
+                with phase('page'):
+                    filename, links = self.downloader.get_download_links(item['md5'])
+                RESOLVE_SECONDS.observe(time.monotonic() - resolve_start)
             except Exception as e:
                 self.logger.error(f"Failed to fetch download info: {e}")
 
@@ -271,7 +477,7 @@ class DownloadWorker:
                     self.queue.requeue_current()
                     continue
 
-                self.queue.mark_complete(item['md5'], False, error=f"Failed to fetch download info: {e}", subfolder=item.get('subfolder'))
+                self.queue.mark_complete(item['md5'], False, error=f"Failed to fetch download info: {e}", subfolder=item.get('subfolder'), timeline=stop_timeline())
                 continue
 
             # Update current download with fetched information
@@ -308,6 +514,7 @@ class DownloadWorker:
 
             try:
                 # Pass pre-fetched filename and links to avoid duplicate API calls
+                transfer_start = time.monotonic()
                 success, used_fast_download, filepath = self.downloader.download(
                     item['md5'],
                     resume_attempts=resume_attempts,
@@ -315,22 +522,27 @@ class DownloadWorker:
                     links=links,
                     subfolder=item.get('subfolder')
                 )
+                TRANSFER_SECONDS.observe(time.monotonic() - transfer_start, result='success' if success else 'failed')
 
                 # Once download completes (success or failure), it's too late to cancel
                 # Reset the cancel flag if it was set - cancellation is handled during download via progress_callback
                 if self.cancel_current:
                     self.cancel_current = False
 
+                # The transfer is done, finish it in the background and move on to the next item
+                if success and isinstance(filepath, PendingFinalize):
+                    self.postprocessor.submit(self.downloader, item, filepath, used_fast_download=used_fast_download, filename=filename, timeline=stop_timeline())
+
                 # Check if paused after download completes - if so, requeue instead of marking complete
-                if self.paused:
+                elif self.paused:
                     self.logger.info(f"Pausing download: {filename}")
                     self.queue.requeue_current()
                     continue
 
-                if success:
-                    self.queue.mark_complete(item['md5'], True, filepath=filepath, used_fast_download=used_fast_download, filename=filename, subfolder=item.get('subfolder'))
+                elif success:
+                    self.queue.mark_complete(item['md5'], True, filepath=filepath, used_fast_download=used_fast_download, filename=filename, subfolder=item.get('subfolder'), timeline=stop_timeline())
                 else:
-                    self.queue.mark_complete(item['md5'], False, error="Download failed", filename=filename, subfolder=item.get('subfolder'))
+                    self.queue.mark_complete(item['md5'], False, error="Download failed", filename=filename, subfolder=item.get('subfolder'), timeline=stop_timeline())
 
             except Exception as e:
                 self.logger.error(f"Download error: {item['md5']} - {e}")
@@ -355,8 +567,4 @@ class DownloadWorker:
                     self.queue.requeue_current()
                     continue
 
-                self.queue.mark_complete(item['md5'], False, error=str(e), filename=filename, subfolder=item.get('subfolder'))
-            
-            # Rate limiting
-            if self.queue.queue:
-                time.sleep(delay)
\ No newline at end of file
+                self.queue.mark_complete(item['md5'], False, error=str(e), filename=filename, subfolder=item.get('subfolder'), timeline=stop_timeline())
\ No newline at end of file
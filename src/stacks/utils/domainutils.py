@@ -1,6 +1,7 @@
 import json
 import logging
 from stacks.constants import ANNAS_ARCHIVE_DOMAINS, DOMAIN_STATE_FILE, CONFIG_PATH
+from stacks.utils.metrics import DOMAIN_ATTEMPTS, DOMAIN_ROTATIONS
 
 logger = logging.getLogger(__name__)
 
@@ -71,6 +72,8 @@ def try_domains_until_success(func, *args, **kwargs):
     Raises:
         The last exception encountered if all domains fail
     """
+    from stacks.downloader.breaker import BREAKER, HostUnavailable
+
     # Start with the last working domain
     current_domain = get_working_domain()
     tried_domains = []
@@ -83,12 +86,24 @@ def try_domains_until_success(func, *args, **kwargs):
             continue
 
         tried_domains.append(current_domain)
+
+        # Don't wait for a timeout from a domain that's known to be down
+        if BREAKER.is_open(current_domain):
+            DOMAIN_ATTEMPTS.inc(outcome='skipped')
+            logger.debug(f"Skipping domain {current_domain}, it's unavailable")
+            last_error = last_error or HostUnavailable(f"{current_domain} is unavailable")
+            current_domain = get_next_domain(current_domain)
+            continue
+
         logger.debug(f"Trying domain: {current_domain}")
 
         try:
             # Call the function with the current domain
             kwargs['domain'] = current_domain
             result = func(*args, **kwargs)
+            DOMAIN_ATTEMPTS.inc(outcome='success')
+            if tried_domains[0] != current_domain:
+                DOMAIN_ROTATIONS.inc()
 
             # Success! Save this domain for future use
             save_working_domain(current_domain)
@@ -96,6 +111,7 @@ def try_domains_until_success(func, *args, **kwargs):
             return result
 
         except Exception as e:
+            DOMAIN_ATTEMPTS.inc(outcome='failure')
             logger.warning(f"Failed with domain {current_domain}: {e}")
             last_error = e
             current_domain = get_next_domain(current_domain)
@@ -1,38 +1,52 @@
+import atexit
+import copy
+import gzip
+import json
 import logging
+import os
+import queue
+import shutil
 import sys
 import flask
-from stacks.constants import LOG_PATH, LOG_FORMAT, LOG_DATE_FORMAT, LOG_VIEW_LENGTH
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from stacks.constants import LOG_PATH, LOG_FORMAT, LOG_DATE_FORMAT, LOG_VIEW_LENGTH, LOG_FILE_NAME
 from pathlib import Path
 from datetime import datetime
 from collections import deque
 
 LOG_BUFFER = deque(maxlen=LOG_VIEW_LENGTH)
 
+# Writes records to the handlers on its own thread, replaced on every setup_logging
+_listener = None
+
 def setup_logging(config=None):
     """
     Setup logging.
+
+    Loggers only put records on a queue; formatting and writing to the
+    console, the log view and the log file happen on a listener thread,
+    so logging never waits on I/O (or holds up whoever holds a lock).
     """
+    global _listener
 
     # ---- Determine log level ----
     if config is None:
         log_level = logging.DEBUG
+        log_format = 'text'
+        keep_days = 30
     else:
         log_level = getattr(
             logging,
             config.get('logging', 'level', default='WARNING').upper(),
             logging.WARNING
         )
+        log_format = config.get('logging', 'format', default='text')
+        keep_days = config.get('logging', 'keep_days', default=30)
 
     # ---- Create log directory ----
     log_path = Path(LOG_PATH)
     log_path.mkdir(parents=True, exist_ok=True)
 
-
-    # ---- Generate Logfile name ----
-    log_file = (
-        log_path / f"log-{datetime.now().strftime('%Y-%m-%d')}.log"
-    )
-
     # ---- Root logger ----
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
@@ -41,29 +55,44 @@ def setup_logging(config=None):
     flask.cli.show_server_banner = lambda *args, **kwargs: None
     logging.getLogger('werkzeug').disabled = True
 
-    # ---- Remove old handlers ----
-    for handler in root_logger.handlers[:]:
-        root_logger.removeHandler(handler)
-        handler.close()
+    text_formatter = logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT)
+    formatter = JsonFormatter() if log_format == 'json' else text_formatter
 
     # ---- Create console handler ----
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(log_level)
-    console_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
-    root_logger.addHandler(console_handler)
+    console_handler.setFormatter(formatter)
 
-    # ---- Add UI buffer handler ----
+    # ---- Add UI buffer handler (always text, the log view parses it) ----
     ui_handler = UILogHandler()
     ui_handler.setLevel(log_level)
-    ui_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
-    root_logger.addHandler(ui_handler)
-
-    # ---- Create file handler only when config exists ----
-    if log_file:
-        file_handler = logging.FileHandler(log_file)
-        file_handler.setLevel(log_level)
-        file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
-        root_logger.addHandler(file_handler)
+    ui_handler.setFormatter(text_formatter)
+
+    # ---- Create file handler, rolled over and compressed at midnight ----
+    file_handler = TimedRotatingFileHandler(log_path / LOG_FILE_NAME, when='midnight', encoding='utf-8')
+    file_handler.namer = _log_archive_name
+    file_handler.rotator = lambda source, dest: _archive_log(source, dest, keep_days)
+    file_handler.setLevel(log_level)
+    file_handler.setFormatter(formatter)
+
+    # ---- Route the root logger through the queue ----
+    log_queue = queue.SimpleQueue()
+    old_listener = _listener
+    _listener = QueueListener(log_queue, console_handler, ui_handler, file_handler, respect_handler_level=True)
+    _listener.start()
+    queue_handler = LogQueueHandler(log_queue)
+    root_logger.addHandler(queue_handler)
+
+    # ---- Remove old handlers once the new one is in (so no record goes unhandled),
+    # then flush what the old listener still has ----
+    for handler in root_logger.handlers[:]:
+        if handler is not queue_handler:
+            root_logger.removeHandler(handler)
+            handler.close()
+    if old_listener is not None:
+        old_listener.stop()
+        for handler in old_listener.handlers:
+            handler.close()
 
     # ---- Configure werkzeug logger ----
     werkzeug_logger = logging.getLogger('werkzeug')
@@ -89,4 +118,55 @@ class UILogHandler(logging.Handler):
             msg = self.format(record)
             LOG_BUFFER.append(msg)
         except Exception:
-            pass
\ No newline at end of file
+            pass
+
+class LogQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # The listener is in this process, so the record is passed on as it is,
+        # exception included; only the message is merged now, while its
+        # arguments still hold the values they had when it was logged
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def _log_archive_name(default_name):
+    """stacks.log.2025-01-31 -> log-2025-01-31.log.gz, next to it"""
+    path = Path(default_name)
+    date = path.suffix.lstrip('.')
+    return str(path.with_name(f"log-{date}.log.gz"))
+
+def _archive_log(source, dest, keep_days):
+    """Compress a finished day's log, then drop archives older than keep_days (0 keeps all)."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+    if keep_days:
+        archives = sorted(Path(dest).parent.glob('log-*.log*'))
+        for old in archives[:-keep_days]:
+            try:
+                old.unlink()
+            except OSError:
+                pass
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+atexit.register(_stop_listener)
@@ -0,0 +1,195 @@
+import bisect
+import math
+import threading
+
+# Default histogram buckets (seconds), from a quick page fetch to a long transfer
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        if not self.labelnames:
+            # Unlabelled metrics are reported from the start, as 0
+            self.values[()] = self._initial()
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self.lock:
+            return [(self.name, key, (), value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, key, extra, value in self._samples():
+            lines.append(f'{name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return lines
+
+class Counter(_Metric):
+    """A value that only goes up."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that goes up and down, or is read from a function when scraped."""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        super().__init__(name, help_text, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function):
+        """Read the value from function() at scrape time (unlabelled gauges only)."""
+        self.function = function
+
+    def _samples(self):
+        if self.function is None:
+            return super()._samples()
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        return [(self.name, (), (), value)]
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, help_text, labels)
+
+    def _initial(self):
+        return [[0] * len(self.buckets), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = self._initial()
+            # Counted in its own bucket only, cumulated when scraped
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f'{self.name}_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+                samples.append((f'{self.name}_sum', key, (), total))
+                samples.append((f'{self.name}_count', key, (), count))
+        return samples
+
+class MetricsRegistry:
+    """All metrics, rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+METRICS = MetricsRegistry()
+
+# ---- Stacks metrics ----
+
+DOWNLOADS = METRICS.counter(
+    'stacks_downloads_total', 'Finished downloads by result and method', ('result', 'method'))
+DOWNLOAD_BYTES = METRICS.counter(
+    'stacks_download_bytes_total', 'Bytes received from download servers')
+MIRROR_ATTEMPTS = METRICS.counter(
+    'stacks_mirror_attempts_total', 'Mirror download attempts by outcome', ('outcome',))
+FAST_DOWNLOAD_ATTEMPTS = METRICS.counter(
+    'stacks_fast_download_attempts_total', 'Fast download attempts by outcome', ('outcome',))
+FLARESOLVERR_SOLVES = METRICS.counter(
+    'stacks_flaresolverr_solves_total', 'FlareSolverr challenge solves by outcome', ('outcome',))
+DOMAIN_ATTEMPTS = METRICS.counter(
+    'stacks_domain_attempts_total', "Anna's Archive domain attempts by outcome", ('outcome',))
+DOMAIN_ROTATIONS = METRICS.counter(
+    'stacks_domain_rotations_total', "Times the working Anna's Archive domain changed")
+HTTP_REQUESTS = METRICS.counter(
+    'stacks_http_requests_total', 'HTTP requests by whether they reused a pooled connection', ('connection',))
+TLS_HANDSHAKES = METRICS.counter(
+    'stacks_tls_handshakes_total', 'TLS handshakes by whether they resumed an earlier session', ('resumed',))
+BREAKER_TRIPS = METRICS.counter(
+    'stacks_breaker_trips_total', 'Times a host circuit breaker opened')
+
+QUEUE_DEPTH = METRICS.gauge('stacks_queue_depth', 'Items waiting in the queue')
+PROCESSING = METRICS.gauge('stacks_processing_items', 'Items being post-processed')
+DOWNLOADING = METRICS.gauge('stacks_downloading', '1 while a download is in progress')
+BREAKER_OPEN_HOSTS = METRICS.gauge('stacks_breaker_open_hosts', 'Hosts whose circuit breaker is open or half-open')
+
+RESOLVE_SECONDS = METRICS.histogram(
+    'stacks_resolve_seconds', 'Time to look up download links for an item')
+TRANSFER_SECONDS = METRICS.histogram(
+    'stacks_transfer_seconds', 'Time to download an item once its links are known', ('result',))
+VERIFY_SECONDS = METRICS.histogram(
+    'stacks_verify_seconds', 'Time to verify a download and move it into place', ('stage',))
+FLARESOLVERR_SECONDS = METRICS.histogram(
+    'stacks_flaresolverr_solve_seconds', 'Time for a FlareSolverr solve')
@@ -2,12 +2,13 @@ import logging
 import shutil
 from pathlib import Path
 from typing import Tuple, List
+from stacks.downloader.manifest import PartManifest, MANIFEST_NAME
 
 logger = logging.getLogger('migration')
 
 def migrate_incomplete_folder(old_path: Path, new_path: Path) -> Tuple[bool, str, dict]:
     """
-    Migrate .part files from old incomplete folder to new incomplete folder.
+    Migrate .part files (with their resume sidecars and manifest entries) from old incomplete folder to new incomplete folder.
     """
     stats = {
         'files_found': 0,
@@ -41,10 +42,13 @@ def migrate_incomplete_folder(old_path: Path, new_path: Path) -> Tuple[bool, str
             logger.info("No migration needed (paths are the same or old path doesn't exist)")
             return True, "No migration needed", stats
 
-        # Find all .part files
+        # Find all .part files: the ones the manifest tracks, plus any untracked leftovers
+        old_manifest = PartManifest(old_path)
         part_files: List[Path] = []
         try:
-            part_files = list(old_path.glob('*.part'))
+            tracked_files = [old_path / entry['name'] for entry in old_manifest.entries.values()]
+            untracked_files = [f for f in old_path.glob('*.part') if f not in tracked_files]
+            part_files = tracked_files + untracked_files
             stats['files_found'] = len(part_files)
             logger.info(f"Found {len(part_files)} .part files to migrate")
         except Exception as e:
@@ -68,6 +72,11 @@ def migrate_incomplete_folder(old_path: Path, new_path: Path) -> Tuple[bool, str
 
                 # Verify copy succeeded
                 if dest_file.exists() and dest_file.stat().st_size == file_size:
+                    # Bring the resume sidecar along so the partial can still be validated
+                    meta_file = part_file.with_name(f"{part_file.name}.meta")
+                    if meta_file.exists():
+                        shutil.copy2(meta_file, new_path / meta_file.name)
+                        migrated_files.append(meta_file)
                     migrated_files.append(part_file)
                     stats['files_migrated'] += 1
                     stats['bytes_migrated'] += file_size
@@ -84,6 +93,17 @@ def migrate_incomplete_folder(old_path: Path, new_path: Path) -> Tuple[bool, str
                 stats['errors'].append(error_msg)
                 logger.error(error_msg)
 
+        # Carry the manifest entries of migrated partials over to the new location
+        migrated_names = {f.name for f in migrated_files}
+        migrated_entries = {
+            md5: entry for md5, entry in old_manifest.entries.items()
+            if entry['name'] in migrated_names
+        }
+        if migrated_entries:
+            PartManifest(new_path).adopt(migrated_entries)
+        if len(migrated_entries) == len(old_manifest.entries):
+            (old_path / MANIFEST_NAME).unlink(missing_ok=True)
+
         # Delete successfully migrated files from old location
         for part_file in migrated_files:
             try:
@@ -10,6 +10,21 @@ let consoleInterval = null;
 const md5Regex = /[a-fA-F0-9]{32}/;
 let subdirectoriesTagInput = null;
 
+// Queue and history are fetched a page at a time
+const PAGE_SIZE = 50;
+// ETAs in a queue page move with the current download, refetch it this often (ms) even if unchanged
+const QUEUE_ETA_REFRESH = 30000;
+let queueOffset = 0;
+let queueItems = [];
+let queueVersion = null;
+let queueFetchedAt = 0;
+let lastProcessing = [];
+let lastProcessingJson = "[]";
+let historyItems = [];
+let historyCursor = null;
+let historyVersion = null;
+let historyFilter = "";
+
 // ============================================================================
 // UTILITY FUNCTIONS
 // ============================================================================
@@ -26,11 +41,20 @@ function formatTime(isoString) {
 function formatBytes(bytes) {
   if (bytes === 0) return "0 B";
   const k = 1024;
-  const sizes = ["B", "KB", "MB", "GB"];
+  const sizes = ["B", "KB", "MB", "GB", "TB"];
   const i = Math.floor(Math.log(bytes) / Math.log(k));
   return (bytes / Math.pow(k, i)).toFixed(2) + " " + sizes[i];
 }
 
+function formatEta(isoString) {
+  const date = new Date(isoString);
+  // Just the time when it's today
+  if (date.toDateString() === new Date().toDateString()) {
+    return date.toLocaleTimeString([], { hour: "2-digit", minute: "2-digit" });
+  }
+  return date.toLocaleString([], { dateStyle: "short", timeStyle: "short" });
+}
+
 function colorize(line) {
   const template = document.getElementById("log-line-template");
   const clone = template.content.firstElementChild.cloneNode(true);
@@ -122,12 +146,7 @@ function updateStatus() {
       }
 
       // Update stats
-      const successCount = data.recent_history.filter((h) => h.success).length;
-      const failCount = data.recent_history.filter((h) => !h.success).length;
-
       document.getElementById("stat-queue").textContent = data.queue_size;
-      document.getElementById("stat-success").textContent = successCount;
-      document.getElementById("stat-failed").textContent = failCount;
 
       // Update fast download stat
       const fastCard = document.getElementById("stat-fast-card");
@@ -185,6 +204,7 @@ function updateStatus() {
         // Calculate and display transfer speed
         const speed = progress.speed || 0;
         progressTextEl.querySelector(".progress-speed").textContent = `(${formatBytes(speed)}/s)`;
+        progressTextEl.querySelector(".progress-eta").textContent = data.current.eta ? `ETA ${formatEta(data.current.eta)}` : "";
 
         currentDiv.style.display = "block";
       } else {
@@ -205,13 +225,27 @@ function updateStatus() {
         pauseBtn.dataset.icon = "pause-circle-line";
       }
 
-      // Update queue
+      // Update queue, only refetched when it changed or its ETAs are getting old
       document.getElementById("queue-count").textContent = data.queue_size;
-      updateQueueList(data.queue);
+      const processing = data.processing || [];
+      const processingJson = JSON.stringify(processing);
+      const processingChanged = processingJson !== lastProcessingJson;
+      lastProcessing = processing;
+      lastProcessingJson = processingJson;
+      if (data.queue_version !== queueVersion || Date.now() - queueFetchedAt > QUEUE_ETA_REFRESH) {
+        queueVersion = data.queue_version;
+        loadQueuePage();
+      } else if (processingChanged && queueOffset === 0) {
+        updateQueueList(queueItems, lastProcessing);
+      }
 
-      // Update history
-      document.getElementById("history-count").textContent = data.recent_history.length;
-      updateHistoryList(data.recent_history);
+      // Update history, only refetched when it changed
+      document.getElementById("history-count").textContent = data.history_size;
+      if (data.history_version !== historyVersion) {
+        historyVersion = data.history_version;
+        reloadHistory();
+        loadStats();
+      }
     })
     .catch((err) => console.error("Failed to update status:", err));
 }
@@ -280,6 +314,40 @@ function removeFromQueue(md5) {
     .catch((err) => console.error("Failed to remove item:", err));
 }
 
+function loadQueuePage() {
+  apiFetch(`/api/queue?offset=${queueOffset}&limit=${PAGE_SIZE}`)
+    .then((r) => r.json())
+    .then((page) => {
+      // Items were removed from under the current page, go back to the last one
+      if (page.items.length === 0 && page.total > 0 && queueOffset > 0) {
+        queueOffset = Math.floor((page.total - 1) / PAGE_SIZE) * PAGE_SIZE;
+        loadQueuePage();
+        return;
+      }
+      queueItems = page.items;
+      queueFetchedAt = Date.now();
+      // Post-processing items are only listed on the first page
+      updateQueueList(page.items, queueOffset === 0 ? lastProcessing : []);
+      updateQueuePager(page);
+    })
+    .catch((err) => console.error("Failed to load queue:", err));
+}
+
+function changeQueuePage(direction) {
+  queueOffset = Math.max(0, queueOffset + direction * PAGE_SIZE);
+  loadQueuePage();
+}
+
+function moveInQueue(md5, position) {
+  apiFetch("/api/queue/move", {
+    method: "POST",
+    body: JSON.stringify({ md5: md5, position: position }),
+  })
+    .then((r) => r.json())
+    .then(() => updateStatus())
+    .catch((err) => console.error("Failed to move item:", err));
+}
+
 function clearQueue() {
   apiFetch("/api/queue/clear", { method: "POST" })
     .then((r) => r.json())
@@ -418,6 +486,62 @@ function addDownload() {
 // API FUNCTIONS - HISTORY
 // ============================================================================
 
+function loadStats() {
+  apiFetch("/api/stats")
+    .then((r) => r.json())
+    .then((stats) => {
+      document.getElementById("stat-success").textContent = stats.success;
+      document.getElementById("stat-failed").textContent = stats.failed;
+      document.getElementById("stat-bytes").textContent = formatBytes(stats.bytes);
+
+      const day = stats.windows["24h"];
+      const hour = stats.windows["1h"];
+      document.getElementById("stat-success").parentElement.title =
+        `${day.success} in the last 24h, ${hour.success} in the last hour`;
+      document.getElementById("stat-failed").parentElement.title =
+        `${day.failed} in the last 24h, ${hour.failed} in the last hour`;
+      document.getElementById("stat-bytes").parentElement.title =
+        `${formatBytes(day.bytes)} in the last 24h, ${stats.fast} fast / ${stats.mirror} mirror downloads`;
+    })
+    .catch((err) => console.error("Failed to load stats:", err));
+}
+
+function fetchHistory(cursor, limit) {
+  const params = new URLSearchParams({ limit: limit });
+  if (cursor !== null) params.set("cursor", cursor);
+  if (historyFilter) params.set("status", historyFilter);
+  return apiFetch("/api/history?" + params.toString()).then((r) => r.json());
+}
+
+function reloadHistory() {
+  // Keep as many entries loaded as before, so "Load more" isn't undone by a new download
+  const limit = Math.min(Math.max(PAGE_SIZE, historyItems.length), 500);
+  fetchHistory(null, limit)
+    .then((page) => {
+      historyItems = page.items;
+      historyCursor = page.next_cursor;
+      updateHistoryList(historyItems);
+    })
+    .catch((err) => console.error("Failed to load history:", err));
+}
+
+function loadMoreHistory() {
+  if (historyCursor === null) return;
+  fetchHistory(historyCursor, PAGE_SIZE)
+    .then((page) => {
+      historyItems = historyItems.concat(page.items);
+      historyCursor = page.next_cursor;
+      updateHistoryList(historyItems);
+    })
+    .catch((err) => console.error("Failed to load history:", err));
+}
+
+function setHistoryFilter(status) {
+  historyFilter = status;
+  historyItems = [];
+  reloadHistory();
+}
+
 function clearHistory() {
   apiFetch("/api/history/clear", { method: "POST" })
     .then((r) => r.json())
@@ -485,12 +609,21 @@ function loadSettings() {
       document.getElementById("setting-new-password").value = "";
 
       // Downloads
-      document.getElementById("setting-delay").value = config.downloads?.delay || 2;
+      document.getElementById("setting-delay").value = config.downloads?.delay ?? 2;
+      document.getElementById("setting-max-per-host").value = config.downloads?.max_per_host || 2;
+      document.getElementById("setting-breaker-failures").value = config.downloads?.breaker_failures ?? 3;
+      document.getElementById("setting-breaker-cooldown").value = config.downloads?.breaker_cooldown ?? 60;
       document.getElementById("setting-retry-count").value = config.downloads?.retry_count || 3;
       document.getElementById("setting-resume-attempts").value = config.downloads?.resume_attempts || 3;
       document.getElementById("setting-incomplete-folder-path").value = config.downloads?.incomplete_folder_path || "/download/incomplete";
+      document.getElementById("setting-incomplete-budget").value = config.downloads?.incomplete_budget ?? 5120;
       document.getElementById("setting-prefer-title-naming").checked = !!config.downloads?.prefer_title_naming;
       document.getElementById("setting-include-hash").value = config.downloads?.include_hash || "none";
+      document.getElementById("setting-min-speed").value = config.downloads?.min_speed ?? 10;
+      document.getElementById("setting-stall-window").value = config.downloads?.stall_window || 60;
+      document.getElementById("setting-chunk-size").value = config.downloads?.chunk_size || 1024;
+      document.getElementById("setting-page-cache-ttl").value = config.cache?.page_ttl ?? 24;
+      document.getElementById("setting-bandwidth-limit").value = config.bandwidth?.limit ?? 0;
 
       // Subdirectories (use tag input component)
       const subdirs = config.downloads?.subdirectories || [];
@@ -509,9 +642,13 @@ function loadSettings() {
 
       // Queue
       document.getElementById("setting-max-history").value = config.queue?.max_history || 100;
+      document.getElementById("setting-queue-fairness").value = config.queue?.fairness || "round_robin";
+      document.getElementById("setting-queue-scheduling").value = config.queue?.scheduling || "arrival";
 
       // Logging
       document.getElementById("setting-log-level").value = config.logging?.level || "WARNING";
+      document.getElementById("setting-log-format").value = config.logging?.format || "text";
+      document.getElementById("setting-log-keep-days").value = config.logging?.keep_days ?? 30;
     })
     .catch((err) => console.error("Failed to load settings:", err));
 }
@@ -525,9 +662,16 @@ function saveSettings() {
   const config = {
     downloads: {
       delay: parseInt(document.getElementById("setting-delay").value),
+      max_per_host: parseInt(document.getElementById("setting-max-per-host").value),
+      breaker_failures: parseInt(document.getElementById("setting-breaker-failures").value),
+      breaker_cooldown: parseInt(document.getElementById("setting-breaker-cooldown").value),
       retry_count: parseInt(document.getElementById("setting-retry-count").value),
       resume_attempts: parseInt(document.getElementById("setting-resume-attempts").value),
+      min_speed: parseInt(document.getElementById("setting-min-speed").value),
+      stall_window: parseInt(document.getElementById("setting-stall-window").value),
+      chunk_size: parseInt(document.getElementById("setting-chunk-size").value),
       incomplete_folder_path: document.getElementById("setting-incomplete-folder-path").value,
+      incomplete_budget: parseInt(document.getElementById("setting-incomplete-budget").value),
       prefer_title_naming: document.getElementById("setting-prefer-title-naming").checked,
       include_hash: document.getElementById("setting-include-hash").value,
       subdirectories: subdirectories,
@@ -541,11 +685,21 @@ function saveSettings() {
       url: document.getElementById("setting-flaresolverr-url").value || "http://localhost:8191",
       timeout: parseInt(document.getElementById("setting-flaresolverr-timeout").value) || 60,
     },
+    cache: {
+      page_ttl: parseInt(document.getElementById("setting-page-cache-ttl").value),
+    },
+    bandwidth: {
+      limit: parseInt(document.getElementById("setting-bandwidth-limit").value) || 0,
+    },
     queue: {
       max_history: parseInt(document.getElementById("setting-max-history").value),
+      fairness: document.getElementById("setting-queue-fairness").value,
+      scheduling: document.getElementById("setting-queue-scheduling").value,
     },
     logging: {
       level: document.getElementById("setting-log-level").value,
+      format: document.getElementById("setting-log-format").value,
+      keep_days: parseInt(document.getElementById("setting-log-keep-days").value),
     },
     login: {
       username: document.getElementById("setting-username").value,
@@ -768,10 +922,10 @@ function testFlaresolverr() {
 // UI UPDATE FUNCTIONS
 // ============================================================================
 
-function updateQueueList(queue) {
+function updateQueueList(queue, processing = []) {
   const queueList = document.getElementById("queue-list");
 
-  if (queue.length === 0) {
+  if (queue.length === 0 && processing.length === 0) {
     queueList.innerHTML = document.getElementById("queue-empty-template").innerHTML;
     return;
   }
@@ -782,13 +936,36 @@ function updateQueueList(queue) {
   // Get template
   const template = document.getElementById("queue-item-template");
 
+  // Finished downloads still being moved into place go first
+  processing.forEach((item) => {
+    const clone = template.content.cloneNode(true);
+
+    clone.querySelector(".item-title-text").textContent = item.filename || item.md5;
+    clone.querySelector(".item-md5").textContent = item.md5;
+    clone.querySelector(".item-time").textContent = item.status_message || "Processing...";
+
+    const subfolderTag = clone.querySelector(".item-subfolder");
+    if (item.subfolder) {
+      subfolderTag.textContent = item.subfolder.split("/").pop();
+      subfolderTag.style.display = "inline-block";
+    }
+
+    // Can't be removed or reordered while it's being moved
+    clone.querySelector(".item-actions").remove();
+
+    queueList.appendChild(clone);
+  });
+
   // Add each item
   queue.forEach((item) => {
     const clone = template.content.cloneNode(true);
 
     clone.querySelector(".item-title-text").textContent = item.md5;
     clone.querySelector(".item-md5").textContent = item.md5;
-    clone.querySelector(".item-time").textContent = "Added: " + formatTime(item.added_at);
+    const details = ["Added: " + formatTime(item.added_at)];
+    if (item.size) details.push(formatBytes(item.size));
+    if (item.eta) details.push("ETA " + formatEta(item.eta));
+    clone.querySelector(".item-time").textContent = details.join(" · ");
 
     // Show subfolder tag if present
     const subfolderTag = clone.querySelector(".item-subfolder");
@@ -797,6 +974,16 @@ function updateQueueList(queue) {
       subfolderTag.style.display = "inline-block";
     }
 
+    // Only show the priority when it isn't the default
+    const priorityTag = clone.querySelector(".item-priority");
+    if (item.priority && item.priority !== "normal") {
+      priorityTag.textContent = item.priority;
+      priorityTag.classList.add("visible", item.priority);
+    }
+
+    clone.querySelector(".move-top-btn").onclick = () => moveInQueue(item.md5, "top");
+    clone.querySelector(".move-bottom-btn").onclick = () => moveInQueue(item.md5, "bottom");
+
     const removeBtn = clone.querySelector(".btn-danger");
     removeBtn.onclick = () => removeFromQueue(item.md5);
 
@@ -804,8 +991,22 @@ function updateQueueList(queue) {
   });
 }
 
+function updateQueuePager(page) {
+  const pager = document.getElementById("queue-pager");
+  if (page.total <= PAGE_SIZE) {
+    pager.style.display = "none";
+    return;
+  }
+  pager.style.display = "flex";
+  const last = Math.min(page.offset + page.items.length, page.total);
+  document.getElementById("queue-page-info").textContent = `${page.offset + 1}–${last} of ${page.total}`;
+  document.getElementById("queue-prev-btn").disabled = page.offset === 0;
+  document.getElementById("queue-next-btn").disabled = last >= page.total;
+}
+
 function updateHistoryList(history) {
   const historyList = document.getElementById("history-list");
+  document.getElementById("history-more-btn").style.display = historyCursor === null ? "none" : "block";
 
   if (history.length === 0) {
     historyList.innerHTML = document.getElementById("history-empty-template").innerHTML;